@@ -1,6 +1,6 @@
 {
     'name': "Mercado Pago QR for Odoo POS",
-    'version': '18.0.1.0.0',
+    'version': '18.0.1.1.0',
     'summary': "Accept Mercado Pago QR payments in Odoo POS with real-time confirmation.",
     'category': "Point of Sale",
      "description": """
@@ -14,10 +14,16 @@ Optimized for LATAM markets.
     'author': "Hiroshi, WolfAIX",
     'website': "https://www.wolfaix.com",
     'depends': ['point_of_sale', 'account', 'pos_online_payment'],
+    'external_dependencies': {
+        'python': ['qrcode'],
+    },
     'data': [
         'security/ir.model.access.csv',
+        'data/mp_cron.xml',
         'views/mp_settings_view.xml',
         'views/pos_payment_method_view.xml',
+        'views/pos_config_view.xml',
+        'views/mp_transaction_report_views.xml',
     ],
     'assets': {
         "point_of_sale._assets_pos": [
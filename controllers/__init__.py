@@ -1,2 +1,3 @@
 from . import mp_api
+from . import mp_metrics
 from . import mp_webhook
@@ -1,11 +1,279 @@
-import json
+import logging
+import random
+import re
 import requests
-import urllib.parse
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from datetime import datetime, timedelta, timezone
 
 from odoo import http
 from odoo.http import request
 
+from .mp_cache import SingleFlight, TTLCache
+from .mp_client import get_client
+from .mp_guard import UpstreamUnavailable
+from .mp_metrics import metrics
+from .mp_qr import get_qr_image, qr_image_url, store_qr_image
+
+_logger = logging.getLogger(__name__)
+
+# Unpaid QRs expire after this many minutes (setting mp_tx_expire_minutes): locally by the
+# sweeper cron, and in MercadoPago through the expiration date of the preference
+DEFAULT_EXPIRE_MINUTES = 60
+
+# Lifetime of an order put on the fixed QR of a POS (static QR mode), in seconds.
+# Shorter than the 30 minutes after which webhooks for a transaction are ignored.
+INSTORE_ORDER_TTL = 20 * 60
+
+# Upper bound of concurrent payment searches in one batch status check
+MAX_CONCURRENT_SEARCHES = 8
+# Read timeout (seconds) of the searches of status checks: the POS polls again anyway,
+# so a slow MercadoPago must not hold the worker for the full mp_http_read_timeout
+STATUS_CHECK_TIMEOUT = 5
+# Status check searches only return payments created since the transaction (minus this
+# margin for clock differences with MercadoPago), newest first, at most SEARCH_LIMIT
+SEARCH_LIMIT = 10
+SEARCH_CLOCK_MARGIN = timedelta(minutes=1)
+
+FINAL_STATUSES = ('approved', 'rejected', 'cancelled', 'expired')
+
+# External reference of each QR created for a POS order: "<order uid>.<first 8 characters of
+# the payment line uuid, "pre" for a pre-created QR>.<attempt>", unique to one transaction
+_ATTEMPT_REFERENCE_RE = re.compile(r"\.[0-9A-Za-z-]{1,8}\.\d+$")
+
+
+def attempt_reference(order_uid, line_uuid, attempt):
+    """External reference of the attempt-th QR of a POS order (see mp.transaction._mp_attempt_reference)."""
+    return f"{order_uid}.{line_uuid[:8] if line_uuid else 'pre'}.{attempt}"
+
+
+def qr_expire_minutes(env):
+    """Minutes after which an unpaid QR expires (setting mp_tx_expire_minutes)."""
+    return int(env['ir.config_parameter'].sudo().get_param('mp_tx_expire_minutes') or DEFAULT_EXPIRE_MINUTES)
+
+
+def is_attempt_reference(reference):
+    """True for a per-attempt reference, False for the order names used before them."""
+    return bool(reference and _ATTEMPT_REFERENCE_RE.search(reference))
+
+# Preference creation: attempts (same X-Idempotency-Key) for timeouts, network
+# errors and 5xx, within an overall time budget, each with a short read timeout
+PREFERENCE_MAX_ATTEMPTS = 3
+PREFERENCE_TIME_BUDGET = 15
+PREFERENCE_ATTEMPT_TIMEOUT = 6
+# Hedged request: sent after the p95 of recent creations, within these bounds (seconds)
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MAX_DELAY = 4.0
+HEDGE_DEFAULT_DELAY = 1.5   # until HEDGE_MIN_SAMPLES creations were timed
+HEDGE_MIN_SAMPLES = 20
+
+# Latencies (seconds) of the last successful preference creations of this worker
+_preference_latencies = deque(maxlen=200)
+
+# /users/me validation of the access token, keyed by (dbname, company_id) and bound to the
+# token value. The token itself is read through ir.config_parameter, whose ormcache is
+# cleared in every worker when the settings are saved.
+TOKEN_VALIDATION_TTL = 6 * 3600     # Successful /users/me validation
+TOKEN_INVALID_TTL = 60              # Rejected token, re-checked after this delay
+
+_token_validation_cache = TTLCache(maxsize=256, ttl=TOKEN_VALIDATION_TTL)
+
+
+# Last known status per (dbname, preference_id). Non-final statuses are only
+# trusted for STATUS_CACHE_TTL seconds; final ones stay until LRU eviction.
+STATUS_CACHE_TTL = 2
+STATUS_CACHE_SIZE = 4096
+
+_status_cache = TTLCache(maxsize=STATUS_CACHE_SIZE, ttl=STATUS_CACHE_TTL)
+# Concurrent polls of the same reference (tabs, terminals, retries) share one upstream search
+_status_flight = SingleFlight()
+
+
+# Creation time (epoch) of the transaction behind each preference, for poll hints
+_qr_created_cache = TTLCache(maxsize=STATUS_CACHE_SIZE)
+
+# Webhooks count as working when a notification was queued within this window (seconds)
+WEBHOOK_HEALTHY_WINDOW = 600
+
+# Bounds (seconds) of the retry_after hint returned to the POS
+MIN_RETRY_AFTER = 2
+MAX_RETRY_AFTER = 30
+
+
+def poll_conditions(env):
+    """
+    Inputs of poll_retry_after that do not depend on the payment, read once per status check.
+
+    Webhook health comes from the database (last queued notification, whichever
+    worker received it), upstream health from this worker's client and the
+    back-off from the server-wide guard (see mp_guard).
+
+    Returns:
+        dict: {"webhooks_healthy": bool, "health": dict (MPClient.health()), "backoff": float (seconds)}
+    """
+    last_event = env['mp.webhook.event'].sudo().search([], order='id desc', limit=1)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    client = get_client()
+    return {
+        "webhooks_healthy": bool(last_event) and (now - last_event.create_date).total_seconds() < WEBHOOK_HEALTHY_WINDOW,
+        "health": client.health(),
+        "backoff": client.guard.status()["retry_after"],
+    }
+
+
+def poll_retry_after(conditions, created_at=None):
+    """
+    Seconds the POS should wait before its next status check.
+
+    Based on the age of the QR (customers pay within the first minute or never),
+    on webhook health (when webhooks arrive, polling is only a safety net), on
+    the upstream 429/5xx rate seen by this worker and on the server-wide
+    back-off (open circuit or 429 Retry-After, see mp_guard).
+
+    Args:
+        conditions: Result of poll_conditions, shared by the payments of a batch
+        created_at: Creation time (epoch) of the transaction, if known
+    """
+    now = time.time()
+    age = now - created_at if created_at else 60
+    if age < 30:
+        delay = MIN_RETRY_AFTER
+    elif age < 120:
+        delay = 4
+    elif age < 600:
+        delay = 8
+    else:
+        delay = 15
+
+    if conditions["webhooks_healthy"]:
+        delay *= 2
+
+    health = conditions["health"]
+    backoff = conditions["backoff"]
+    if backoff or health["throttled"]:
+        # Status checks are answered from the database meanwhile: no need to ask often
+        delay = max(delay * 3, backoff, 10)
+    elif health["requests"] and health["errors"] / health["requests"] > 0.2:
+        delay *= 2
+
+    return int(min(max(delay, MIN_RETRY_AFTER), MAX_RETRY_AFTER))
+
+
+def cache_payment_status(dbname, payment_id, result):
+    """Store the last known status of a preference (write-through from webhook and polls)."""
+    if not payment_id:
+        return
+    ttl = None if result.get("payment_status") in FINAL_STATUSES else STATUS_CACHE_TTL
+    _status_cache.set((dbname, payment_id), result, ttl=ttl)
+
+
+def _credentials_key(env):
+    return (env.cr.dbname, env.company.id)
+
+
+# MercadoPago dates: "2024-01-01T12:00:00.000-04:00" (fraction and offset optional, "Z" for UTC)
+_MP_DATETIME_RE = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,9}))?(Z|[+-]\d{2}:?\d{2})?$"
+)
+_MP_TIMEZONES = {None: timezone.utc, "Z": timezone.utc}
+
+
+def _parse_mp_datetime(value):
+    """
+    Parse a MercadoPago date ("2024-01-01T12:00:00.000-04:00") into an aware UTC datetime.
+    Returns None if the value can't be parsed (the payment is then skipped - too risky).
+
+    One compiled regular expression and a cache of the (few) UTC offsets seen:
+    called for every result of the payment searches.
+    """
+    match = _MP_DATETIME_RE.match(value) if isinstance(value, str) else None
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    tz = _MP_TIMEZONES.get(offset)
+    if tz is None:
+        sign = -1 if offset[0] == "-" else 1
+        digits = offset[1:].replace(":", "")
+        tz = _MP_TIMEZONES[offset] = timezone(sign * timedelta(hours=int(digits[:2]), minutes=int(digits[2:])))
+    try:
+        return datetime(
+            int(year), int(month), int(day), int(hour), int(minute), int(second),
+            int(fraction[:6].ljust(6, "0")) if fraction else 0, tzinfo=tz,
+        ).astimezone(timezone.utc)
+    except (ValueError, OverflowError):
+        return None
+
+
+class PaymentIndex:
+    """
+    Results of a payment search, indexed once for all the preferences matched against them.
+
+    Payments with a preference ID are looked up by it; only the others (in-store
+    orders, old payment formats) are kept by external_reference. A per-attempt
+    reference belongs to a single transaction, so its newest payment matches;
+    an order name (references created before them) is shared by every QR of
+    the order, and the creation date of its payments is then parsed, the first
+    time a match needs it. Results are expected newest first.
+    """
+    __slots__ = ("by_preference", "by_reference", "_dates")
+
+    def __init__(self, results):
+        self.by_preference = {}
+        self.by_reference = defaultdict(list)   # external_reference -> [payment without preference ID]
+        self._dates = {}                        # id(payment) -> parsed date_created
+        for payment in results:
+            preference_id = payment.get("preference_id")
+            if preference_id:
+                self.by_preference.setdefault(str(preference_id), payment)
+            else:
+                self.by_reference[payment.get("external_reference")].append(payment)
+
+    def _date_created(self, payment):
+        key = id(payment)
+        if key not in self._dates:
+            self._dates[key] = _parse_mp_datetime(payment.get("date_created"))
+        return self._dates[key]
+
+    def match(self, payment_id, external_reference, transaction_date):
+        """
+        Find our payment - STRICT matching to avoid old payments.
+
+        Priority: preference_id (unique) > external_reference (only for payments
+        without preference_id; created after our transaction unless the reference
+        is a per-attempt one)
+
+        Args:
+            payment_id: Preference ID stored on the transaction
+            external_reference: External reference of the transaction
+            transaction_date: Creation date of the local transaction (naive UTC), or None
+
+        Returns:
+            dict: The matching payment, or None
+        """
+        payment = self.by_preference.get(str(payment_id))
+        if payment:
+            return payment
+        if is_attempt_reference(external_reference):
+            # Only ever used by our transaction: no date check needed
+            return next(iter(self.by_reference.get(external_reference, ())), None)
+        if not transaction_date:
+            return None
+        if transaction_date.tzinfo:
+            transaction_date = transaction_date.astimezone(timezone.utc)
+        else:
+            # Odoo stores naive datetime in UTC by default
+            transaction_date = transaction_date.replace(tzinfo=timezone.utc)
+        for payment in self.by_reference.get(external_reference, ()):
+            # Only accept if payment was created after our transaction
+            # This ensures we don't match old payments from previous orders
+            payment_date = self._date_created(payment)
+            if payment_date and payment_date >= transaction_date:
+                return payment
+        return None
+
 
 class MPApiController(http.Controller):
     """
@@ -15,18 +283,68 @@ class MPApiController(http.Controller):
     - Model methods (via delegation)
     - HTTP routes (for external access)
     - Webhook handlers
+
+    All upstream calls go through the per-worker pooled client (see mp_client).
+    Helper methods accept an optional ``env`` so models can call them with
+    their own environment; HTTP routes fall back to ``request.env``.
     """
 
-    def _get_access_token(self):
+    def _get_access_token(self, env=None):
         """
         Get MercadoPago Access Token from system parameters.
         Supports both naming conventions: mp_access_token and mp.access.token
+
+        get_param is ormcached, and the cache is invalidated in all the workers
+        (and cron processes) when a parameter is written, so a changed or revoked
+        token is never used after the settings are saved.
         """
-        config = request.env['ir.config_parameter'].sudo()
+        env = env or request.env
+        config = env['ir.config_parameter'].sudo()
         token_raw = config.get_param("mp_access_token") or config.get_param("mp.access.token")
-        
         return token_raw.strip() if token_raw else None
 
+    def _get_token_validation(self, token, env=None):
+        """
+        Cached variant of _validate_access_token.
+
+        A successful validation is reused for TOKEN_VALIDATION_TTL seconds and a
+        rejected token for TOKEN_INVALID_TTL seconds. Network failures are never
+        cached. The cached entry is bound to the token value, so a new token is
+        always validated again.
+        """
+        env = env or request.env
+        key = _credentials_key(env)
+        cached = _token_validation_cache.get(key)
+        if cached and cached[0] == token:
+            return cached[1]
+
+        validation = self._validate_access_token(token)
+        self._store_token_validation(key, token, validation)
+        return validation
+
+    def _store_token_validation(self, key, token, validation):
+        if validation.get("valid"):
+            _token_validation_cache.set(key, (token, validation))
+        elif not validation.get("transient"):
+            _token_validation_cache.set(key, (token, validation), ttl=TOKEN_INVALID_TTL)
+
+    def _revalidate_token_async(self, env, token):
+        """
+        Called when MercadoPago answers 401: drop the cached validation and
+        validate the token again in a background thread, so the next QR fails
+        fast (or succeeds) without an extra round trip at the till.
+        """
+        key = _credentials_key(env)
+        _token_validation_cache.pop(key)
+
+        def _revalidate():
+            validation = self._validate_access_token(token)
+            self._store_token_validation(key, token, validation)
+            if not validation.get("valid"):
+                _logger.warning("[MP] Access token rejected for %s: %s", key, validation.get("error"))
+
+        threading.Thread(target=_revalidate, name="mp-token-revalidate", daemon=True).start()
+
     def _validate_access_token(self, token):
         """
         Validates MercadoPago access token using /users/me API.
@@ -36,16 +354,12 @@ class MPApiController(http.Controller):
                 "valid": bool,
                 "token_type": "test" or "production",
                 "user_id": str or None,
-                "error": str or None
+                "error": str or None,
+                "transient": bool (network error, result should not be cached)
             }
         """
-        url = "https://api.mercadopago.com/users/me"
-        headers = {
-            "Authorization": f"Bearer {token}",
-        }
-        
         try:
-            response = requests.get(url, headers=headers, timeout=10)
+            response = get_client().get("/users/me", token=token)
             
             if response.status_code == 200:
                 data = response.json()
@@ -66,6 +380,7 @@ class MPApiController(http.Controller):
                     "token_type": None,
                     "user_id": None,
                     "error": error_msg,
+                    "transient": response.status_code == 429 or response.status_code >= 500,
                 }
         except Exception as e:
             return {
@@ -73,9 +388,11 @@ class MPApiController(http.Controller):
                 "token_type": None,
                 "user_id": None,
                 "error": str(e),
+                "transient": True,
             }
 
-    def _create_mp_preference(self, amount, description, external_reference, customer_email=None):
+    def _create_mp_preference(self, amount, description, external_reference, customer_email=None, env=None,
+                              tx_vals=None):
         """
         Creates a MercadoPago Checkout Preference and returns QR code.
         
@@ -90,6 +407,8 @@ class MPApiController(http.Controller):
             description: Payment description (order name)
             external_reference: External reference for the order
             customer_email: Optional customer email from POS partner
+            env: Optional Odoo environment (defaults to request.env)
+            tx_vals: Optional extra values for the mp.transaction record (e.g. pos_session_id)
         
         Returns:
             dict: {
@@ -99,8 +418,10 @@ class MPApiController(http.Controller):
                 "details": str (error message if status="error")
             }
         """
+        env = env or request.env
+
         # 1. Get Access Token
-        token = self._get_access_token()
+        token = self._get_access_token(env)
         
         if not token:
             return {
@@ -108,8 +429,8 @@ class MPApiController(http.Controller):
                 "details": "Falta el Access Token de MercadoPago - Configure en Ajustes",
             }
         
-        # 2. Validate token
-        token_validation = self._validate_access_token(token)
+        # 2. Validate token (cached, see _get_token_validation)
+        token_validation = self._get_token_validation(token, env)
         if not token_validation.get("valid"):
             return {
                 "status": "error",
@@ -123,30 +444,22 @@ class MPApiController(http.Controller):
                 "details": "Error: Se está usando PUBLIC_KEY en lugar de ACCESS_TOKEN. Use el ACCESS_TOKEN (más largo) para llamadas API.",
             }
         
-        # 4. Prepare the Checkout Preferences API request
-        url = "https://api.mercadopago.com/checkout/preferences"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {token}",
-        }
-        
-        # 5. Build payload for Checkout Preferences
-        # Using items array with category_id for better approval rates (reduces fraud warnings)
+        # 4. Build payload for Checkout Preferences. It expires with the local transaction
+        # (sweeper cron): paid after that, no open transaction would ever record the payment
+        expiration = datetime.now(timezone.utc) + timedelta(minutes=qr_expire_minutes(env))
         payload = {
-            "items": [{
-                "title": description or "Venta POS Odoo",
-                "quantity": 1,
-                "unit_price": float(amount),
-                "currency_id": "ARS",  # Argentina Peso
-                "category_id": "services",  # Reduces fraud detection false positives
-            }],
+            "items": self._preference_items(amount, description),
             "external_reference": external_reference,
+            "expires": True,
+            "expiration_date_to": expiration.isoformat(timespec="milliseconds"),
         }
         
-        # 6. Make API request
+        # 5. Make API request: retried and optionally hedged under one idempotency key,
+        # so MercadoPago creates a single preference however many requests are sent
+        idempotency_key = self._preference_idempotency_key(env, amount, external_reference, tx_vals)
+        hedge = env['ir.config_parameter'].sudo().get_param("mp_preference_hedging") == "True"
         try:
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            response = self._post_preference(token, payload, idempotency_key, hedge=hedge)
             
             try:
                 data = response.json()
@@ -154,6 +467,7 @@ class MPApiController(http.Controller):
                 data = {"raw": response.text}
             
             if response.status_code == 401:
+                self._revalidate_token_async(env, token)
                 return {
                     "status": "error",
                     "error": "unauthorized",
@@ -169,42 +483,18 @@ class MPApiController(http.Controller):
                     "details": error_msg,
                 }
 
-            # 7. Extract QR code from preference response
+            # 6. Extract QR code from preference response
             preference_id = data.get("id")
-            qr_data = ""
-            
-            # Try to get QR code from preference response - check all possible locations
-            
-            # 1. Check root level qr_code_base64 and qr_code
-            qr_code_base64 = data.get("qr_code_base64", "")
-            qr_code = data.get("qr_code", "")
-            
-            # 2. Check in point_of_interaction.transaction_data
-            point_of_interaction = data.get("point_of_interaction", {})
-            if point_of_interaction:
-                transaction_data = point_of_interaction.get("transaction_data", {})
-                if transaction_data:
-                    if not qr_code_base64:
-                        qr_code_base64 = transaction_data.get("qr_code_base64", "")
-                    if not qr_code:
-                        qr_code = transaction_data.get("qr_code", "")
-            
-            # 3. Check init_point (payment link) - can be converted to QR
-            init_point = data.get("init_point", "")
-            sandbox_init_point = data.get("sandbox_init_point", "")  # For test mode
-            
-            # Build QR image URL - try in order of preference
-            if qr_code_base64:
-                qr_data = f"data:image/png;base64,{qr_code_base64}"
-            elif qr_code:
-                qr_encoded = urllib.parse.quote(qr_code, safe='')
-                qr_data = f"https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={qr_encoded}"
-            elif init_point:
-                qr_encoded = urllib.parse.quote(init_point, safe='')
-                qr_data = f"https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={qr_encoded}"
-            elif sandbox_init_point:
-                qr_encoded = urllib.parse.quote(sandbox_init_point, safe='')
-                qr_data = f"https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={qr_encoded}"
+            qr_payload, qr_code_base64 = self._extract_qr(data)
+
+            # The image itself is served by /mp/pos/qr/<preference_id> (rendered locally
+            # from the payload, see mp_qr), so the RPC response only carries its URL.
+            if qr_payload:
+                qr_data = qr_image_url(preference_id)
+            elif qr_code_base64:
+                # Only a pre-rendered PNG: keep it in the image store and on the transaction
+                store_qr_image(env.cr.dbname, preference_id, png_base64=qr_code_base64)
+                qr_data = qr_image_url(preference_id)
             else:
                 return {
                     "status": "error", 
@@ -212,18 +502,25 @@ class MPApiController(http.Controller):
                     "preference_id": preference_id
                 }
             
-            # 8. Log transaction in database (optional, for tracking)
-            try:
-                request.env['mp.transaction'].sudo().create({
-                    "external_reference": external_reference,
-                    "mp_payment_id": str(preference_id),  # Store preference ID
-                    "qr_data": qr_code or qr_code_base64[:100] if qr_code_base64 else "",
-                    "status": "initial",  # Initial state: QR created, not yet scanned
-                    "raw_data": json.dumps(data),
-                    "amount": amount,
-                })
-            except Exception as e:
-                pass  
+            # 7. Log transaction in database (optional, for tracking). A retried or hedged
+            # request may get back a preference already stored (idempotency key): keep that one
+            Transaction = env['mp.transaction'].sudo()
+            if not Transaction.search_count([('mp_payment_id', '=', str(preference_id))], limit=1):
+                try:
+                    # Savepoint: a failed insert (e.g. a concurrent one, mp_payment_id is unique)
+                    # must not abort the transaction of the whole RPC
+                    with env.cr.savepoint():
+                        Transaction.create({
+                            "external_reference": external_reference,
+                            "mp_payment_id": str(preference_id),  # Store preference ID
+                            "qr_data": qr_payload,
+                            "qr_image": qr_code_base64 if not qr_payload else False,
+                            "status": "initial",  # Initial state: QR created, not yet scanned
+                            "amount": amount,
+                            **(tx_vals or {}),
+                        })
+                except Exception as e:
+                    _logger.warning("[MP] Could not store the transaction of preference %s: %s", preference_id, e)
 
             return {
                 "status": "success",
@@ -239,224 +536,664 @@ class MPApiController(http.Controller):
         except Exception as e:
             return {"status": "error", "details": str(e)}
 
-    def _check_mp_payment_status(self, payment_id, external_reference=None):
+    def _preference_idempotency_key(self, env, amount, external_reference, tx_vals=None):
+        """
+        X-Idempotency-Key of a preference creation, derived from the POS order,
+        payment line and amount: a cashier retrying after a timeout gets the
+        preference MercadoPago already created instead of a duplicate.
+
+        The number of transactions the line (or the order's pre-created QR)
+        already had is part of the key, so a new QR requested after the previous
+        one was cancelled or expired is a new preference. A per-attempt
+        reference already carries it.
+        """
+        if is_attempt_reference(external_reference):
+            name = f"{env.cr.dbname}:{external_reference}:{float(amount):.2f}"
+            return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+
+        vals = tx_vals or {}
+        order_uid = vals.get("pos_order_uid")
+        line_uuid = vals.get("pos_payment_line_uuid")
+        if not order_uid or not (line_uuid or vals.get("prewarmed")):
+            # Nothing stable to derive it from: still shared by the retries of this call
+            return str(uuid.uuid4())
+
+        if line_uuid:
+            domain = [('pos_payment_line_uuid', '=', line_uuid)]
+        else:
+            domain = [('pos_order_uid', '=', order_uid), ('prewarmed', '=', True)]
+        previous = env['mp.transaction'].sudo().search_count(domain)
+        name = f"{env.cr.dbname}:{order_uid}:{line_uuid or 'prewarm'}:{external_reference}:{float(amount):.2f}:{previous}"
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+
+    def _post_preference(self, token, payload, idempotency_key, hedge=False):
+        """
+        POST /checkout/preferences with bounded retries and an optional hedged request.
+
+        Timeouts, network errors and 5xx responses are retried (at most
+        PREFERENCE_MAX_ATTEMPTS, within PREFERENCE_TIME_BUDGET seconds). All the
+        requests carry the same X-Idempotency-Key, which makes them safe.
+        Requests not sent by the guard (UpstreamUnavailable) are not retried.
+
+        Returns:
+            requests.Response: First non-5xx response, or the last 5xx one
+
+        Raises:
+            requests.exceptions.RequestException: No response within the budget
+        """
+        deadline = time.monotonic() + PREFERENCE_TIME_BUDGET
+        headers = {"X-Idempotency-Key": idempotency_key}
+
+        def _send(timeout):
+            start = time.monotonic()
+            response = get_client().post(
+                "/checkout/preferences", token=token, json=payload, headers=headers, timeout=timeout
+            )
+            if response.status_code < 500:
+                _preference_latencies.append(time.monotonic() - start)
+            return response
+
+        response = error = None
+        for attempt in range(PREFERENCE_MAX_ATTEMPTS):
+            timeout = min(PREFERENCE_ATTEMPT_TIMEOUT, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+            if attempt:
+                metrics.inc("mp_preference_retries_total")
+                _logger.info("[MP] Retrying preference creation (%s), attempt %s", error or
+                             f"HTTP {response.status_code}", attempt + 1)
+            try:
+                response = self._send_hedged(_send, timeout) if hedge else _send(timeout)
+                error = None
+            except UpstreamUnavailable:
+                raise
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                error = e
+            else:
+                if response.status_code < 500:
+                    return response
+            # Short jittered pause, unless it would eat the rest of the budget
+            pause = random.uniform(0.1, 0.3) * (attempt + 1)
+            if attempt + 1 == PREFERENCE_MAX_ATTEMPTS or deadline - time.monotonic() <= pause:
+                break
+            time.sleep(pause)
+
+        if response is not None and error is None:
+            return response
+        raise error or requests.exceptions.Timeout("Preference creation time budget exhausted")
+
+    def _send_hedged(self, send, timeout):
+        """
+        Send a request and, if it has not answered after the p95 latency of recent
+        preference creations, a second identical one; the first successful answer wins.
+
+        Args:
+            send: Callable(timeout) sending the request (HTTP only, runs in threads)
+            timeout: Read timeout of each request
+        """
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="mp-hedge")
+        try:
+            futures = [executor.submit(send, timeout)]
+            done, _pending = wait(futures, timeout=self._hedge_delay())
+            if not done:
+                metrics.inc("mp_preference_hedged_total")
+                futures.append(executor.submit(send, timeout))
+
+            # A 2xx wins right away; a 4xx (e.g. 409 while the other request creates the
+            # preference) only once both have answered, then preferred to a 5xx
+            responses, error = [], None
+            for future in as_completed(futures):
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    error = e
+                    continue
+                if response.status_code < 300:
+                    return response
+                responses.append(response)
+            if responses:
+                return min(responses, key=lambda response: response.status_code >= 500)
+            raise error
+        finally:
+            # The slower request is not waited for; its answer is the same preference anyway
+            executor.shutdown(wait=False)
+
+    def _hedge_delay(self):
+        """p95 latency (seconds) of the recent preference creations of this worker, bounded."""
+        latencies = sorted(_preference_latencies)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return min(max(p95, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+    def _instore_orders_path(self, user_id, external_pos_id):
+        return f"/instore/qr/seller/collectors/{user_id}/pos/{external_pos_id}/orders"
+
+    def _create_mp_instore_order(self, amount, description, external_reference, external_pos_id, env=None,
+                                 tx_vals=None):
+        """
+        Put an order on the fixed QR of a MercadoPago POS (static QR mode).
+
+        Uses PUT /instore/qr/seller/collectors/{user_id}/pos/{external_pos_id}/orders:
+        the customer scans the QR printed at the counter and pays the order last
+        put on that POS. One upstream call and no QR image; the payment is then
+        found by external_reference (polls, webhooks) like a preference payment.
+
+        Args:
+            amount: Payment amount (float)
+            description: Payment description (order name)
+            external_reference: External reference for the order
+            external_pos_id: External ID of the MercadoPago POS bound to the pos.config
+            env: Optional Odoo environment (defaults to request.env)
+            tx_vals: Optional extra values for the mp.transaction record (e.g. pos_session_id)
+
+        Returns:
+            dict: {
+                "status": "success" or "error",
+                "payment_id": str (local ID of the order, used for status checking),
+                "qr_data": False (nothing to display, the QR is printed),
+                "static_qr": True,
+                "details": str (error message if status="error")
+            }
+        """
+        env = env or request.env
+
+        token = self._get_access_token(env)
+        if not token:
+            return {
+                "status": "error",
+                "details": "Falta el Access Token de MercadoPago - Configure en Ajustes",
+            }
+
+        # The collector (user_id) comes from the cached /users/me validation
+        token_validation = self._get_token_validation(token, env)
+        if not token_validation.get("valid") or not token_validation.get("user_id"):
+            return {
+                "status": "error",
+                "details": f"Token inválido: {token_validation.get('error', 'Error desconocido')}",
+            }
+
+        title = description or "Venta POS Odoo"
+        expiration = datetime.now(timezone.utc) + timedelta(seconds=INSTORE_ORDER_TTL)
+        payload = {
+            "external_reference": external_reference,
+            "title": title,
+            "description": title,
+            "total_amount": float(amount),
+            "expiration_date": expiration.isoformat(timespec="milliseconds"),
+            "items": [{
+                "title": title,
+                "unit_price": float(amount),
+                "quantity": 1,
+                "unit_measure": "unit",
+                "total_amount": float(amount),
+            }],
+        }
+
+        try:
+            response = get_client().put(
+                self._instore_orders_path(token_validation["user_id"], external_pos_id), token=token, json=payload
+            )
+        except requests.exceptions.Timeout:
+            return {"status": "error", "details": "Timeout de conexión con MercadoPago"}
+        except requests.exceptions.RequestException as e:
+            return {"status": "error", "details": f"Error de conexión: {str(e)}"}
+
+        if response.status_code == 401:
+            self._revalidate_token_async(env, token)
+            return {
+                "status": "error",
+                "error": "unauthorized",
+                "details": "Mercado Pago rechazó el token (401). Verifique que está usando ACCESS_TOKEN (no PUBLIC_KEY) y que es correcto para su ambiente (test vs producción).",
+            }
+        if response.status_code >= 400:
+            try:
+                error_msg = response.json().get("message", response.text)
+            except ValueError:
+                error_msg = response.text
+            return {
+                "status": "error",
+                "error": "mp_error",
+                "error_code": response.status_code,
+                "details": error_msg,
+            }
+
+        # In-store orders have no preference: the transaction gets a local ID instead
+        payment_id = f"instore-{uuid.uuid4().hex}"
+        env['mp.transaction'].sudo().create({
+            "external_reference": external_reference,
+            "mp_payment_id": payment_id,
+            "mp_external_pos_id": external_pos_id,
+            "status": "initial",
+            "amount": amount,
+            **(tx_vals or {}),
+        })
+        return {
+            "status": "success",
+            "payment_id": payment_id,
+            "qr_data": False,
+            "static_qr": True,
+        }
+
+    def _delete_mp_instore_order(self, external_pos_id, env=None):
+        """
+        Remove the order waiting on the fixed QR of a POS, so the next customer
+        scanning it does not pay a cancelled sale.
+
+        Returns:
+            bool: True if MercadoPago acknowledged the deletion
+        """
+        env = env or request.env
+        token = self._get_access_token(env)
+        token_validation = self._get_token_validation(token, env) if token else {}
+        if not token_validation.get("user_id"):
+            return False
+        try:
+            response = get_client().delete(
+                self._instore_orders_path(token_validation["user_id"], external_pos_id), token=token
+            )
+        except requests.exceptions.RequestException as e:
+            _logger.warning("[MP] Could not remove the order of POS %s: %s", external_pos_id, e)
+            return False
+        return response.status_code < 400
+
+    def _preference_items(self, amount, description):
+        """Items of a preference. category_id gives better approval rates (fewer fraud warnings)."""
+        return [{
+            "title": description or "Venta POS Odoo",
+            "quantity": 1,
+            "unit_price": float(amount),
+            "currency_id": "ARS",  # Argentina Peso
+            "category_id": "services",  # Reduces fraud detection false positives
+        }]
+
+    def _extract_qr(self, data):
+        """
+        Find the QR content in a preference response.
+
+        Returns:
+            tuple: (payload to render - qr_code, init_point or sandbox_init_point - or "",
+                    pre-rendered PNG in base64 or "")
+        """
+        # 1. Check root level qr_code_base64 and qr_code
+        qr_code_base64 = data.get("qr_code_base64", "")
+        qr_code = data.get("qr_code", "")
+
+        # 2. Check in point_of_interaction.transaction_data
+        transaction_data = (data.get("point_of_interaction") or {}).get("transaction_data") or {}
+        qr_code_base64 = qr_code_base64 or transaction_data.get("qr_code_base64", "")
+        qr_code = qr_code or transaction_data.get("qr_code", "")
+
+        # 3. init_point (payment link) can be rendered as a QR; sandbox_init_point in test mode
+        return qr_code or data.get("init_point", "") or data.get("sandbox_init_point", ""), qr_code_base64
+
+    def _update_mp_preference_amount(self, tx, amount, description, env=None):
+        """
+        Change the amount of an open preference in place (PUT /checkout/preferences/{id}).
+
+        Only used when the QR is unchanged by the update: the image URL of a
+        preference is cached as immutable by the POS browsers.
+
+        Args:
+            tx: mp.transaction of the preference (status "initial")
+            amount: New payment amount
+            description: Payment description (order name)
+            env: Optional Odoo environment (defaults to request.env)
+
+        Returns:
+            bool: True if the preference was updated and tx.amount written
+        """
+        env = env or request.env
+        token = self._get_access_token(env)
+        if not token:
+            return False
+        try:
+            response = get_client().put(
+                f"/checkout/preferences/{tx.mp_payment_id}", token=token,
+                json={"items": self._preference_items(amount, description)},
+            )
+        except requests.exceptions.RequestException as e:
+            _logger.info("[MP] Preference %s update failed: %s", tx.mp_payment_id, e)
+            return False
+
+        if response.status_code == 401:
+            self._revalidate_token_async(env, token)
+        if response.status_code != 200:
+            _logger.info("[MP] Preference %s update rejected: HTTP %s", tx.mp_payment_id, response.status_code)
+            return False
+
+        try:
+            qr_payload, _qr_code_base64 = self._extract_qr(response.json())
+        except ValueError:
+            return False
+        # A QR that changed needs a new image URL: the caller creates a new preference instead
+        if not qr_payload or qr_payload != tx.qr_data:
+            return False
+        tx.sudo().write({"amount": amount})
+        return True
+
+    def _check_mp_payment_status(self, payment_id, external_reference=None, env=None):
         """
         Check status of a payment by polling MercadoPago API.
-        
+
         Uses flexible matching:
         1. Primary: Match by preference_id (payment_id is actually a preference_id)
         2. Fallback: Match by external_reference if preference_id not available
-        
+
         This ensures the POS detects payments even if MercadoPago doesn't include
         preference_id in the payment object.
         """
-        token = self._get_access_token()
-        
-        # 1. Retrieve the local transaction record
-        tx = request.env['mp.transaction'].sudo().search([('mp_payment_id', '=', payment_id)], limit=1)
-        
-        if not token:
-            # If no token, check DB status
-            if tx:
-                # Treat "initial" and "pending" as "pending" for polling
-                if tx.status in ('initial', 'pending'):
-                    return {"payment_status": "pending"}
-                return {"payment_status": tx.status}
-            return {"payment_status": "pending"}
-        
-        # 2. Use external_reference from parameter or transaction as a search filter
-        if not external_reference and tx:
-            external_reference = tx.external_reference
-        
-        # 3. SAFETY CHECK: Only search API if we have a way to filter results
-        # We need either preference_id (payment_id) OR external_reference to safely identify our payment
-        # Without a filter, searching would return ALL recent payments and could match unrelated approved payments
-        if not payment_id and not external_reference:
-            # No way to safely identify our payment - check DB only and return pending
-            if tx:
-                # Treat "initial" and "pending" as "pending" for polling
-                if tx.status in ('initial', 'pending'):
-                    return {"payment_status": "pending"}
-                # If DB has final status, return it (webhook updated it)
-                if tx.status in ('approved', 'rejected', 'cancelled'):
-                    return {"payment_status": tx.status}
-                return {"payment_status": "pending"}
+        results = self._check_mp_payment_status_batch(
+            [{"payment_id": payment_id, "external_reference": external_reference}],
+            env=env,
+        )
+        return results.get(payment_id) or {"payment_status": "pending"}
+
+    def _check_mp_payment_status_batch(self, payments, env=None):
+        """
+        Check the status of many payments at once.
+
+        All local transactions are read with a single query. Payments already in
+        a final state are answered from the database; only the unresolved ones
+        are looked up in MercadoPago, with one search per distinct
+        external_reference, run concurrently on the pooled client.
+
+        Args:
+            payments: list of {"payment_id": preference ID, "external_reference": str or None}
+            env: Optional Odoo environment (defaults to request.env)
+
+        Returns:
+            dict: {payment_id: {"payment_status": str, "status_detail": str, "payment_id": str,
+                                "retry_after": int (seconds, only while not final)}}
+        """
+        env = env or request.env
+        dbname = env.cr.dbname
+
+        # 1. Answer from the short-TTL status cache when possible
+        results = {}
+        uncached = []
+        for entry in payments:
+            cached = _status_cache.get((dbname, entry.get("payment_id")))
+            if cached is not None:
+                results[entry.get("payment_id")] = cached
+            else:
+                uncached.append(entry)
+        if results:
+            metrics.inc("mp_status_checks_total", len(results), source="cache")
+        if not uncached:
+            return self._add_retry_hints(env, results)
+
+        token = self._get_access_token(env)
+
+        # 2. Retrieve all local transaction records in one query (newest first)
+        payment_ids = [p.get("payment_id") for p in uncached if p.get("payment_id")]
+        tx_by_payment_id = {}
+        if payment_ids:
+            for tx in env['mp.transaction'].sudo().search([('mp_payment_id', 'in', payment_ids)]):
+                if tx.mp_payment_id not in tx_by_payment_id:
+                    tx_by_payment_id[tx.mp_payment_id] = tx
+                    _qr_created_cache.set(
+                        (dbname, tx.mp_payment_id),
+                        tx.create_date.replace(tzinfo=timezone.utc).timestamp(),
+                    )
+            env['mp.transaction'].sudo().concat(*tx_by_payment_id.values())._mp_record_poll()
+
+        lookups = []
+        for entry in uncached:
+            payment_id = entry.get("payment_id")
+            tx = tx_by_payment_id.get(payment_id)
+
+            # Search filter: the reference of the transaction (per attempt), or the one sent by the
+            # POS when there is none; older POS clients still send the order name
+            external_reference = (tx.external_reference if tx else None) or entry.get("external_reference")
+
+            # 3. Final status already known (webhook or previous poll) - no API call needed
+            if tx and tx.status in FINAL_STATUSES:
+                results[payment_id] = {"payment_status": tx.status}
+                cache_payment_status(dbname, payment_id, results[payment_id])
+                metrics.inc("mp_status_checks_total", source="database")
+                continue
+
+            # SAFETY CHECK: Only search API if we have a token and an external_reference to filter by.
+            # Without a filter, searching would return ALL recent payments and could match unrelated approved payments
+            if not token or not payment_id or not external_reference:
+                results[payment_id] = self._tx_payment_status(tx)
+                metrics.inc("mp_status_checks_total", source="local")
+                continue
+
+            lookups.append((payment_id, external_reference, tx))
+
+        if lookups:
+            metrics.inc("mp_status_checks_total", len(lookups), source="upstream")
+
+        if not lookups:
+            return self._add_retry_hints(env, results)
+
+        # 4. Search MercadoPago once per external_reference, concurrently.
+        # Each search is coalesced (single-flight) on what it asks MercadoPago (reference and
+        # date range), so callers polling the same reference at the same time share one request.
+        groups = {}
+        begin_dates = {}
+        for payment_id, reference, tx in lookups:
+            groups.setdefault(reference, []).append(payment_id)
+            # Oldest transaction of the group; unknown if one of them has no local transaction.
+            # A per-attempt reference has a single transaction: no date range needed.
+            created = tx.create_date if tx and not is_attempt_reference(reference) else None
+            if reference not in begin_dates or not created:
+                begin_dates[reference] = created
+            elif begin_dates[reference]:
+                begin_dates[reference] = min(begin_dates[reference], created)
+
+        def _search(reference):
+            return _status_flight.do(
+                (dbname, reference, begin_dates[reference]),
+                lambda: self._search_mp_payments(token, reference, begin_dates[reference]),
+            )
+
+        references = list(groups)
+        if len(references) == 1:
+            searches = {references[0]: _search(references[0])}
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(references), MAX_CONCURRENT_SEARCHES)) as executor:
+                searches = dict(zip(references, executor.map(_search, references)))
+
+        if any(search["status_code"] == 401 for search in searches.values()):
+            self._revalidate_token_async(env, token)
+
+        # 5. Match results and update the local transactions
+        for payment_id, external_reference, tx in lookups:
+            search = searches[external_reference]
+            payment = None
+            if search["status_code"] == 200:
+                payment = search["index"].match(payment_id, external_reference, tx.create_date if tx else None)
+
+            if not payment:
+                # If no API match found (or API error), check local DB (webhook may have updated it)
+                results[payment_id] = self._tx_payment_status(tx)
+                if search["status_code"] == 200:
+                    cache_payment_status(dbname, payment_id, results[payment_id])
+                continue
+
+            status = payment.get("status", "pending")
+
+            # Update local Odoo database
+            if tx and tx.status != status:
+                tx.sudo()._mp_set_status(status, payment, channel='poll')
+
+            results[payment_id] = {
+                "payment_status": status,
+                "status_detail": payment.get("status_detail", ""),
+                "payment_id": str(payment.get("id")),
+            }
+            cache_payment_status(dbname, payment_id, results[payment_id])
+
+        return self._add_retry_hints(env, results)
+
+    def _add_retry_hints(self, env, results):
+        """
+        Attach a retry_after hint to every result that is not final (cached dicts are copied).
+        The conditions shared by all the payments (see poll_conditions) are read once.
+        """
+        if all(result.get("payment_status") in FINAL_STATUSES for result in results.values()):
+            return results
+        dbname = env.cr.dbname
+        conditions = poll_conditions(env)
+        return {
+            payment_id: result if result.get("payment_status") in FINAL_STATUSES else dict(
+                result, retry_after=poll_retry_after(conditions, _qr_created_cache.get((dbname, payment_id)))
+            )
+            for payment_id, result in results.items()
+        }
+
+    def _tx_payment_status(self, tx):
+        """Status to report to the POS from the local transaction only."""
+        if not tx or not tx.status:
             return {"payment_status": "pending"}
-        
-        # 4. Build the Search URL - we have at least one filter (payment_id or external_reference)
-        headers = {"Authorization": f"Bearer {token}"}
-        
-        # Only search if we have external_reference to filter by
-        # If we only have payment_id (preference_id), we'll match by preference_id in the results
-        if not external_reference:
-            # We have payment_id but no external_reference
-            # We can't safely search without a filter - check DB only
-            if tx:
-                if tx.status in ('initial', 'pending'):
-                    return {"payment_status": "pending"}
-                if tx.status in ('approved', 'rejected', 'cancelled'):
-                    return {"payment_status": tx.status}
-                return {"payment_status": "pending"}
+        # "initial" and "pending" both mean "not yet completed" - treat as pending
+        # This prevents auto-approval from old transactions
+        if tx.status in ('initial', 'pending'):
             return {"payment_status": "pending"}
-        
-        # We have external_reference - safe to search with filter
-        search_url = f"https://api.mercadopago.com/v1/payments/search?sort=date_created&criteria=desc&external_reference={external_reference}"
-        
+        return {"payment_status": tx.status, "status_detail": tx.status_detail or ""}
+
+    def _search_mp_payments(self, token, external_reference, begin_date=None):
+        """
+        Search MercadoPago payments by external_reference, newest first.
+
+        Bounded: at most SEARCH_LIMIT payments, created since begin_date (the
+        transaction's creation) when known, so an order name reused for many
+        sales does not return its whole payment history.
+
+        Only does HTTP (no ORM access), so it can run in worker threads.
+
+        Args:
+            token: Access token
+            external_reference: External reference of the transaction(s)
+            begin_date: Optional creation date (naive UTC) of the oldest transaction searched for
+
+        Returns:
+            dict: {"status_code": int or None, "results": list, "index": PaymentIndex}
+        """
+        search_params = {
+            "sort": "date_created",
+            "criteria": "desc",
+            "external_reference": external_reference,
+            "limit": SEARCH_LIMIT,
+        }
+        if begin_date:
+            search_params.update({
+                "range": "date_created",
+                "begin_date": (begin_date.replace(tzinfo=timezone.utc) - SEARCH_CLOCK_MARGIN).isoformat(
+                    timespec="milliseconds"
+                ),
+                "end_date": "NOW",
+            })
+        results = []
+        status_code = None
         try:
-            response = requests.get(search_url, headers=headers, timeout=20)
-            
-            api_match_found = False
-            
-            if response.status_code == 200:
-                data = response.json()
-                results = data.get("results", [])
-                
-                # 4. Find matching payment - STRICT matching to avoid old payments
-                # Priority: preference_id (unique) > external_reference (only if recent)
-                for payment in results:
-                    payment_preference_id = payment.get("preference_id")
-                    payment_ext_ref = payment.get("external_reference")
-                    
-                    # PRIMARY: Match by preference_id (this is unique and safe)
-                    matches_preference = payment_preference_id and str(payment_preference_id) == str(payment_id)
-                    
-                    if matches_preference:
-                        # Found exact match by preference_id - this is definitely our payment
-                        api_match_found = True
-                        status = payment.get("status", "pending")
-                        status_detail = payment.get("status_detail", "")
-                        actual_payment_id = payment.get("id")
-                        
-                        # Update local Odoo database
-                        if tx and tx.status != status:
-                            tx.sudo().write({
-                                'status': status,
-                                'raw_data': json.dumps(payment),
-                            })
-                        
-                        return {
-                            "payment_status": status,
-                            "status_detail": status_detail,
-                            "payment_id": str(actual_payment_id),
-                        }
-                    
-                    # FALLBACK: Only use external_reference if:
-                    # 1. No preference_id match found yet
-                    # 2. Payment has NO preference_id (old payment format - safe to match by external_ref)
-                    # 3. Payment is recent (created after our transaction)
-                    # IMPORTANT: If payment HAS a preference_id but it doesn't match, skip it (belongs to different preference)
-                    if (not api_match_found and 
-                        not payment_preference_id and  # Payment has no preference_id (old format)
-                        external_reference and 
-                        payment_ext_ref == external_reference):
-                        # Check if payment is recent (created after our transaction)
-                        payment_date_str = payment.get("date_created")
-                        if payment_date_str and tx:
-                            try:
-                                # Parse MercadoPago date format: "2024-01-01T12:00:00.000-04:00" (with timezone)
-                                # Try dateutil.parser first (most robust), fallback to manual parsing
-                                payment_date_utc = None
-                                
-                                try:
-                                    # Try dateutil.parser (handles all timezone formats automatically)
-                                    from dateutil import parser
-                                    payment_date = parser.parse(payment_date_str)
-                                    payment_date_utc = payment_date.astimezone(timezone.utc)
-                                except (ImportError, ValueError):
-                                    # Fallback: manual parsing for timezone
-                                    # Format: "2024-01-01T12:00:00.000-04:00" or "2024-01-01T12:00:00.000+03:00"
-                                    import re
-                                    # Extract timezone offset using regex: matches "+03:00" or "-04:00" at the end
-                                    tz_match = re.search(r'([+-]\d{2}):(\d{2})(?:Z)?$', payment_date_str)
-                                    if tz_match:
-                                        # Has timezone offset - extract date part (everything before the timezone)
-                                        # Remove milliseconds and timezone: "2024-01-01T12:00:00.000-04:00" -> "2024-01-01T12:00:00"
-                                        date_part = re.sub(r'\.\d{3}[+-]\d{2}:\d{2}$', '', payment_date_str)
-                                        if date_part == payment_date_str:
-                                            # Try alternative: remove timezone only
-                                            date_part = re.sub(r'[+-]\d{2}:\d{2}(?:Z)?$', '', payment_date_str)
-                                        
-                                        payment_date = datetime.strptime(date_part, "%Y-%m-%dT%H:%M:%S")
-                                        
-                                        # Parse timezone offset
-                                        # tz_match.group(1) is "+03" or "-04" (includes sign)
-                                        offset_str = tz_match.group(1)
-                                        hours = int(offset_str)  # int("+03") = 3, int("-04") = -4
-                                        minutes = int(tz_match.group(2))
-                                        # Calculate offset: hours already has sign, minutes is always positive
-                                        # For "+03:30": 3*3600 + 30*60 = 12600
-                                        # For "-04:30": -4*3600 - 30*60 = -16200
-                                        offset_seconds = hours * 3600 + (minutes * 60 if hours >= 0 else -minutes * 60)
-                                        tz = timezone(timedelta(seconds=offset_seconds))
-                                        payment_date = payment_date.replace(tzinfo=tz)
-                                        payment_date_utc = payment_date.astimezone(timezone.utc)
-                                    else:
-                                        # No timezone found - assume UTC
-                                        date_part = payment_date_str.split('.')[0] if '.' in payment_date_str else payment_date_str
-                                        payment_date = datetime.strptime(date_part, "%Y-%m-%dT%H:%M:%S")
-                                        payment_date_utc = payment_date.replace(tzinfo=timezone.utc)
-                                
-                                # Only proceed if date parsing was successful
-                                if payment_date_utc:
-                                    # Convert transaction_date to UTC
-                                    transaction_date = tx.create_date
-                                    if transaction_date.tzinfo:
-                                        transaction_date_utc = transaction_date.astimezone(timezone.utc)
-                                    else:
-                                        # Odoo stores naive datetime in UTC by default
-                                        transaction_date_utc = transaction_date.replace(tzinfo=timezone.utc)
-                                    
-                                    # Only accept if payment was created after our transaction (with 1 minute buffer for clock skew)
-                                    # This ensures we don't match old payments from previous orders
-                                    if payment_date_utc >= transaction_date_utc:
-                                        api_match_found = True
-                                        status = payment.get("status", "pending")
-                                        status_detail = payment.get("status_detail", "")
-                                        actual_payment_id = payment.get("id")
-                                        
-                                        # Update local Odoo database
-                                        if tx.status != status:
-                                            tx.sudo().write({
-                                                'status': status,
-                                                'raw_data': json.dumps(payment),
-                                            })
-                                        
-                                        return {
-                                            "payment_status": status,
-                                            "status_detail": status_detail,
-                                            "payment_id": str(actual_payment_id),
-                                        }
-                            except (ValueError, AttributeError):
-                                # If date parsing fails, skip this payment (too risky)
-                                continue
-            
-            # 5. If no API match found, check local DB immediately (webhook may have updated it)
-            # This ensures we detect webhook updates even if API search doesn't find the payment
-            if not api_match_found and tx:
-                # If webhook updated the DB to a final status, return it immediately
-                if tx.status in ('approved', 'rejected', 'cancelled'):
-                    return {"payment_status": tx.status}
-                # "initial" and "pending" both mean "not yet completed" - treat as pending
-                # This prevents auto-approval from old transactions
-                if tx.status in ('initial', 'pending'):
-                    return {"payment_status": "pending"}
-                # Fallback for any other status
-                return {"payment_status": tx.status if tx.status else "pending"}
-            
-            # No API match and no transaction record
-            return {"payment_status": "pending"}
+            response = get_client().get(
+                "/v1/payments/search", token=token, params=search_params, timeout=STATUS_CHECK_TIMEOUT
+            )
+            status_code = response.status_code
+            if status_code == 200:
+                results = response.json().get("results", [])
+        except UpstreamUnavailable:
+            # Not sent: the caller answers from the transaction, kept up to date by webhooks
+            pass
+        except Exception as e:
+            _logger.info("[MP] Payment search failed for %s: %s", external_reference, e)
+            status_code = None
+        return {"status_code": status_code, "results": results, "index": PaymentIndex(results)}
+
+    def _search_mp_payments_page(self, token, begin_date, end_date, offset=0, limit=100):
+        """
+        One page of the payments updated in [begin_date, end_date], oldest update first
+        (GET /v1/payments/search with range=date_last_updated).
+
+        Args:
+            token: Access token
+            begin_date, end_date: Aware datetimes
+            offset, limit: Paging
+
+        Returns:
+            dict: {"status_code": int or None, "results": list, "total": int}
 
+        Raises:
+            UpstreamUnavailable: Not sent (see mp_guard)
+        """
+        search_params = {
+            "sort": "date_last_updated",
+            "criteria": "asc",
+            "range": "date_last_updated",
+            "begin_date": begin_date.isoformat(timespec="milliseconds"),
+            "end_date": end_date.isoformat(timespec="milliseconds"),
+            "offset": offset,
+            "limit": limit,
+        }
+        try:
+            response = get_client().get("/v1/payments/search", token=token, params=search_params)
+        except UpstreamUnavailable:
+            raise
+        except requests.exceptions.RequestException as e:
+            _logger.info("[MP] Payment search page %s failed: %s", offset, e)
+            return {"status_code": None, "results": [], "total": 0}
+        if response.status_code != 200:
+            return {"status_code": response.status_code, "results": [], "total": 0}
+        data = response.json()
+        return {
+            "status_code": 200,
+            "results": data.get("results", []),
+            "total": (data.get("paging") or {}).get("total", 0),
+        }
+
+    def _fetch_mp_payment(self, token, payment_id):
+        """
+        Fetch one MercadoPago payment (GET /v1/payments/{id}).
+
+        Only does HTTP (no ORM access), so it can run in worker threads.
+
+        Returns:
+            dict: {"status_code": int or None, "payment": dict or None, "error": str or None,
+                   "shed": bool (not sent, see mp_guard),
+                   "retry_after": float (seconds before sending again, when shed)}
+        """
+        try:
+            response = get_client().get(f"/v1/payments/{payment_id}", token=token)
+        except UpstreamUnavailable as e:
+            return {"status_code": None, "payment": None, "error": str(e), "shed": True,
+                    "retry_after": e.retry_after}
         except Exception as e:
-            # On error, check if webhook updated the local DB
-            # This is critical - even if API fails, webhook updates should be detected
-            if tx:
-                if tx.status in ('approved', 'rejected', 'cancelled'):
-                    return {"payment_status": tx.status}
-                # "initial" and "pending" both mean "not yet completed" - treat as pending
-                if tx.status in ('initial', 'pending'):
-                    return {"payment_status": "pending"}
-                return {"payment_status": tx.status if tx.status else "pending"}
-            return {"payment_status": "pending"}     
+            return {"status_code": None, "payment": None, "error": str(e)}
+        if response.status_code != 200:
+            return {"status_code": response.status_code, "payment": None, "error": response.text[:500]}
+        return {"status_code": 200, "payment": response.json(), "error": None}
+
+    @http.route('/mp/pos/qr/<string:preference_id>', type='http', auth='user', methods=['GET'])
+    def qr_image_http(self, preference_id, **kwargs):
+        """
+        Serve the QR image of a preference.
+
+        A preference's QR never changes, so the image is sent with an ETag and a
+        long private Cache-Control: reopening the popup is served by the browser cache.
+        """
+        dbname = request.env.cr.dbname
+        image = get_qr_image(dbname, preference_id)
+        if not image:
+            tx = request.env['mp.transaction'].sudo().search([('mp_payment_id', '=', preference_id)], limit=1)
+            if not tx or not (tx.qr_data or tx.qr_image):
+                return request.not_found()
+            image = store_qr_image(dbname, preference_id, payload=tx.qr_data, png_base64=tx.qr_image)
+
+        mimetype, content, etag = image
+        headers = [
+            ('ETag', f'"{etag}"'),
+            ('Cache-Control', 'private, max-age=86400, immutable'),
+        ]
+        if request.httprequest.if_none_match.contains(etag):
+            return request.make_response(b'', headers=headers, status=304)
+        return request.make_response(content, headers=headers + [
+            ('Content-Type', mimetype),
+            ('Content-Length', str(len(content))),
+        ])
 
     @http.route('/mp/pos/create_preference', type='json', auth='user', csrf=False)
     def create_preference_http(self, **kwargs):
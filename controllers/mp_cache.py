@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache with per-entry expiry.
+
+    Lives in worker memory: every Odoo worker process has its own copy, so
+    entries must always be safe to recompute (they are only an optimisation).
+
+    Args:
+        maxsize: Maximum number of entries; the least recently used entry is
+            evicted when the cache is full
+        ttl: Default time-to-live in seconds (None = until evicted)
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=_MISSING):
+        """Store ``value``; ``ttl=None`` keeps it until evicted."""
+        ttl = self.ttl if ttl is _MISSING else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def invalidate(self, predicate=None):
+        """Drop every entry whose key matches ``predicate`` (all entries if None)."""
+        with self._lock:
+            if predicate is None:
+                self._data.clear()
+                return
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for it and share its result (or its exception).
+    """
+
+    class _Call:
+        __slots__ = ("event", "result", "error")
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+        return call.result
@@ -0,0 +1,249 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from odoo.tools import config
+
+from .mp_guard import UpstreamGuard
+from .mp_metrics import endpoint_label, metrics
+
+_logger = logging.getLogger(__name__)
+
+MP_API_BASE_URL = "https://api.mercadopago.com"
+
+# Defaults, overridable from the Odoo server configuration file (odoo.conf):
+#   mp_http_pool_size = 10
+#   mp_http_connect_timeout = 5
+#   mp_http_read_timeout = 20
+#   mp_http_warm_connections = 2
+#   mp_rate_limit = 50               requests per second, all workers of the server
+#   mp_rate_burst = 100
+#   mp_breaker_failures = 5          failures within mp_breaker_window seconds opening the circuit
+#   mp_breaker_window = 30
+#   mp_breaker_open_seconds = 30
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 20.0
+DEFAULT_WARM_CONNECTIONS = 2
+DEFAULT_RATE_LIMIT = 50.0
+DEFAULT_RATE_BURST = 100
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_WINDOW = 30.0
+DEFAULT_BREAKER_OPEN_SECONDS = 30.0
+
+# Window (seconds) over which upstream throttling and error rates are measured
+HEALTH_WINDOW = 60
+
+
+def _config_value(key, default, cast):
+    value = config.get(key)
+    if value in (None, "", False):
+        return default
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        _logger.warning("[MP Client] Invalid value %r for %s, using %s", value, key, default)
+        return default
+
+
+class MPClient:
+    """
+    Pooled HTTP client for the MercadoPago API.
+
+    One instance lives in each Odoo worker process and is shared by the
+    controllers, the webhook handler and the models. The underlying
+    requests.Session keeps TLS connections to api.mercadopago.com alive,
+    so polls and preference creations reuse an open connection instead of
+    paying a new TCP+TLS handshake every time.
+
+    Every request goes through the server-wide UpstreamGuard (rate limiter,
+    429 back-off and circuit breaker) and raises UpstreamUnavailable instead
+    of being sent while MercadoPago is failing or throttling.
+    """
+
+    def __init__(self, base_url=None, pool_size=None, connect_timeout=None, read_timeout=None):
+        self.base_url = (base_url or config.get("mp_api_base_url") or MP_API_BASE_URL).rstrip("/")
+        self.pool_size = pool_size or _config_value("mp_http_pool_size", DEFAULT_POOL_SIZE, int)
+        self.connect_timeout = connect_timeout or _config_value(
+            "mp_http_connect_timeout", DEFAULT_CONNECT_TIMEOUT, float
+        )
+        self.read_timeout = read_timeout or _config_value(
+            "mp_http_read_timeout", DEFAULT_READ_TIMEOUT, float
+        )
+
+        self.session = requests.Session()
+        # Retries are handled by the callers, never silently by urllib3
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=0,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Connection": "keep-alive",
+        })
+
+        self.guard = UpstreamGuard(
+            rate=_config_value("mp_rate_limit", DEFAULT_RATE_LIMIT, float),
+            burst=_config_value("mp_rate_burst", DEFAULT_RATE_BURST, int),
+            failures=_config_value("mp_breaker_failures", DEFAULT_BREAKER_FAILURES, int),
+            window=_config_value("mp_breaker_window", DEFAULT_BREAKER_WINDOW, float),
+            open_seconds=_config_value("mp_breaker_open_seconds", DEFAULT_BREAKER_OPEN_SECONDS, float),
+            probe_timeout=self.connect_timeout + self.read_timeout,
+        )
+
+        # (monotonic time, status code or None on network error) of recent responses
+        self._recent = deque(maxlen=1000)
+
+    def _url(self, path):
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, token=None, timeout=None, headers=None, **kwargs):
+        """
+        Send a request to the MercadoPago API through the pooled session.
+
+        Args:
+            method: HTTP method
+            path: API path (e.g. "/v1/payments/search") or absolute URL
+            token: Optional access token, sent as a Bearer Authorization header
+            timeout: Optional read timeout in seconds (defaults to mp_http_read_timeout)
+            headers: Optional extra headers
+
+        Returns:
+            requests.Response
+
+        Raises:
+            UpstreamUnavailable: Not sent (circuit open, throttled or rate limited)
+            requests.exceptions.RequestException: Network error or timeout
+        """
+        self.guard.acquire(endpoint_label(path))
+
+        request_headers = {}
+        if token:
+            request_headers["Authorization"] = f"Bearer {token}"
+        if headers:
+            request_headers.update(headers)
+
+        start = time.monotonic()
+        try:
+            response = self.session.request(
+                method,
+                self._url(path),
+                headers=request_headers,
+                timeout=(self.connect_timeout, timeout or self.read_timeout),
+                **kwargs
+            )
+        except requests.exceptions.RequestException:
+            self._recent.append((time.monotonic(), None))
+            self.guard.record(None)
+            self._observe(method, path, start, "error")
+            raise
+
+        self._record(response)
+        self._observe(method, path, start, response.status_code)
+        return response
+
+    def _observe(self, method, path, start, status):
+        metrics.observe(
+            "mp_upstream_request_duration_seconds", time.monotonic() - start,
+            endpoint=endpoint_label(path), method=method, status=status,
+        )
+
+    def _record(self, response):
+        self._recent.append((time.monotonic(), response.status_code))
+        self.guard.record(response.status_code, response.headers.get("Retry-After"))
+
+    def health(self):
+        """
+        Upstream health of this worker over the last HEALTH_WINDOW seconds.
+
+        Returns:
+            dict: {
+                "requests": int,
+                "throttled": int (429 responses),
+                "errors": int (5xx responses and network errors),
+            }
+
+        The server-wide back-off state is in self.guard.status().
+        """
+        now = time.monotonic()
+        recent = [code for at, code in list(self._recent) if now - at <= HEALTH_WINDOW]
+        return {
+            "requests": len(recent),
+            "throttled": sum(1 for code in recent if code == 429),
+            "errors": sum(1 for code in recent if code is None or code >= 500),
+        }
+
+    def get(self, path, token=None, **kwargs):
+        return self.request("GET", path, token=token, **kwargs)
+
+    def post(self, path, token=None, **kwargs):
+        return self.request("POST", path, token=token, **kwargs)
+
+    def put(self, path, token=None, **kwargs):
+        return self.request("PUT", path, token=token, **kwargs)
+
+    def delete(self, path, token=None, **kwargs):
+        return self.request("DELETE", path, token=token, **kwargs)
+
+    def warm_up(self, connections=None):
+        """
+        Open keep-alive connections to the API host ahead of the first sale.
+
+        The response itself is irrelevant (the API root answers 404); only the
+        established TLS connection, which goes back to the pool, matters.
+        """
+        connections = connections or _config_value("mp_http_warm_connections", DEFAULT_WARM_CONNECTIONS, int)
+        connections = max(1, min(connections, self.pool_size))
+
+        def _open():
+            try:
+                self.session.head(self._url("/"), timeout=(self.connect_timeout, self.connect_timeout))
+            except requests.exceptions.RequestException as e:
+                _logger.info("[MP Client] Warm-up connection failed: %s", e)
+
+        threads = [threading.Thread(target=_open, daemon=True) for _ in range(connections)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        _logger.info("[MP Client] Warmed up %s connection(s) to %s", connections, self.base_url)
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the MPClient of the current worker process.
+
+    Odoo may build registries in the prefork master before forking; a session
+    inherited through fork() would share sockets between processes, so a new
+    client is created whenever the PID changes.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = MPClient()
+                _client_pid = pid
+    return _client
+
+
+def warm_up_client():
+    """Warm up the worker's client in the background (never blocks the caller)."""
+    thread = threading.Thread(target=lambda: get_client().warm_up(), name="mp-client-warmup", daemon=True)
+    thread.start()
+    return thread
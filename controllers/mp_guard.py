@@ -0,0 +1,257 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows: no prefork workers, the state is kept in memory
+    fcntl = None
+
+from odoo.tools import config
+
+from .mp_metrics import metrics
+
+_logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Delay (seconds) assumed when a 429 response has no usable Retry-After header
+DEFAULT_RETRY_AFTER = 10
+# Longest a caller waits for a rate limiter token before its request is shed (seconds)
+MAX_TOKEN_WAIT = 0.5
+# Failures needed to open the circuit also have to be this share of the window's requests
+FAILURE_RATIO = 0.5
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """
+    A MercadoPago request was not sent: the circuit is open, MercadoPago asked
+    us to back off (429 Retry-After), or the shared rate limit is exhausted.
+
+    Subclass of RequestException, so callers handle it like a network error
+    (answer from the database, keep the webhook for later...).
+    """
+
+    def __init__(self, reason, retry_after):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"MercadoPago temporalmente no disponible, reintente en {int(retry_after) + 1} s")
+
+
+def parse_retry_after(value, default=DEFAULT_RETRY_AFTER):
+    """Seconds of a Retry-After header (delay in seconds or HTTP date)."""
+    if not value:
+        return default
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class UpstreamGuard:
+    """
+    Token-bucket rate limiter and circuit breaker in front of every MercadoPago call.
+
+    The state lives in a small file of the data directory, updated under an
+    exclusive flock, so it is shared by all the workers (and cron threads) of
+    the server: one worker seeing MercadoPago fail or throttle stops the others
+    from piling up requests that would each hold a worker until their timeout.
+
+    - Rate limit: ``rate`` requests per second, bursts of ``burst``. A caller
+      waits up to MAX_TOKEN_WAIT for a token, otherwise its request is shed.
+    - 429: no request is sent until the Retry-After delay has passed.
+    - Circuit breaker: ``failures`` network errors or 5xx responses within
+      ``window`` seconds (and at least FAILURE_RATIO of the requests) open the
+      circuit for ``open_seconds``; then a single probe request is let through,
+      which closes the circuit on success or opens it again on failure.
+    """
+
+    def __init__(self, rate, burst, failures, window, open_seconds, probe_timeout, directory=None):
+        self.rate = rate
+        self.burst = burst
+        self.failures = failures
+        self.window = window
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._memory_state = {}
+
+    # Shared state
+
+    def _path(self):
+        directory = self.directory or os.path.join(config['data_dir'], "mp_upstream")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{socket.gethostname()}.json")
+
+    @contextmanager
+    def _state(self):
+        """Read-modify-write access to the shared state, exclusive across processes."""
+        with self._lock:
+            if fcntl is None:
+                yield self._memory_state
+                return
+            fd = os.open(self._path(), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    state = json.loads(os.read(fd, 65536) or b"{}")
+                except ValueError:
+                    state = {}   # torn write of a killed process: start over
+                yield state
+                data = json.dumps(state).encode()
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, data)
+            finally:
+                os.close(fd)     # also releases the flock
+
+    def _read_state(self):
+        """
+        Snapshot of the shared state, read under a shared flock and never written
+        back: monitoring reads do not queue behind (nor block) the request path.
+        """
+        if fcntl is None:
+            with self._lock:
+                return dict(self._memory_state)
+        fd = os.open(self._path(), os.O_RDONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            data = os.read(fd, 65536)
+        finally:
+            os.close(fd)
+        try:
+            return json.loads(data or b"{}")
+        except ValueError:
+            return {}
+
+    # Request lifecycle
+
+    def acquire(self, endpoint=None):
+        """
+        Reserve the right to send one request, waiting briefly for a token if needed.
+
+        Raises:
+            UpstreamUnavailable: The request must not be sent
+        """
+        with self._state() as state:
+            now = time.time()
+            wait = self._acquire(state, now)
+            if isinstance(wait, UpstreamUnavailable):
+                shed = state.setdefault("shed", {})
+                shed[wait.reason] = shed.get(wait.reason, 0) + 1
+        if isinstance(wait, UpstreamUnavailable):
+            metrics.inc("mp_upstream_shed_total", reason=wait.reason)
+            _logger.debug("[MP Client] Request to %s shed (%s): %s", endpoint, wait.reason, wait)
+            raise wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def _acquire(self, state, now):
+        blocked_until = state.get("blocked_until", 0.0)
+        if blocked_until > now:
+            return UpstreamUnavailable("throttled", blocked_until - now)
+
+        circuit = state.get("circuit", CIRCUIT_CLOSED)
+        if circuit == CIRCUIT_OPEN:
+            if now < state.get("open_until", 0.0):
+                return UpstreamUnavailable("circuit_open", state["open_until"] - now)
+            state["circuit"] = circuit = CIRCUIT_HALF_OPEN
+            state["probe_until"] = 0.0
+        if circuit == CIRCUIT_HALF_OPEN:
+            # One probe at a time; a probe that never reports back frees the slot after its timeout
+            if now < state.get("probe_until", 0.0):
+                return UpstreamUnavailable("circuit_open", state["probe_until"] - now)
+            state["probe_until"] = now + self.probe_timeout
+
+        tokens = min(self.burst, state.get("tokens", self.burst) + (now - state.get("refilled_at", now)) * self.rate)
+        state["refilled_at"] = now
+        if tokens >= 1:
+            state["tokens"] = tokens - 1
+            return 0.0
+        wait = (1 - tokens) / self.rate
+        if wait > MAX_TOKEN_WAIT:
+            state["tokens"] = tokens
+            return UpstreamUnavailable("rate_limited", wait)
+        state["tokens"] = tokens - 1   # reserved: the token is spent once the caller has waited
+        return wait
+
+    def record(self, status_code, retry_after=None):
+        """
+        Report the outcome of a sent request.
+
+        Args:
+            status_code: HTTP status, or None on network error or timeout
+            retry_after: Retry-After header of a 429 response
+        """
+        failure = status_code is None or status_code >= 500
+        with self._state() as state:
+            now = time.time()
+            if status_code == 429:
+                delay = parse_retry_after(retry_after)
+                state["blocked_until"] = max(state.get("blocked_until", 0.0), now + delay)
+                _logger.warning("[MP Client] MercadoPago throttling (429), pausing requests for %.0f s", delay)
+
+            if now - state.get("window_start", 0.0) > self.window:
+                state.update(window_start=now, window_requests=0, window_failures=0)
+            state["window_requests"] = state.get("window_requests", 0) + 1
+            state["window_failures"] = state.get("window_failures", 0) + int(failure)
+
+            circuit = state.get("circuit", CIRCUIT_CLOSED)
+            if circuit == CIRCUIT_HALF_OPEN:
+                if failure:
+                    self._open(state, now, "probe failed")
+                else:
+                    state.update(circuit=CIRCUIT_CLOSED, window_start=now, window_requests=0, window_failures=0)
+                    _logger.info("[MP Client] MercadoPago answering again, circuit closed")
+            elif (circuit == CIRCUIT_CLOSED and failure and state["window_failures"] >= self.failures
+                    and state["window_failures"] >= FAILURE_RATIO * state["window_requests"]):
+                self._open(state, now, f"{state['window_failures']} failures in {self.window:.0f} s")
+
+    def _open(self, state, now, cause):
+        state.update(circuit=CIRCUIT_OPEN, open_until=now + self.open_seconds, opened_at=now)
+        state["trips"] = state.get("trips", 0) + 1
+        _logger.warning("[MP Client] Circuit opened for %.0f s (%s): MercadoPago calls are shed",
+                        self.open_seconds, cause)
+
+    # Monitoring
+
+    def status(self):
+        """
+        Shared state, for the settings, the poll hints and the metrics (read-only, see _read_state).
+
+        Returns:
+            dict: {
+                "circuit": "closed", "open" or "half_open",
+                "retry_after": float (seconds until requests are sent again, 0 if they are),
+                "throttled": bool (a 429 Retry-After is running),
+                "shed": {reason: int} (requests not sent, all workers),
+                "trips": int (times the circuit opened),
+            }
+        """
+        state = self._read_state()
+        now = time.time()
+        circuit = state.get("circuit", CIRCUIT_CLOSED)
+        if circuit == CIRCUIT_OPEN and now >= state.get("open_until", 0.0):
+            circuit = CIRCUIT_HALF_OPEN   # the next request is the probe
+        blocked = max(0.0, state.get("blocked_until", 0.0) - now)
+        retry_after = max(blocked, state.get("open_until", 0.0) - now if circuit == CIRCUIT_OPEN else 0.0)
+        return {
+            "circuit": circuit,
+            "retry_after": retry_after,
+            "throttled": blocked > 0,
+            "shed": dict(state.get("shed", {})),
+            "trips": state.get("trips", 0),
+        }
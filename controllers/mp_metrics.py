@@ -0,0 +1,280 @@
+import bisect
+import glob
+import hmac
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from odoo import http
+from odoo.http import request
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+# Seconds between two snapshots of a worker's metrics to the shared directory
+METRICS_FLUSH_INTERVAL = 5
+# Snapshots of workers that are gone are still aggregated for this long (seconds)
+METRICS_STALE_AFTER = 3600
+
+# Latency buckets (seconds)
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+# Webhook delays (seconds): MercadoPago usually notifies within seconds, retries take minutes
+DELAY_BUCKETS = (1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+METRICS_HELP = {
+    "mp_upstream_request_duration_seconds": ("histogram", "MercadoPago API call latency by endpoint and status"),
+    "mp_status_checks_total": ("counter", "Payment status checks by source of the answer"),
+    "mp_transactions_created_total": ("counter", "MercadoPago transactions (QRs and orders) created"),
+    "mp_preference_retries_total": ("counter", "Preference creations retried after a timeout or a 5xx"),
+    "mp_preference_hedged_total": ("counter", "Preference creations that sent a hedged second request"),
+    "mp_webhook_notifications_total": ("counter", "Webhook notifications received, and duplicates acknowledged"),
+    "mp_webhook_events_processed_total": ("counter", "Queued webhook notifications processed, by result"),
+    "mp_webhook_queue_lag_seconds": ("histogram", "Time between receiving a notification and processing it"),
+    "mp_webhook_delivery_delay_seconds": ("histogram", "Time between a payment update and its notification"),
+    "mp_transactions_open": ("gauge", "Transactions waiting for payment (initial or pending)"),
+    "mp_webhook_queue_depth": ("gauge", "Webhook notifications waiting to be processed"),
+    "mp_upstream_shed_total": ("counter", "MercadoPago requests not sent, by reason (circuit open, 429, rate limit)"),
+    "mp_upstream_circuit_open": ("gauge", "1 while MercadoPago calls are suspended (open circuit or 429 Retry-After)"),
+}
+
+# Upstream paths with ids, reported with placeholders to keep the label set bounded
+_ENDPOINT_PATTERNS = [
+    (re.compile(r"^/v1/payments/\d+$"), "/v1/payments/{id}"),
+    (re.compile(r"^/checkout/preferences/[^/]+$"), "/checkout/preferences/{id}"),
+    (re.compile(r"^/instore/qr/seller/collectors/[^/]+/pos/[^/]+/orders$"),
+     "/instore/qr/seller/collectors/{user_id}/pos/{external_pos_id}/orders"),
+]
+
+
+def endpoint_label(path):
+    """Normalized endpoint of an API path or URL (ids replaced by placeholders)."""
+    path = re.sub(r"^https?://[^/]+", "", path).split("?", 1)[0]
+    for pattern, label in _ENDPOINT_PATTERNS:
+        if pattern.match(path):
+            return label
+    return path
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of one worker process.
+
+    Each worker periodically writes a snapshot of its values to a file in
+    <data_dir>/mp_metrics; the metrics route sums the snapshots of every
+    worker (multi-process aggregation, as in prometheus_client).
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._counters = defaultdict(float)   # (name, labels) -> value
+        self._histograms = {}                 # (name, labels) -> {"buckets", "counts", "sum", "count"}
+        self._last_flush = 0.0
+
+    def _check_pid(self):
+        # Values inherited through fork() belong to the parent process
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._check_pid()
+            self._counters[(name, _labels_key(labels))] += value
+        self._maybe_flush()
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        with self._lock:
+            self._check_pid()
+            key = (name, _labels_key(labels))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    "buckets": list(buckets), "counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0,
+                }
+            histogram["counts"][bisect.bisect_left(histogram["buckets"], value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+        self._maybe_flush()
+
+    def snapshot(self):
+        with self._lock:
+            self._check_pid()
+            return {
+                "counters": [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [
+                    [name, dict(labels), histogram["buckets"], list(histogram["counts"]),
+                     histogram["sum"], histogram["count"]]
+                    for (name, labels), histogram in self._histograms.items()
+                ],
+            }
+
+    # Shared snapshots
+
+    def _directory(self):
+        directory = self.directory or os.path.join(config['data_dir'], "mp_metrics")
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _snapshot_path(self):
+        return os.path.join(self._directory(), f"{socket.gethostname()}-{os.getpid()}.json")
+
+    def _maybe_flush(self):
+        if time.monotonic() - self._last_flush >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write this worker's snapshot (atomically: readers never see a partial file)."""
+        self._last_flush = time.monotonic()
+        try:
+            path = self._snapshot_path()
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            _logger.warning("[MP Metrics] Could not write metrics snapshot: %s", e)
+
+    def _snapshots(self):
+        """Snapshots of all workers: live ones, and recently exited ones (until METRICS_STALE_AFTER)."""
+        hostname = socket.gethostname()
+        now = time.time()
+        snapshots = []
+        for path in glob.glob(os.path.join(self._directory(), "*.json")):
+            name = os.path.basename(path)[:-len(".json")]
+            host, _sep, pid = name.rpartition("-")
+            try:
+                stale = now - os.path.getmtime(path) > METRICS_STALE_AFTER
+                if stale and host == hostname and pid.isdigit() and not _pid_alive(int(pid)):
+                    os.remove(path)
+                    continue
+                if stale and host != hostname:
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def aggregate(self):
+        """
+        Sum of the metrics of every worker.
+
+        Returns:
+            tuple: (counters {(name, labels): value},
+                    histograms {(name, labels): {"buckets", "counts", "sum", "count"}})
+        """
+        self.flush()
+        counters = defaultdict(float)
+        histograms = {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot.get("counters", []):
+                counters[(name, _labels_key(labels))] += value
+            for name, labels, buckets, counts, total, count in snapshot.get("histograms", []):
+                key = (name, _labels_key(labels))
+                histogram = histograms.setdefault(key, {
+                    "buckets": buckets, "counts": [0] * len(counts), "sum": 0.0, "count": 0,
+                })
+                if histogram["buckets"] != buckets:
+                    continue  # buckets changed between versions: skip the old snapshot
+                histogram["counts"] = [a + b for a, b in zip(histogram["counts"], counts)]
+                histogram["sum"] += total
+                histogram["count"] += count
+        return counters, histograms
+
+
+def counter_total(counters, name, **labels):
+    """Value of counter ``name`` in aggregated ``counters``, summed over the label sets matching ``labels``."""
+    wanted = {(key, str(value)) for key, value in labels.items()}
+    return sum(value for (counter, key), value in counters.items() if counter == name and wanted <= set(key))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+metrics = MetricsRegistry()
+
+
+def _format_labels(labels, **extra):
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _key, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _value), value in zip(items, escaped)) + "}"
+
+
+def render_prometheus(counters, histograms, gauges):
+    """Prometheus text exposition format (version 0.0.4)."""
+    samples = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        samples[name].append(f"{name}{_format_labels(labels)} {value:g}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"] + ["+Inf"], histogram["counts"]):
+            cumulative += count
+            samples[name].append(f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+        samples[name].append(f"{name}_sum{_format_labels(labels)} {histogram['sum']:g}")
+        samples[name].append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    for name, value in gauges.items():
+        samples[name].append(f"{name} {value:g}")
+
+    lines = []
+    for name in sorted(samples):
+        metric_type, help_text = METRICS_HELP.get(name, ("untyped", name))
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"] + samples[name]
+    return "\n".join(lines) + "\n"
+
+
+class MPMetricsController(http.Controller):
+
+    @http.route('/mp/pos/metrics', type='http', auth='public', methods=['GET'], csrf=False)
+    def metrics_http(self, **kwargs):
+        """
+        Prometheus metrics of all the workers of this server.
+
+        Readable with "Authorization: Bearer <mp_metrics_token>" (system parameter)
+        or by a logged-in administrator.
+        """
+        env = request.env
+        expected = env['ir.config_parameter'].sudo().get_param("mp_metrics_token")
+        authorization = request.httprequest.headers.get("Authorization", "")
+        token = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else ""
+        if not ((expected and hmac.compare_digest(token, expected)) or env.user.has_group('base.group_system')):
+            return request.make_response("Forbidden\n", headers=[('Content-Type', 'text/plain')], status=403)
+
+        # Imported here: the client itself reports to this module
+        from .mp_client import get_client
+
+        counters, histograms = metrics.aggregate()
+        # Gauges come from the database: already global, nothing to aggregate
+        gauges = {
+            "mp_transactions_open": env['mp.transaction'].sudo().search_count(
+                [('status', 'in', ('initial', 'pending'))]
+            ),
+            "mp_webhook_queue_depth": env['mp.webhook.event'].sudo().search_count([('state', 'in', ('pending', 'processing'))]),
+            # Server-wide state shared by the workers (see mp_guard)
+            "mp_upstream_circuit_open": int(get_client().guard.status()["retry_after"] > 0),
+        }
+        return request.make_response(render_prometheus(counters, histograms, gauges), headers=[
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'),
+            ('Cache-Control', 'no-store'),
+        ])
@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import io
+import urllib.parse
+
+import qrcode
+import qrcode.image.svg
+
+from .mp_cache import TTLCache
+
+# Rendered QR codes, keyed by payload (qr_code / init_point). Payloads are
+# unique per preference, so entries are only reused while a QR is on screen
+# (reopened popups, retries); the LRU bound keeps the worker memory flat.
+QR_CACHE_SIZE = 512
+
+_qr_cache = TTLCache(maxsize=QR_CACHE_SIZE)
+
+# Images served by /mp/pos/qr/<preference_id>, keyed by (dbname, preference_id).
+# Bounded per worker; a miss is rebuilt from the mp.transaction record.
+QR_IMAGE_STORE_SIZE = 256
+
+_image_store = TTLCache(maxsize=QR_IMAGE_STORE_SIZE)
+
+
+def render_qr_svg(payload):
+    """
+    Render ``payload`` as an SVG QR code, locally (no third-party service).
+
+    Args:
+        payload: Text to encode (EMVCo qr_code string or payment link)
+
+    Returns:
+        bytes: SVG document
+    """
+    svg = _qr_cache.get(payload)
+    if svg is None:
+        qr = qrcode.QRCode(
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            box_size=10,
+            border=2,
+            image_factory=qrcode.image.svg.SvgPathImage,
+        )
+        qr.add_data(payload)
+        qr.make(fit=True)
+        stream = io.BytesIO()
+        qr.make_image().save(stream)
+        svg = stream.getvalue()
+        _qr_cache.set(payload, svg)
+    return svg
+
+
+def qr_image_url(preference_id):
+    """URL of the cacheable QR image route of a preference."""
+    return "/mp/pos/qr/" + urllib.parse.quote(str(preference_id), safe="")
+
+
+def store_qr_image(dbname, preference_id, payload=None, png_base64=None):
+    """
+    Put the QR image of a preference in the worker's image store.
+
+    Args:
+        dbname: Database name
+        preference_id: MercadoPago preference ID
+        payload: Text to render locally as SVG (qr_code / init_point)
+        png_base64: Pre-rendered PNG from MercadoPago (used when there is no payload)
+
+    Returns:
+        tuple: (mimetype, content bytes, etag)
+    """
+    if payload:
+        mimetype, content = "image/svg+xml", render_qr_svg(payload)
+    else:
+        mimetype, content = "image/png", base64.b64decode(png_base64)
+    image = (mimetype, content, hashlib.sha1(content).hexdigest())
+    _image_store.set((dbname, str(preference_id)), image)
+    return image
+
+
+def get_qr_image(dbname, preference_id):
+    """Return (mimetype, content, etag) from the image store, or None."""
+    return _image_store.get((dbname, str(preference_id)))
@@ -0,0 +1,204 @@
+import heapq
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from odoo import SUPERUSER_ID, api, fields
+from odoo.modules.registry import Registry
+
+from .mp_qr import qr_image_url
+
+_logger = logging.getLogger(__name__)
+
+# Backends selectable in the settings (ir.config_parameter "mp_backend")
+BACKEND_MERCADOPAGO = "mercadopago"
+BACKEND_SIMULATOR = "simulator"
+
+DEFAULT_APPROVE_SECONDS = 10   # Simulated payments are approved after this delay (0 = never)
+
+# Upper bound of auto-approvals waiting in a worker's scheduler; past it, payments
+# are still approved by the next status check (see MPSimulator.check_status_batch)
+SIMULATOR_MAX_SCHEDULED = 100000
+
+# Payments due within this window (seconds) are approved in the same batch
+SIMULATOR_BATCH_WINDOW = 0.25
+
+# Simulated transactions use fake MercadoPago payment ids in this range
+SIMULATED_PAYMENT_ID_BASE = 9 * 10 ** 11
+
+
+def get_backend(env):
+    """Payment backend selected in the settings: BACKEND_MERCADOPAGO or BACKEND_SIMULATOR."""
+    return env['ir.config_parameter'].sudo().get_param("mp_backend") or BACKEND_MERCADOPAGO
+
+
+class SimulatorScheduler:
+    """
+    Auto-approval of simulated payments: one timer heap and one daemon thread
+    per worker, whatever the number of payments (no thread or sleep per payment).
+
+    Due payments are approved in batches, one database transaction per database.
+    The heap is only a trigger: the payments themselves are mp.transaction rows,
+    so a payment whose entry is lost (worker restart, full heap) is approved by
+    the next status check instead.
+    """
+
+    def __init__(self, maxsize=SIMULATOR_MAX_SCHEDULED):
+        self.maxsize = maxsize
+        self._heap = []   # (due monotonic time, dbname, payment_id)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def schedule(self, dbname, payment_id, delay):
+        """
+        Approve ``payment_id`` in ``delay`` seconds.
+
+        Returns:
+            bool: False if the heap is full (the payment is then approved when polled)
+        """
+        with self._cond:
+            if self._pid != os.getpid():
+                # Inherited through fork(): the parent's thread does not exist here
+                self._heap, self._thread, self._pid = [], None, os.getpid()
+            if len(self._heap) >= self.maxsize:
+                return False
+            heapq.heappush(self._heap, (time.monotonic() + delay, dbname, payment_id))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mp-simulator", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                while not self._heap or self._heap[0][0] > now:
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                    now = time.monotonic()
+                due = defaultdict(list)
+                while self._heap and self._heap[0][0] <= now + SIMULATOR_BATCH_WINDOW:
+                    _due_at, dbname, payment_id = heapq.heappop(self._heap)
+                    due[dbname].append(payment_id)
+
+            for dbname, payment_ids in due.items():
+                try:
+                    with Registry(dbname).cursor() as cr:
+                        env = api.Environment(cr, SUPERUSER_ID, {})
+                        MPSimulator().approve(env, payment_ids)
+                except Exception:
+                    _logger.exception("[MP Simulator] Auto-approval of %s payment(s) failed", len(payment_ids))
+
+
+_scheduler = SimulatorScheduler()
+
+
+class MPSimulator:
+    """
+    Payment backend that never calls MercadoPago, for demos, staging and load tests.
+
+    Simulated payments are regular mp.transaction rows (flagged "simulated"):
+    they are shared by all workers, survive restarts, go through the same
+    status, bus and QR image code as real payments, and are expired and
+    archived by the sweeper like any other transaction.
+    """
+
+    def _approve_seconds(self, env):
+        value = env['ir.config_parameter'].sudo().get_param("mp_simulator_approve_seconds")
+        return int(value) if value not in (None, False, "") else DEFAULT_APPROVE_SECONDS
+
+    def create_payment(self, env, amount, description, external_reference, tx_vals=None):
+        """
+        Create a simulated payment (same result as MPApiController._create_mp_preference).
+        """
+        payment_id = f"SIM-{uuid.uuid4().hex[:16].upper()}"
+        env['mp.transaction'].sudo().create({
+            "external_reference": external_reference,
+            "mp_payment_id": payment_id,
+            "qr_data": f"mp://pay/{payment_id}/{amount}",
+            "status": "initial",
+            "amount": amount,
+            "simulated": True,
+            **(tx_vals or {}),
+        })
+
+        approve_seconds = self._approve_seconds(env)
+        if approve_seconds > 0:
+            dbname = env.cr.dbname
+            # Scheduled once committed: the scheduler thread reads the row with its own cursor
+            env.cr.postcommit.add(lambda: _scheduler.schedule(dbname, payment_id, approve_seconds))
+
+        _logger.info("[MP Simulator] Created payment %s (%s) for %s", payment_id, amount, description)
+        return {
+            "status": "success",
+            "payment_id": payment_id,
+            "qr_data": qr_image_url(payment_id),
+            "preference_id": payment_id,
+        }
+
+    def check_status_batch(self, env, payments):
+        """
+        Status of simulated payments, read from the database. Payments past their
+        approval delay are approved here if the scheduler has not done it yet.
+
+        Returns:
+            dict: {payment_id: {"payment_status": str, ...}}
+        """
+        payment_ids = [p.get("payment_id") for p in payments if p.get("payment_id")]
+        transactions = env['mp.transaction'].sudo().search([('mp_payment_id', 'in', payment_ids)])
+
+        approve_seconds = self._approve_seconds(env)
+        if approve_seconds > 0:
+            cutoff = fields.Datetime.now() - timedelta(seconds=approve_seconds)
+            overdue = transactions.filtered(
+                lambda tx: tx.simulated and tx.status in ('initial', 'pending') and tx.create_date <= cutoff
+            )
+            self.approve(env, overdue.mapped('mp_payment_id'))
+        transactions._mp_record_poll()
+
+        by_payment_id = {tx.mp_payment_id: tx for tx in transactions}
+        results = {}
+        for payment_id in payment_ids:
+            tx = by_payment_id.get(payment_id)
+            if not tx or tx.status in ('initial', 'pending'):
+                results[payment_id] = {"payment_status": "pending"}
+            else:
+                results[payment_id] = {
+                    "payment_status": tx.status,
+                    "status_detail": tx.status_detail or "",
+                    "payment_id": tx.mp_real_payment_id,
+                }
+        return results
+
+    def approve(self, env, payment_ids):
+        """Approve the open simulated transactions among ``payment_ids``."""
+        transactions = env['mp.transaction'].sudo().search([
+            ('mp_payment_id', 'in', list(payment_ids)),
+            ('simulated', '=', True),
+            ('status', 'in', ('initial', 'pending')),
+        ])
+        for tx in transactions:
+            tx._mp_set_status('approved', self._payment(tx), channel='simulator')
+        if transactions:
+            _logger.info("[MP Simulator] Approved %s payment(s)", len(transactions))
+        return transactions
+
+    def _payment(self, tx):
+        """A MercadoPago-like payment dict for a simulated transaction."""
+        now = datetime.now(timezone.utc)
+        return {
+            "id": SIMULATED_PAYMENT_ID_BASE + tx.id,
+            "status": "approved",
+            "status_detail": "accredited",
+            "date_created": now.isoformat(timespec="milliseconds"),
+            "date_approved": now.isoformat(timespec="milliseconds"),
+            "external_reference": tx.external_reference,
+            "preference_id": tx.mp_payment_id,
+            "transaction_amount": tx.amount,
+            "simulated": True,
+        }
@@ -0,0 +1,33 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Move mp_transaction.raw_data (Text, rewritten on every status change) into
+    the typed columns and the JSONB raw_payload, then drop it.
+
+    Only final transactions keep their full payload; for the others raw_data
+    only held the preference, whose ID is already stored in mp_payment_id.
+    """
+    cr.execute("""
+        SELECT 1 FROM information_schema.columns
+         WHERE table_name = 'mp_transaction' AND column_name = 'raw_data'
+    """)
+    if not cr.fetchone():
+        return
+
+    # raw_data was always written with json.dumps; payments (unlike preferences) carry a "status"
+    cr.execute("""
+        UPDATE mp_transaction
+           SET raw_payload = raw_data::jsonb,
+               mp_real_payment_id = raw_data::jsonb ->> 'id',
+               status_detail = raw_data::jsonb ->> 'status_detail',
+               mp_date_created = (raw_data::jsonb ->> 'date_created')::timestamptz AT TIME ZONE 'UTC'
+         WHERE status IN ('approved', 'rejected', 'cancelled')
+           AND raw_data::jsonb ? 'status'
+    """)
+    _logger.info("[MP] Moved %s raw payment payload(s) to raw_payload", cr.rowcount)
+
+    cr.execute("ALTER TABLE mp_transaction DROP COLUMN raw_data")
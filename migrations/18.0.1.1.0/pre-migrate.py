@@ -0,0 +1,31 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """
+    Prepare mp_transaction for the indexes of 18.0.1.1.0 (see mp.transaction.init).
+
+    - Drop the single-column indexes of mp_payment_id and external_reference:
+      Odoo does not drop indexes a field no longer declares, and both are now
+      covered (unique constraint, external_reference/create_date index).
+    - Resolve duplicate mp_payment_id values, or the unique constraint cannot
+      be added. The transaction lookups already returned (newest first) keeps
+      the ID; the others get it suffixed with their own id.
+    """
+    cr.execute("DROP INDEX IF EXISTS mp_transaction__mp_payment_id_index")
+    cr.execute("DROP INDEX IF EXISTS mp_transaction__external_reference_index")
+
+    cr.execute("""
+        UPDATE mp_transaction tx
+           SET mp_payment_id = tx.mp_payment_id || '-dup-' || tx.id
+          FROM (
+            SELECT id, row_number() OVER (PARTITION BY mp_payment_id ORDER BY create_date DESC, id DESC) AS rank
+              FROM mp_transaction
+             WHERE mp_payment_id IS NOT NULL
+          ) ranked
+         WHERE ranked.id = tx.id AND ranked.rank > 1
+    """)
+    if cr.rowcount:
+        _logger.warning("[MP] Renamed %s duplicate MercadoPago preference ID(s) on mp_transaction", cr.rowcount)
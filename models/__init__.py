@@ -1,3 +1,9 @@
 from . import mp_settings
 from . import mp_transaction
+from . import mp_transaction_archive
+from . import mp_transaction_report
+from . import mp_webhook_event
+from . import pos_config
 from . import pos_payment_method
+from . import pos_session
+from . import ir_websocket
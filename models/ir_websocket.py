@@ -0,0 +1,23 @@
+from odoo import models
+
+from .mp_transaction import MP_BUS_CHANNEL_PREFIX
+
+
+class IrWebsocket(models.AbstractModel):
+    _inherit = 'ir.websocket'
+
+    def _build_bus_channel_list(self, channels):
+        """
+        Resolve "mp_pos_session_<id>" channels to the pos.session record, so
+        MercadoPago status notifications only reach users who can read the session.
+        """
+        channels = list(channels)
+        if self.env.uid:
+            for channel in [c for c in channels if isinstance(c, str) and c.startswith(MP_BUS_CHANNEL_PREFIX)]:
+                channels.remove(channel)
+                session_id = channel[len(MP_BUS_CHANNEL_PREFIX):]
+                if session_id.isdigit():
+                    session = self.env['pos.session'].search([('id', '=', int(session_id))], limit=1)
+                    if session:
+                        channels.append(session)
+        return super()._build_bus_channel_list(channels)
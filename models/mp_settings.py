@@ -1,4 +1,19 @@
-from odoo import models, fields
+from odoo import api, models, fields
+
+from ..controllers.mp_api import DEFAULT_EXPIRE_MINUTES
+from ..controllers.mp_client import get_client
+from ..controllers.mp_guard import CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN
+from ..controllers.mp_simulator import BACKEND_MERCADOPAGO, BACKEND_SIMULATOR, DEFAULT_APPROVE_SECONDS
+from .mp_transaction import DEFAULT_ARCHIVE_DAYS
+
+# Integer settings where 0 is a value of its own (feature turned off), with their default.
+# Stored by get_values/set_values: a config_parameter field deletes the parameter for 0,
+# which then reads back as the default.
+ZERO_ALLOWED_PARAMS = {
+    'mp_simulator_approve_seconds': DEFAULT_APPROVE_SECONDS,
+    'mp_tx_archive_days': DEFAULT_ARCHIVE_DAYS,
+}
+
 
 class MPSettings(models.TransientModel):
     _inherit = 'res.config.settings'
@@ -7,3 +22,73 @@ class MPSettings(models.TransientModel):
     mp_public_key = fields.Char(string="MercadoPago Public Key", config_parameter="mp_public_key")
     mp_client_id = fields.Char(string="MercadoPago Client ID", config_parameter="mp_client_id")
     mp_client_secret = fields.Char(string="MercadoPago Client Secret", config_parameter="mp_client_secret")
+
+    # Payment backend: MercadoPago, or the simulator (staging, demos, load tests)
+    mp_backend = fields.Selection(
+        [(BACKEND_MERCADOPAGO, 'MercadoPago'), (BACKEND_SIMULATOR, 'Simulator (no real payments)')],
+        string="MercadoPago Backend", config_parameter="mp_backend", default=BACKEND_MERCADOPAGO,
+    )
+    # 0 = only approved manually, see ZERO_ALLOWED_PARAMS
+    mp_simulator_approve_seconds = fields.Integer(string="Simulated Approval Delay (s)")
+
+    # Fixed QR mode, per point of sale (POS settings)
+    pos_mp_external_pos_id = fields.Char(related='pos_config_id.mp_external_pos_id', readonly=False)
+
+    # Transaction retention (sweeper cron)
+    mp_tx_expire_minutes = fields.Integer(string="Expire Unpaid QRs After (minutes)",
+                                          config_parameter="mp_tx_expire_minutes", default=DEFAULT_EXPIRE_MINUTES)
+    mp_tx_archive_days = fields.Integer(string="Archive Transactions After (days)")   # 0 = never, see ZERO_ALLOWED_PARAMS
+
+    # Webhook queue monitoring (read-only)
+    mp_webhook_queue_depth = fields.Integer(string="Pending Webhook Notifications", compute='_compute_mp_webhook_queue')
+    mp_webhook_queue_lag = fields.Float(string="Webhook Processing Lag (s)", compute='_compute_mp_webhook_queue')
+    mp_webhook_queue_failed = fields.Integer(string="Failed Webhook Notifications", compute='_compute_mp_webhook_queue')
+    mp_webhook_duplicates = fields.Integer(string="Duplicate Notifications",
+                                           compute='_compute_mp_webhook_queue')
+
+    # Preference creation: hedged second request when MercadoPago is slower than usual
+    mp_preference_hedging = fields.Boolean(string="Hedged QR Creation", config_parameter="mp_preference_hedging")
+
+    # MercadoPago API protection, shared by the workers of this server (read-only, see mp_guard)
+    mp_upstream_circuit = fields.Selection(
+        [(CIRCUIT_CLOSED, 'Closed (calls allowed)'), (CIRCUIT_OPEN, 'Open (calls suspended)'),
+         (CIRCUIT_HALF_OPEN, 'Half-open (testing MercadoPago)')],
+        string="MercadoPago Circuit", compute='_compute_mp_upstream',
+    )
+    mp_upstream_retry_after = fields.Integer(string="Calls Resume In (s)", compute='_compute_mp_upstream')
+    mp_upstream_trips = fields.Integer(string="Circuit Openings", compute='_compute_mp_upstream')
+    mp_upstream_shed = fields.Integer(string="Calls Not Sent", compute='_compute_mp_upstream',
+                                      help="Requests answered locally instead of calling MercadoPago: "
+                                           "open circuit, 429 back-off or rate limit")
+
+    @api.model
+    def get_values(self):
+        res = super().get_values()
+        params = self.env['ir.config_parameter'].sudo()
+        for name, default in ZERO_ALLOWED_PARAMS.items():
+            value = params.get_param(name)
+            res[name] = int(value) if value not in (None, False, "") else default
+        return res
+
+    def set_values(self):
+        super().set_values()
+        params = self.env['ir.config_parameter'].sudo()
+        for name in ZERO_ALLOWED_PARAMS:
+            # Stored as text: "0" is kept, unlike the integer 0
+            params.set_param(name, str(self[name]))
+
+    def _compute_mp_upstream(self):
+        status = get_client().guard.status()
+        for settings in self:
+            settings.mp_upstream_circuit = status["circuit"]
+            settings.mp_upstream_retry_after = int(status["retry_after"])
+            settings.mp_upstream_trips = status["trips"]
+            settings.mp_upstream_shed = sum(status["shed"].values())
+
+    def _compute_mp_webhook_queue(self):
+        stats = self.env['mp.webhook.event'].sudo()._get_queue_stats()
+        for settings in self:
+            settings.mp_webhook_queue_depth = stats["depth"]
+            settings.mp_webhook_queue_lag = stats["lag"]
+            settings.mp_webhook_queue_failed = stats["failed"]
+            settings.mp_webhook_duplicates = stats["duplicates"] + stats["duplicate_updates"]
@@ -1,21 +1,477 @@
-from odoo import models, fields
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from odoo import models, fields, api
+from odoo.tools import create_index
+
+from ..controllers.mp_api import (
+    FINAL_STATUSES, MPApiController, _parse_mp_datetime, attempt_reference, cache_payment_status, is_attempt_reference,
+    qr_expire_minutes,
+)
+from ..controllers.mp_guard import UpstreamUnavailable
+from ..controllers.mp_metrics import metrics
+from ..controllers.mp_simulator import BACKEND_SIMULATOR, get_backend
+
+_logger = logging.getLogger(__name__)
+
+# Sweeper defaults, overridable from the settings (ir.config_parameter)
+# Open QRs older than mp_api.DEFAULT_EXPIRE_MINUTES are expired (webhooks already ignore them after 30)
+DEFAULT_ARCHIVE_DAYS = 90      # Closed transactions older than this move to mp.transaction.archive
+PREWARM_EXPIRE_MINUTES = 10    # Pre-created QRs never shown on a payment line are expired after this
+SWEEP_BATCH_SIZE = 1000        # Rows expired or archived per database transaction
+SWEEP_MAX_BATCHES = 50         # Batches per cron run before handing over to a new run
+
+# Reconciliation cron: payments updated since the last run (checkpoint, ir.config_parameter
+# "mp_reconcile_checkpoint"), searched again with an overlap for late-indexed updates
+RECONCILE_OVERLAP = timedelta(minutes=2)
+RECONCILE_LOOKBACK = timedelta(hours=2)    # First run, or checkpoint older than this
+RECONCILE_PAGE_SIZE = 100
+RECONCILE_MAX_PAGES = 50                   # Pages per run; the next run resumes from the last one
+
+_mp_api = MPApiController()
+
+# Columns copied to the cold table (qr_data and qr_image are only useful while the QR is on screen)
+ARCHIVE_COLUMNS = (
+    'create_date', 'write_date', 'pos_order_id', 'pos_session_id', 'mp_payment_id', 'external_reference', 'pos_order_ref',
+    'status', 'amount', 'mp_real_payment_id', 'status_detail', 'mp_date_created', 'raw_payload',
+    'simulated', 'first_poll_date', 'webhook_date', 'mp_date_approved', 'pos_notified_date', 'confirm_channel',
+)
+
+# Bus channel the POS subscribes to (suffixed with the pos.session id),
+# resolved to the pos.session record by ir.websocket
+MP_BUS_CHANNEL_PREFIX = "mp_pos_session_"
+MP_BUS_STATUS_TYPE = "MP_PAYMENT_STATUS"
+
 
 class MPTransaction(models.Model):
     _name = 'mp.transaction'
     _rec_name = 'mp_payment_id'
     _description = 'MercadoPago POS Transaction'
     _order = 'create_date desc'
+    _sql_constraints = [
+        ('mp_payment_id_uniq', 'unique (mp_payment_id)', "A MercadoPago preference can only be linked to one transaction."),
+    ]
 
     pos_order_id = fields.Many2one('pos.order', string="POS Order")
-    mp_payment_id = fields.Char(index=True, string="MP Payment ID")
-    external_reference = fields.Char(index=True, string="External Reference")
+    pos_session_id = fields.Many2one('pos.session', string="POS Session", index='btree_not_null')
+    # POS order and payment line the QR was shown for, to reuse an open preference (see init())
+    # and to number the attempts of the order (see _mp_attempt_reference)
+    pos_order_uid = fields.Char(string="POS Order UID", index='btree_not_null')
+    pos_order_ref = fields.Char(string="POS Order Reference", help="Name of the POS order the QR was created for")
+    pos_payment_line_uuid = fields.Char(string="POS Payment Line UUID")
+    simulated = fields.Boolean(string="Simulated", help="Created by the simulator backend, never sent to MercadoPago")
+    prewarmed = fields.Boolean(string="Pre-created",
+                               help="Created in the background before the QR was requested (payment line set once shown)")
+    # Indexed by the unique constraint (poll, cancel and webhook lookups)
+    mp_payment_id = fields.Char(string="MP Payment ID")
+    # Indexed together with create_date, see init(); unique per QR of a POS order (_mp_attempt_reference)
+    external_reference = fields.Char(string="External Reference")
+    # Indexed for _mp_instore_active (latest order put on a POS)
+    mp_external_pos_id = fields.Char(string="MP External POS ID", index='btree_not_null',
+                                     help="Set for orders put on the fixed QR of a MercadoPago POS (static QR mode)")
     qr_data = fields.Text(string="QR Data / URL")
+    qr_image = fields.Binary(string="QR Image", attachment=True,
+                             help="PNG sent by MercadoPago, only kept when there is no QR data to render")
     status = fields.Selection([
         ('initial', 'Initial'),      # QR created, not yet scanned
         ('pending', 'Pending'),      # Payment actually pending
         ('approved', 'Approved'),
         ('rejected', 'Rejected'),
         ('cancelled', 'Cancelled'),
+        ('expired', 'Expired'),      # Abandoned QR, closed by the sweeper or the session closing
     ], string="Status", default='initial')
     amount = fields.Float(string="Amount", digits=(12, 2))
-    raw_data = fields.Text(string="Raw Response JSON")
+    # Typed copies of the payment fields the module reads; mp_payment_id above is the preference ID
+    mp_real_payment_id = fields.Char(string="MP Payment", help="ID of the MercadoPago payment made for the preference")
+    status_detail = fields.Char(string="Status Detail")
+    mp_date_created = fields.Datetime(string="MP Payment Date")
+    # Full payment as JSONB (compressed by PostgreSQL TOAST), only written on final statuses
+    raw_payload = fields.Json(string="Raw Payment")
+    # Confirmation timeline (the QR is created at create_date), analysed in mp.transaction.report
+    first_poll_date = fields.Datetime(string="First Poll", help="First status check of the POS for this QR")
+    webhook_date = fields.Datetime(string="Webhook Received",
+                                   help="First MercadoPago notification received for the payment")
+    mp_date_approved = fields.Datetime(string="MP Approval Date", help="Approval time reported by MercadoPago")
+    pos_notified_date = fields.Datetime(string="Status Sent to POS",
+                                        help="The final status was pushed over the bus or returned to a poll")
+    confirm_channel = fields.Selection([
+        ('poll', 'Poll'),              # Found by a status check of the POS
+        ('webhook', 'Webhook'),        # Applied from a MercadoPago notification
+        ('simulator', 'Simulator'),
+        ('reconcile', 'Reconciliation'),  # Found by the reconciliation cron (lost webhook, no poll)
+    ], string="Confirmed By", help="Path through which the final status reached Odoo")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        for (simulated, static), group in records.grouped(
+                lambda tx: (tx.simulated, bool(tx.mp_external_pos_id))).items():
+            metrics.inc("mp_transactions_created_total", len(group),
+                        backend="simulator" if simulated else "mercadopago", mode="static" if static else "dynamic")
+        return records
+
+    def init(self):
+        super().init()
+        # Webhook fallback and order lookups: search([('external_reference', '=', ref)], limit=1)
+        # with the default order, answered straight from the index without a sort
+        create_index(
+            self.env.cr, 'mp_transaction_external_reference_create_date_index', self._table,
+            ['external_reference', 'create_date DESC'],
+        )
+        # Open transactions only (a small, hot subset of the table): expiry and session sweeps
+        # (the predicate must match the queries of _expire_stale and pos.session exactly)
+        create_index(
+            self.env.cr, 'mp_transaction_open_create_date_index', self._table,
+            ['create_date'], where="status IN ('initial', 'pending')",
+        )
+        # Open preference of a payment line, reused when the QR popup is opened again
+        create_index(
+            self.env.cr, 'mp_transaction_open_payment_line_index', self._table,
+            ['pos_payment_line_uuid'], where="status IN ('initial', 'pending')",
+        )
+
+    def _mp_instore_active(self):
+        """
+        Whether this order is the one currently on the fixed QR of its MercadoPago POS.
+
+        A POS holds only the last order put on it, and every PUT creates a
+        transaction, so the order on the POS is the latest transaction of that
+        mp_external_pos_id: an older one may no longer be reused or taken off the POS.
+
+        Returns:
+            bool: False for dynamic QRs and replaced orders
+        """
+        self.ensure_one()
+        if not self.mp_external_pos_id:
+            return False
+        return self.search([('mp_external_pos_id', '=', self.mp_external_pos_id)], order='id desc', limit=1) == self
+
+    @api.model
+    def _mp_attempt_reference(self, pos_order_uid, pos_payment_line_uuid=None):
+        """
+        External reference of a new QR for a POS order.
+
+        Made of the order uid, the payment line (or "pre" for a pre-created QR)
+        and the number of QRs the order already had plus one, so each reference
+        belongs to a single transaction: payment searches, webhook lookups and
+        reconciliation find exactly one record, without comparing dates. The
+        transaction keeps the order uid and name (reverse mapping).
+
+        A call retried after a timeout, before its transaction was created, gets
+        the same reference, hence the same idempotency key (MPApiController._preference_idempotency_key).
+
+        Args:
+            pos_order_uid: POS order uid
+            pos_payment_line_uuid: Optional POS payment line uuid (None when pre-created)
+
+        Returns:
+            str: The external reference
+        """
+        attempt = self.sudo().search_count([('pos_order_uid', '=', pos_order_uid)]) + 1
+        return attempt_reference(pos_order_uid, pos_payment_line_uuid, attempt)
+
+    def _mp_set_status(self, status, payment=None, channel=None, payments=None, notify=True):
+        """
+        Update the transaction status and push it to the POS over the bus.
+
+        Every status change (webhook, poll, cancellation) goes through this
+        method so the POS can react without polling, and the worker's status
+        cache is updated once the transaction is committed (write-through).
+        Transactions moving to the same status are updated together: one
+        write of the status for all of them, one bus message per POS session.
+
+        Args:
+            status: New MercadoPago status
+            payment: Optional MercadoPago payment dict; its typed fields are always
+                stored, the full payload only once the status is final
+            channel: Optional path that found the status ("poll", "webhook" or
+                "simulator"), recorded in the confirmation timeline
+            payments: Optional {transaction id: payment dict}, instead of payment
+                when the transactions were updated from different payments
+            notify: False when the caller pushes the statuses itself, together with
+                those of other updates (see _mp_notify_status)
+        """
+        if payments is None:
+            payments = dict.fromkeys(self.ids, payment) if payment is not None else {}
+        vals = {'status': status}
+        if status in FINAL_STATUSES and channel:
+            vals['confirm_channel'] = channel
+        self.write(vals)
+        # Typed fields of each payment: a value per transaction, flushed with the status
+        for tx in self.filtered(lambda tx: payments.get(tx.id) is not None):
+            tx_payment = payments[tx.id]
+            date_created = _parse_mp_datetime(tx_payment.get('date_created'))
+            date_approved = _parse_mp_datetime(tx_payment.get('date_approved'))
+            payment_vals = {
+                'mp_real_payment_id': str(tx_payment['id']) if tx_payment.get('id') else False,
+                'status_detail': tx_payment.get('status_detail') or False,
+                'mp_date_created': date_created.replace(tzinfo=None) if date_created else False,
+                'mp_date_approved': date_approved.replace(tzinfo=None) if date_approved else False,
+            }
+            if status in FINAL_STATUSES:
+                payment_vals['raw_payload'] = tx_payment
+            tx.write(payment_vals)
+        if status in FINAL_STATUSES:
+            # The POS gets the status now: in the answer to its poll, or over the bus
+            self.filtered(lambda tx: channel == 'poll' or tx.pos_session_id).write({
+                'pos_notified_date': fields.Datetime.now(),
+            })
+        if notify:
+            self._mp_notify_status(payments)
+
+        dbname = self.env.cr.dbname
+        updates = [(tx.mp_payment_id, tx._mp_status_payload(payments.get(tx.id))) for tx in self]
+
+        @self.env.cr.postcommit.add
+        def _write_through():
+            for payment_id, result in updates:
+                cache_payment_status(dbname, payment_id, result)
+
+    def _mp_record_poll(self):
+        """Confirmation timeline of polled transactions: first poll, final status returned to the POS."""
+        now = fields.Datetime.now()
+        self.filtered(lambda tx: not tx.first_poll_date).write({'first_poll_date': now})
+        self.filtered(lambda tx: tx.status in FINAL_STATUSES and not tx.pos_notified_date).write({
+            'pos_notified_date': now,
+        })
+
+    def _mp_status_payload(self, payment=None):
+        """Status of the transaction as reported to the POS."""
+        self.ensure_one()
+        return {
+            'payment_id': self.mp_payment_id,
+            'external_reference': self.external_reference,
+            # "initial" and "pending" both mean "not yet completed" for the POS
+            'payment_status': 'pending' if self.status in ('initial', 'pending') else self.status,
+            'status_detail': (payment or {}).get('status_detail') or self.status_detail or '',
+        }
+
+    def _mp_notify_status(self, payments=None):
+        """
+        Send the current status of the transactions on their POS session channel:
+        one message per session, with the list of its transactions' statuses.
+
+        Args:
+            payments: Optional {transaction id: MercadoPago payment dict}
+        """
+        payments = payments or {}
+        notifications = [
+            (session, MP_BUS_STATUS_TYPE, [tx._mp_status_payload(payments.get(tx.id)) for tx in transactions])
+            for session, transactions in self.filtered('pos_session_id').grouped('pos_session_id').items()
+        ]
+        if notifications:
+            self.env['bus.bus'].sudo()._sendmany(notifications)
+
+    @api.model
+    def _cron_sweep(self, batch_size=SWEEP_BATCH_SIZE, max_batches=SWEEP_MAX_BATCHES):
+        """
+        Expire abandoned QRs, move old closed transactions to the cold table and
+        delete old processed webhook notifications. One database transaction per
+        batch; if work is left after max_batches, another run is triggered.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        expire_minutes = qr_expire_minutes(self.env)
+        # "0" (archiving turned off, see mp_settings.ZERO_ALLOWED_PARAMS) is kept; only a missing value is defaulted
+        archive_days = params.get_param('mp_tx_archive_days')
+        archive_days = int(archive_days) if archive_days not in (None, False, "") else DEFAULT_ARCHIVE_DAYS
+
+        for _batch in range(max_batches):
+            done = self._expire_unclaimed(batch_size) < batch_size
+            done = self._expire_stale(expire_minutes, batch_size) < batch_size and done
+            if archive_days > 0:
+                done = self._archive_old(archive_days, batch_size) < batch_size and done
+            done = self.env['mp.webhook.event']._purge_processed(batch_size) < batch_size and done
+            self.env.cr.commit()
+            if done:
+                break
+        else:
+            self.env.ref('pos_mercadopago_qr.ir_cron_mp_transaction_sweep')._trigger()
+
+    @api.model
+    def _cron_reconcile(self, page_size=RECONCILE_PAGE_SIZE, max_pages=RECONCILE_MAX_PAGES):
+        """
+        Resolve open transactions from the payments updated in MercadoPago since the last run.
+
+        Pages once through /v1/payments/search by date_last_updated, whatever the
+        number of open transactions, matches the payments in memory (preference
+        ID first, then external_reference as the status checks do) and updates
+        the transactions in one pass. A lost webhook is caught here even when no
+        POS is polling the QR anymore.
+        """
+        if get_backend(self.env) == BACKEND_SIMULATOR:
+            return
+        params = self.env['ir.config_parameter'].sudo()
+        now = datetime.now(timezone.utc)
+        checkpoint = _parse_mp_datetime(params.get_param('mp_reconcile_checkpoint'))
+        begin = max(checkpoint - RECONCILE_OVERLAP, now - RECONCILE_LOOKBACK) if checkpoint else now - RECONCILE_LOOKBACK
+
+        open_transactions = self.sudo().search([
+            ('status', 'in', ('initial', 'pending')), ('simulated', '=', False),
+        ])
+        token = _mp_api._get_access_token(self.env)
+        if not open_transactions or not token:
+            # Nothing to resolve: move on without calling MercadoPago
+            params.set_param('mp_reconcile_checkpoint', now.isoformat())
+            return
+
+        by_preference = {tx.mp_payment_id: tx for tx in open_transactions if tx.mp_payment_id}
+        by_reference = defaultdict(list)
+        for tx in open_transactions.sorted('create_date', reverse=True):
+            if tx.external_reference:
+                by_reference[tx.external_reference].append(tx)
+
+        matched = {}   # tx -> last updated payment
+        checkpoint = now
+        offset = 0
+        try:
+            for _page in range(max_pages):
+                page = _mp_api._search_mp_payments_page(token, begin, now, offset=offset, limit=page_size)
+                if page["status_code"] != 200:
+                    _logger.warning("[MP] Reconciliation stopped: search returned %s", page["status_code"])
+                    return
+                for payment in page["results"]:
+                    tx = self._reconcile_match(payment, by_preference, by_reference)
+                    if tx:
+                        matched[tx] = payment   # oldest update first: the latest one wins
+                offset += len(page["results"])
+                if not page["results"] or offset >= page["total"]:
+                    break
+            else:
+                # Too many updates for one run: resume after the last page read
+                checkpoint = _parse_mp_datetime(page["results"][-1].get("date_last_updated")) or begin
+                self.env.ref('pos_mercadopago_qr.ir_cron_mp_reconcile')._trigger()
+        except UpstreamUnavailable as e:
+            _logger.info("[MP] Reconciliation postponed: %s", e)
+            return
+
+        by_status = defaultdict(dict)   # status -> {tx id: payment}
+        known_statuses = dict(self._fields['status'].selection)
+        for tx, payment in matched.items():
+            status = payment.get("status", "pending")
+            # MercadoPago statuses without a local equivalent (in_process, authorized...) are left to the polls
+            if status != tx.status and status in known_statuses:
+                by_status[status][tx.id] = payment
+        # One status write per target status, then one bus message per POS session for all of them
+        updated = open_transactions.browse()
+        for status, payments in by_status.items():
+            transactions = open_transactions.browse(list(payments))
+            transactions._mp_set_status(status, channel='reconcile', payments=payments, notify=False)
+            updated |= transactions
+        updated._mp_notify_status({tx_id: p for payments in by_status.values() for tx_id, p in payments.items()})
+        # Single write pass: the status updates of all the transactions are flushed together
+        self.env.flush_all()
+        params.set_param('mp_reconcile_checkpoint', checkpoint.isoformat())
+        if updated:
+            _logger.info("[MP] Reconciliation updated %s transaction(s) from %s payment update(s)",
+                         len(updated), offset)
+
+    @api.model
+    def _reconcile_match(self, payment, by_preference, by_reference):
+        """
+        Open transaction of a payment from the reconciliation search, or an empty
+        recordset. Same rules as PaymentIndex.match (status checks): a payment with
+        a preference ID only matches that preference; one without matches the
+        transaction of its per-attempt external_reference, or for an order name,
+        the newest transaction of it created before the payment.
+        """
+        preference_id = payment.get("preference_id")
+        if preference_id:
+            return by_preference.get(str(preference_id), self.browse())
+        transactions = by_reference.get(payment.get("external_reference"), [])
+        if transactions and is_attempt_reference(payment.get("external_reference")):
+            return transactions[0]
+        payment_date = _parse_mp_datetime(payment.get("date_created"))
+        if not payment_date:
+            return self.browse()
+        for tx in transactions:
+            if tx.create_date.replace(tzinfo=timezone.utc) <= payment_date:
+                return tx
+        return self.browse()
+
+    @api.model
+    def _expire_stale(self, expire_minutes, batch_size):
+        """
+        Expire one batch of open transactions older than expire_minutes.
+
+        Returns:
+            int: Number of expired transactions
+        """
+        cutoff = fields.Datetime.now() - timedelta(minutes=expire_minutes)
+        # SKIP LOCKED: rows being updated by a poll or a webhook are left for the next run
+        self.env.cr.execute("""
+            SELECT id FROM mp_transaction
+             WHERE status IN ('initial', 'pending') AND create_date < %s
+             ORDER BY create_date
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [cutoff, batch_size])
+        stale = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if stale:
+            stale._mp_set_status('expired')
+            _logger.info("[MP] Expired %s transaction(s) older than %s minutes", len(stale), expire_minutes)
+        return len(stale)
+
+    @api.model
+    def _expire_unclaimed(self, batch_size):
+        """
+        Expire one batch of pre-created QRs that were never shown (the order was
+        paid another way or abandoned). Nobody saw them, so no bus notification.
+
+        Returns:
+            int: Number of expired transactions
+        """
+        cutoff = fields.Datetime.now() - timedelta(minutes=PREWARM_EXPIRE_MINUTES)
+        self.env.cr.execute("""
+            UPDATE mp_transaction SET status = 'expired', write_date = now() at time zone 'UTC'
+             WHERE id IN (
+                SELECT id FROM mp_transaction
+                 WHERE status IN ('initial', 'pending') AND create_date < %s
+                   AND prewarmed AND pos_payment_line_uuid IS NULL
+                 ORDER BY create_date
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+             )
+        """, [cutoff, batch_size])
+        if self.env.cr.rowcount:
+            self.invalidate_model(['status'])
+        return self.env.cr.rowcount
+
+    @api.model
+    def _archive_old(self, archive_days, batch_size):
+        """
+        Move one batch of closed transactions older than archive_days to mp.transaction.archive.
+
+        Returns:
+            int: Number of archived transactions
+        """
+        cutoff = fields.Datetime.now() - timedelta(days=archive_days)
+        self.env.cr.execute("""
+            SELECT id FROM mp_transaction
+             WHERE status NOT IN ('initial', 'pending') AND create_date < %s
+             ORDER BY id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [cutoff, batch_size])
+        ids = [row[0] for row in self.env.cr.fetchall()]
+        if not ids:
+            return 0
+
+        # Only transactions without QR data kept a PNG attachment; unlink them through
+        # the ORM so their files are garbage-collected from the filestore
+        self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name), ('res_field', '=', 'qr_image'), ('res_id', 'in', ids),
+        ]).unlink()
+
+        columns = ", ".join(ARCHIVE_COLUMNS)
+        self.env.cr.execute(f"""
+            WITH moved AS (
+                DELETE FROM mp_transaction WHERE id = ANY(%s)
+                RETURNING id, {columns}
+            )
+            INSERT INTO mp_transaction_archive (transaction_id, create_uid, write_uid, {columns})
+            SELECT id, %s, %s, {columns} FROM moved
+        """, [ids, self.env.uid, self.env.uid])
+        self.invalidate_model()
+        _logger.info("[MP] Archived %s transaction(s) older than %s days", len(ids), archive_days)
+        return len(ids)
@@ -0,0 +1,39 @@
+from odoo import models, fields
+
+
+class MPTransactionArchive(models.Model):
+    """
+    Cold storage for closed mp.transaction rows, filled by the sweeper cron.
+
+    Rows are moved here with plain SQL (see mp.transaction._archive_old) and
+    never read by the payment flows, so the hot table stays small.
+    """
+    _name = 'mp.transaction.archive'
+    _rec_name = 'mp_payment_id'
+    _description = 'MercadoPago POS Transaction (Archived)'
+    _order = 'create_date desc'
+
+    transaction_id = fields.Integer(string="Original Transaction ID", readonly=True)
+    pos_order_id = fields.Many2one('pos.order', string="POS Order", readonly=True)
+    pos_session_id = fields.Many2one('pos.session', string="POS Session", readonly=True)
+    mp_payment_id = fields.Char(string="MP Payment ID", index=True, readonly=True)
+    external_reference = fields.Char(string="External Reference", index=True, readonly=True)
+    pos_order_ref = fields.Char(string="POS Order Reference", index=True, readonly=True)
+    status = fields.Selection(selection='_selection_status', string="Status", readonly=True)
+    amount = fields.Float(string="Amount", digits=(12, 2), readonly=True)
+    mp_real_payment_id = fields.Char(string="MP Payment", readonly=True)
+    status_detail = fields.Char(string="Status Detail", readonly=True)
+    mp_date_created = fields.Datetime(string="MP Payment Date", readonly=True)
+    raw_payload = fields.Json(string="Raw Payment", readonly=True)
+    simulated = fields.Boolean(string="Simulated", readonly=True)
+    first_poll_date = fields.Datetime(string="First Poll", readonly=True)
+    webhook_date = fields.Datetime(string="Webhook Received", readonly=True)
+    mp_date_approved = fields.Datetime(string="MP Approval Date", readonly=True)
+    pos_notified_date = fields.Datetime(string="Status Sent to POS", readonly=True)
+    confirm_channel = fields.Selection(selection='_selection_confirm_channel', string="Confirmed By", readonly=True)
+
+    def _selection_status(self):
+        return self.env['mp.transaction']._fields['status'].selection
+
+    def _selection_confirm_channel(self):
+        return self.env['mp.transaction']._fields['confirm_channel'].selection
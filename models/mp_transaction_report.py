@@ -0,0 +1,102 @@
+from odoo import models, fields, tools
+from odoo.models import parse_read_group_spec
+from odoo.tools import SQL
+
+# Aggregators of the report measures, computed by PostgreSQL (see _read_group_select)
+PERCENTILE_AGGREGATES = {'p50': 0.5, 'p90': 0.9, 'p95': 0.95, 'p99': 0.99}
+
+
+class MPTransactionReport(models.Model):
+    """
+    Time to confirm approved MercadoPago payments, from the confirmation
+    timeline of mp.transaction (live and archived rows).
+
+    Each duration exists as one measure per percentile (confirm_p50,
+    confirm_p90...): a pivot measure has a single aggregator, and percentiles
+    must be computed on the rows of each cell, they cannot be summed up from
+    finer groups.
+    """
+    _name = 'mp.transaction.report'
+    _description = 'MercadoPago Confirmation Times'
+    _auto = False
+    _order = 'create_date desc'
+    _rec_name = 'mp_payment_id'
+
+    mp_payment_id = fields.Char(string="MP Payment ID", readonly=True)
+    external_reference = fields.Char(string="External Reference", readonly=True)
+    pos_order_ref = fields.Char(string="POS Order Reference", readonly=True)
+    create_date = fields.Datetime(string="QR Created", readonly=True)
+    pos_session_id = fields.Many2one('pos.session', string="POS Session", readonly=True)
+    pos_config_id = fields.Many2one('pos.config', string="Point of Sale", readonly=True)
+    confirm_channel = fields.Selection(selection='_selection_confirm_channel', string="Confirmed By", readonly=True)
+    simulated = fields.Boolean(string="Simulated", readonly=True)
+    amount = fields.Float(string="Amount", digits=(12, 2), readonly=True)
+
+    # Durations in seconds
+    confirm_p50 = fields.Float(string="Time to Confirm (p50)", readonly=True, aggregator='p50',
+                               help="QR created to status sent to the POS")
+    confirm_p90 = fields.Float(string="Time to Confirm (p90)", readonly=True, aggregator='p90')
+    confirm_p99 = fields.Float(string="Time to Confirm (p99)", readonly=True, aggregator='p99')
+    approval_p50 = fields.Float(string="Time to Approval (p50)", readonly=True, aggregator='p50',
+                                help="QR created to payment approved by MercadoPago")
+    approval_p90 = fields.Float(string="Time to Approval (p90)", readonly=True, aggregator='p90')
+    surface_delay_p50 = fields.Float(string="Approval to POS (p50)", readonly=True, aggregator='p50',
+                                     help="Payment approved by MercadoPago to status sent to the POS")
+    surface_delay_p90 = fields.Float(string="Approval to POS (p90)", readonly=True, aggregator='p90')
+    webhook_delay_p50 = fields.Float(string="Approval to Webhook (p50)", readonly=True, aggregator='p50',
+                                     help="Payment approved by MercadoPago to its first notification received")
+    webhook_delay_p90 = fields.Float(string="Approval to Webhook (p90)", readonly=True, aggregator='p90')
+    first_poll_delay = fields.Float(string="QR to First Poll", readonly=True, aggregator='avg')
+
+    def _selection_confirm_channel(self):
+        return self.env['mp.transaction']._fields['confirm_channel'].selection
+
+    def _read_group_select(self, aggregate_spec, query):
+        fname, _property_name, func = parse_read_group_spec(aggregate_spec)
+        if func not in PERCENTILE_AGGREGATES:
+            return super()._read_group_select(aggregate_spec, query)
+        if fname not in self._fields:
+            raise ValueError(f"Invalid field {fname!r} on model {self._name!r}")
+        return SQL(
+            "percentile_cont(%s) WITHIN GROUP (ORDER BY %s)",
+            PERCENTILE_AGGREGATES[func], self._field_to_sql(self._table, fname, query),
+        )
+
+    def _select_transactions(self, table, id_column):
+        seconds = "EXTRACT(EPOCH FROM ({} - {}))::float".format
+        return f"""
+            SELECT t.{id_column} AS id,
+                   t.mp_payment_id,
+                   t.external_reference,
+                   t.pos_order_ref,
+                   t.create_date,
+                   t.pos_session_id,
+                   s.config_id AS pos_config_id,
+                   t.confirm_channel,
+                   COALESCE(t.simulated, FALSE) AS simulated,
+                   t.amount,
+                   {seconds('t.pos_notified_date', 't.create_date')} AS confirm_p50,
+                   {seconds('t.pos_notified_date', 't.create_date')} AS confirm_p90,
+                   {seconds('t.pos_notified_date', 't.create_date')} AS confirm_p99,
+                   {seconds('t.mp_date_approved', 't.create_date')} AS approval_p50,
+                   {seconds('t.mp_date_approved', 't.create_date')} AS approval_p90,
+                   {seconds('t.pos_notified_date', 't.mp_date_approved')} AS surface_delay_p50,
+                   {seconds('t.pos_notified_date', 't.mp_date_approved')} AS surface_delay_p90,
+                   {seconds('t.webhook_date', 't.mp_date_approved')} AS webhook_delay_p50,
+                   {seconds('t.webhook_date', 't.mp_date_approved')} AS webhook_delay_p90,
+                   {seconds('t.first_poll_date', 't.create_date')} AS first_poll_delay
+              FROM {table} t
+              LEFT JOIN pos_session s ON s.id = t.pos_session_id
+             WHERE t.status = 'approved'
+        """
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        # Archived rows keep the id of the transaction they were moved from
+        self.env.cr.execute(f"""
+            CREATE OR REPLACE VIEW {self._table} AS (
+                {self._select_transactions('mp_transaction', 'id')}
+                UNION ALL
+                {self._select_transactions('mp_transaction_archive', 'transaction_id')}
+            )
+        """)
@@ -0,0 +1,410 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from odoo import models, fields, api
+from odoo.tools import index_exists
+
+from ..controllers.mp_api import FINAL_STATUSES, MAX_CONCURRENT_SEARCHES, MPApiController, _parse_mp_datetime
+from ..controllers.mp_client import get_client
+from ..controllers.mp_metrics import DELAY_BUCKETS, counter_total, metrics
+
+_logger = logging.getLogger(__name__)
+
+WEBHOOK_BATCH_SIZE = 50        # Notifications processed per transaction
+WEBHOOK_MAX_BATCHES = 20       # Batches per cron run before handing over to a new run
+WEBHOOK_MAX_ATTEMPTS = 5       # Upstream fetch attempts before an event is marked failed
+# Retention of processed notifications (sweeper cron, see _purge_processed)
+WEBHOOK_DONE_RETENTION_DAYS = 7
+WEBHOOK_FAILED_RETENTION_DAYS = 30   # Kept longer: they may need to be looked into
+
+_mp_api = MPApiController()
+
+
+class MPWebhookEvent(models.Model):
+    _name = 'mp.webhook.event'
+    _description = 'MercadoPago Webhook Notification'
+    _order = 'id'
+    _rec_name = 'resource_id'
+
+    resource_id = fields.Char(string="MP Payment ID", required=True, index=True)
+    action = fields.Char(string="Action")
+    notification_id = fields.Char(string="MP Notification ID")
+    payload = fields.Text(string="Raw Notification JSON")
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),   # Claimed by the queue cron (see _claim_batch)
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], string="State", default='pending', required=True, index=True)
+    result = fields.Char(string="Result")
+    attempts = fields.Integer(string="Attempts", default=0)
+    error = fields.Text(string="Last Error")
+    processed_at = fields.Datetime(string="Processed At")
+
+    def init(self):
+        super().init()
+        # Duplicate notifications are rejected by these indexes (see _enqueue), so
+        # deduplication holds across workers and only counts committed events.
+        # Redelivery of a notification already received (a failed one may come again)
+        if not index_exists(self.env.cr, 'mp_webhook_event_notification_uniq'):
+            self.env.cr.execute("""
+                CREATE UNIQUE INDEX mp_webhook_event_notification_uniq
+                    ON mp_webhook_event (resource_id, COALESCE(action, ''), notification_id)
+                 WHERE notification_id IS NOT NULL AND state != 'failed'
+            """)
+        # At most one pending notification per payment and action; claimed ones ("processing")
+        # are out of it, so a notification received while they are fetched is queued
+        if not index_exists(self.env.cr, 'mp_webhook_event_pending_uniq'):
+            # Pending duplicates queued before the index existed: keep the oldest
+            self.env.cr.execute("""
+                UPDATE mp_webhook_event e
+                   SET state = 'done', result = 'duplicate', processed_at = now() at time zone 'UTC'
+                 WHERE e.state = 'pending'
+                   AND EXISTS (SELECT 1 FROM mp_webhook_event o
+                                WHERE o.state = 'pending' AND o.id < e.id
+                                  AND o.resource_id = e.resource_id
+                                  AND COALESCE(o.action, '') = COALESCE(e.action, ''))
+            """)
+            self.env.cr.execute("""
+                CREATE UNIQUE INDEX mp_webhook_event_pending_uniq
+                    ON mp_webhook_event (resource_id, COALESCE(action, ''))
+                 WHERE state = 'pending'
+            """)
+
+    @api.model
+    def _enqueue(self, resource_id, action, payload):
+        """
+        Store a notification and wake up the queue cron.
+        Called by the webhook endpoint, which answers MercadoPago right after.
+
+        A notification is a duplicate, acknowledged without any row, when:
+        - the same notification (MercadoPago's notification "id") was already
+          received and did not fail (redelivery), or
+        - a notification for the same payment and action is still pending in the
+          queue, not yet claimed by the queue cron: processing it fetches the
+          latest payment state anyway.
+        Both are checked by unique indexes (see init) in the transaction of the
+        insert: a redelivery reaching another worker is still a duplicate, and a
+        notification whose request rolled back is accepted when it comes again.
+
+        Returns:
+            mp.webhook.event: The queued event, or an empty recordset for a duplicate
+        """
+        metrics.inc("mp_webhook_notifications_total", outcome="received")
+        notification_id = payload.get("id") if isinstance(payload.get("data"), dict) else None
+        self.flush_model(['resource_id', 'action', 'notification_id', 'state'])
+        self.env.cr.execute("""
+            INSERT INTO mp_webhook_event (resource_id, action, notification_id, payload, state, attempts,
+                                          create_uid, write_uid, create_date, write_date)
+            VALUES (%s, %s, %s, %s, 'pending', 0, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        """, [
+            resource_id, action, str(notification_id) if notification_id else None, json.dumps(payload),
+            self.env.uid, self.env.uid,
+        ])
+        row = self.env.cr.fetchone()
+        if not row:
+            metrics.inc("mp_webhook_notifications_total", outcome="duplicate")
+            _logger.info("[MP Webhook] Duplicate notification for payment %s (%s) ignored", resource_id, action)
+            return self.browse()
+
+        self.env.ref('pos_mercadopago_qr.ir_cron_mp_webhook_queue')._trigger()
+        return self.browse(row[0])
+
+    @api.model
+    def _cron_process_queue(self, batch_size=WEBHOOK_BATCH_SIZE, max_batches=WEBHOOK_MAX_BATCHES):
+        """
+        Drain the queue in batches. Each batch is claimed and committed before its
+        payments are fetched, then processed in its own database transaction.
+        If the queue is still not empty after max_batches, another run is triggered.
+        """
+        for _batch in range(max_batches):
+            events = self._claim_batch(batch_size)
+            if not events:
+                break
+            # Claimed events leave the pending unique index (see init): a notification
+            # received while their payments are fetched is queued, not dropped as a duplicate
+            self.env.cr.commit()
+            processed = events._process_batch()
+            self.env.cr.commit()
+            if not processed:
+                break
+        else:
+            self.env.ref('pos_mercadopago_qr.ir_cron_mp_webhook_queue')._trigger()
+
+    @api.model
+    def _claim_batch(self, batch_size):
+        """
+        Claim one batch of queued notifications: pending ones, and claimed ones left
+        for another attempt (failed fetch, request not sent) or by an interrupted run.
+
+        While MercadoPago calls are suspended (open circuit, 429 Retry-After),
+        nothing is claimed: the notifications stay queued without using up
+        their attempts, and the queue is resumed when the back-off ends.
+
+        Returns:
+            mp.webhook.event: The claimed events, in state "processing"
+        """
+        backoff = get_client().guard.status()["retry_after"]
+        if backoff:
+            _logger.info("[MP Webhook] MercadoPago calls suspended, queue resumes in %.0f s", backoff)
+            self.env.ref('pos_mercadopago_qr.ir_cron_mp_webhook_queue')._trigger(
+                at=fields.Datetime.now() + timedelta(seconds=backoff)
+            )
+            return self.browse()
+
+        self.flush_model(['state'])
+        # SKIP LOCKED: events being processed by another run (locked, see _process_batch) are left to it
+        self.env.cr.execute("""
+            UPDATE mp_webhook_event
+               SET state = 'processing', write_date = now() at time zone 'UTC'
+             WHERE id IN (
+                SELECT id FROM mp_webhook_event
+                 WHERE state IN ('pending', 'processing')
+                 ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+             )
+            RETURNING id
+        """, [batch_size])
+        ids = sorted(row[0] for row in self.env.cr.fetchall())
+        self.invalidate_model(['state', 'write_date'])
+        return self.browse(ids)
+
+    def _process_batch(self):
+        """
+        Process a batch of claimed notifications (see _claim_batch).
+
+        Payments are fetched concurrently (one fetch per distinct payment, however
+        many notifications it got), then applied sequentially in this transaction.
+        Notifications whose fetch failed or was not sent stay claimed, for the next batch.
+
+        Returns:
+            bool: False if there was nothing to process, or no fetch could be sent
+        """
+        if not self:
+            return False
+        # Locked until this transaction ends: another run does not claim them again meanwhile
+        self.env.cr.execute("""
+            SELECT id FROM mp_webhook_event
+             WHERE id IN %s AND state = 'processing'
+               FOR UPDATE SKIP LOCKED
+        """, [tuple(self.ids)])
+        events = self.browse([row[0] for row in self.env.cr.fetchall()])
+        if not events:
+            return False
+
+        now = fields.Datetime.now()
+        token = _mp_api._get_access_token(self.env)
+        if not token:
+            _logger.warning("[MP Webhook] Missing access token, %s notification(s) failed", len(events))
+            events.write({'state': 'failed', 'error': 'no_token', 'processed_at': now})
+            return True
+
+        resource_ids = list(set(events.mapped('resource_id')))
+        with ThreadPoolExecutor(max_workers=min(len(resource_ids), MAX_CONCURRENT_SEARCHES)) as executor:
+            fetched = dict(zip(resource_ids, executor.map(
+                lambda resource_id: _mp_api._fetch_mp_payment(token, resource_id), resource_ids
+            )))
+
+        if all(fetch.get("shed") for fetch in fetched.values()):
+            # Nothing sent (e.g. rate limited, which sets no back-off): resume once the guard lets
+            # requests through again instead of selecting the same notifications right away
+            delay = max(fetch["retry_after"] for fetch in fetched.values())
+            _logger.info("[MP Webhook] MercadoPago calls shed, queue resumes in %.1f s", delay)
+            self.env.ref('pos_mercadopago_qr.ir_cron_mp_webhook_queue')._trigger(
+                at=fields.Datetime.now() + timedelta(seconds=max(delay, 1))
+            )
+            return False
+
+        for resource_id, group in events.grouped('resource_id').items():
+            fetch = fetched[resource_id]
+            if fetch.get("shed"):
+                continue  # Not sent (back-off started during the batch): left claimed as is
+            if not fetch["payment"]:
+                _logger.warning("[MP Webhook] MP fetch failed %s: %s", fetch["status_code"], fetch["error"])
+                for event in group:
+                    attempts = event.attempts + 1
+                    event.write({
+                        'attempts': attempts,
+                        'error': f"{fetch['status_code'] or 'request_failed'}: {fetch['error']}",
+                        # Retried by the next batch; back to "pending" could clash with a newer notification
+                        'state': 'failed' if attempts >= WEBHOOK_MAX_ATTEMPTS else 'processing',
+                        'processed_at': now,
+                    })
+                continue
+
+            # A status already applied (e.g. payment.created then payment.updated) is "unchanged"
+            result = self._apply_payment(fetch["payment"], received_at=min(group.mapped('create_date')))
+            metrics.inc("mp_webhook_events_processed_total", len(group), result=result)
+            self._observe_delays(group, fetch["payment"])
+            for event in group:
+                event.write({
+                    'state': 'done',
+                    'result': result,
+                    'attempts': event.attempts + 1,
+                    'error': False,
+                    'processed_at': now,
+                })
+        return True
+
+    def _observe_delays(self, events, payment):
+        """Record how late the notifications arrived and how long they waited in the queue."""
+        now = datetime.now(timezone.utc)
+        updated_at = _parse_mp_datetime(payment.get("date_last_updated") or payment.get("date_created"))
+        for event in events:
+            received_at = event.create_date.replace(tzinfo=timezone.utc)
+            metrics.observe("mp_webhook_queue_lag_seconds", (now - received_at).total_seconds(),
+                            buckets=DELAY_BUCKETS)
+            if updated_at:
+                metrics.observe("mp_webhook_delivery_delay_seconds",
+                                max(0.0, (received_at - updated_at).total_seconds()), buckets=DELAY_BUCKETS)
+
+    @api.model
+    def _apply_payment(self, payment, received_at=None):
+        """
+        Update the local transaction of a payment fetched from MercadoPago.
+
+        Args:
+            payment: MercadoPago payment dict
+            received_at: Optional time the notification was received, recorded in
+                the confirmation timeline of the transaction
+
+        Returns:
+            str: "updated", "unchanged", "not_found", "already_final", "too_old" or "invalid_state"
+        """
+        payment_id = payment.get("id")
+        status = payment.get("status", "pending")
+        preference_id = payment.get("preference_id")
+        external_reference = payment.get("external_reference")
+
+        _logger.info(
+            "[MP Webhook] Payment %s: status=%s, preference_id=%s, external_ref=%s",
+            payment_id, status, preference_id, external_reference
+        )
+
+        # Find local transaction
+        # We stored preference_id as mp_payment_id when creating the preference
+        Transaction = self.env['mp.transaction'].sudo()
+        tx = Transaction
+
+        # First try to find by preference_id (what we stored as mp_payment_id)
+        if preference_id:
+            tx = Transaction.search([('mp_payment_id', '=', str(preference_id))], limit=1)
+
+        # Fallback: find by external_reference (unique per QR, see mp.transaction._mp_attempt_reference)
+        if not tx and external_reference:
+            tx = Transaction.search([('external_reference', '=', external_reference)], limit=1)
+
+        if not tx:
+            _logger.warning(
+                "[MP Webhook] No transaction found for payment_id=%s pref=%s ext_ref=%s",
+                payment_id, preference_id, external_reference
+            )
+            return "not_found"
+
+        if received_at and not tx.webhook_date:
+            tx.webhook_date = received_at
+
+        old_status = tx.status
+
+        # SAFEGUARD 1: Don't update if already in final state
+        # This prevents webhooks from old payments overwriting new transactions
+        if old_status in FINAL_STATUSES:
+            _logger.info(
+                "[MP Webhook] Transaction %s already in final state %s, ignoring update to %s",
+                tx.id, old_status, status
+            )
+            return "already_final"
+
+        # SAFEGUARD 2: Only update if transaction is recent (within 30 minutes)
+        # This prevents delayed webhooks from previous orders updating new transactions
+        # Odoo stores naive datetime in UTC, so we compare with UTC
+        tx_create_date_utc = tx.create_date.replace(tzinfo=timezone.utc)
+        age_minutes = (datetime.now(timezone.utc) - tx_create_date_utc).total_seconds() / 60
+
+        if age_minutes > 30:
+            _logger.warning(
+                "[MP Webhook] Transaction %s is too old (%.1f minutes), ignoring update. "
+                "This prevents old webhooks from affecting new transactions.",
+                tx.id, age_minutes
+            )
+            return "too_old"
+
+        # SAFEGUARD 3: Only update if current status is "initial" or "pending"
+        # This ensures we only update transactions that are still waiting for payment
+        if old_status not in ('initial', 'pending'):
+            _logger.info(
+                "[MP Webhook] Transaction %s has status %s (not initial/pending), ignoring update to %s",
+                tx.id, old_status, status
+            )
+            return "invalid_state"
+
+        # Same status already stored (e.g. payment.created then payment.updated) - no write
+        if old_status == status:
+            return "unchanged"
+
+        # All safeguards passed - safe to update
+        tx._mp_set_status(status, payment, channel='webhook')
+        _logger.info("[MP Webhook] Transaction %s updated: %s -> %s", tx.id, old_status, status)
+        return "updated"
+
+    @api.model
+    def _purge_processed(self, batch_size):
+        """
+        Delete one batch of processed notifications: done ones older than
+        WEBHOOK_DONE_RETENTION_DAYS, failed ones older than WEBHOOK_FAILED_RETENTION_DAYS.
+        Pending notifications are never deleted. Called by the sweeper cron.
+
+        Returns:
+            int: Number of deleted notifications
+        """
+        now = fields.Datetime.now()
+        self.env.cr.execute("""
+            DELETE FROM mp_webhook_event
+             WHERE id IN (
+                SELECT id FROM mp_webhook_event
+                 WHERE (state = 'done' AND create_date < %s) OR (state = 'failed' AND create_date < %s)
+                 ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+             )
+        """, [
+            now - timedelta(days=WEBHOOK_DONE_RETENTION_DAYS),
+            now - timedelta(days=WEBHOOK_FAILED_RETENTION_DAYS),
+            batch_size,
+        ])
+        purged = self.env.cr.rowcount
+        if purged:
+            self.invalidate_model()
+            _logger.info("[MP Webhook] Deleted %s processed notification(s)", purged)
+        return purged
+
+    @api.model
+    def _get_queue_stats(self):
+        """
+        Queue depth and processing lag, shown in the settings.
+
+        Returns:
+            dict: {
+                "depth": int (queued notifications, pending or claimed),
+                "lag": float (seconds the oldest queued notification has been waiting),
+                "failed": int (notifications that exhausted their attempts),
+                "received": int, "duplicates": int, "duplicate_updates": int (all workers,
+                    see /mp/pos/metrics)
+            }
+        """
+        counters, _histograms = metrics.aggregate()
+        oldest = self.search([('state', 'in', ('pending', 'processing'))], order='id', limit=1)
+        lag = (fields.Datetime.now() - oldest.create_date).total_seconds() if oldest else 0.0
+        return {
+            "depth": self.search_count([('state', 'in', ('pending', 'processing'))]),
+            "lag": lag,
+            "failed": self.search_count([('state', '=', 'failed')]),
+            "received": int(counter_total(counters, "mp_webhook_notifications_total", outcome="received")),
+            "duplicates": int(counter_total(counters, "mp_webhook_notifications_total", outcome="duplicate")),
+            "duplicate_updates": int(counter_total(counters, "mp_webhook_events_processed_total", result="unchanged")),
+        }
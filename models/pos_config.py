@@ -0,0 +1,11 @@
+from odoo import models, fields
+
+
+class PosConfig(models.Model):
+    _inherit = 'pos.config'
+
+    mp_external_pos_id = fields.Char(
+        string='MercadoPago External POS ID',
+        help='External ID of the MercadoPago store POS whose printed QR is used by payment methods '
+             'in "Fixed QR of the POS" mode'
+    )
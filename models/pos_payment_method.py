@@ -1,26 +1,24 @@
 from odoo import models, api, fields
-import requests
 import logging
-import json
-import uuid
-import threading
-import time
-import urllib.parse
+from datetime import timedelta
 
-_logger = logging.getLogger(__name__)
+from odoo.tools import config, float_compare
 
-MP_TEST_MODE = False           # Set to False for real MercadoPago API
-MP_AUTO_APPROVE_SECONDS = 10  # Auto-approve test payments after X seconds (0 to disable)
+from ..controllers.mp_api import MPApiController, qr_expire_minutes
+from ..controllers.mp_client import warm_up_client
+from ..controllers.mp_qr import qr_image_url
+from ..controllers.mp_simulator import BACKEND_SIMULATOR, MPSimulator, get_backend
 
-_test_payments = {}
+_logger = logging.getLogger(__name__)
 
+# Open preferences are reused for a payment line up to this age (seconds); webhooks
+# for transactions older than 30 minutes are ignored, so a reused QR must be younger
+MP_REUSE_MAX_AGE = 20 * 60
 
-def _auto_approve_payment(payment_id, delay):
-    """Background thread to auto-approve a test payment after delay."""
-    time.sleep(delay)
-    if payment_id in _test_payments and _test_payments[payment_id]["status"] == "pending":
-        _test_payments[payment_id]["status"] = "approved"
-        _logger.info("[MP TEST] Payment %s AUTO-APPROVED after %s seconds", payment_id, delay)
+# Stateless helpers shared by every call; upstream requests go through the
+# per-worker pooled client instead of a new connection per call.
+_mp_api = MPApiController()
+_mp_simulator = MPSimulator()
 
 
 class PosPaymentMethod(models.Model):
@@ -30,77 +28,158 @@ class PosPaymentMethod(models.Model):
         string='Use MercadoPago QR',
         help='Enable this to use MercadoPago QR integration for this payment method'
     )
+    mp_qr_mode = fields.Selection(
+        [('dynamic', 'New QR per sale'), ('static', 'Fixed QR of the POS')],
+        string='MercadoPago QR Mode', default='dynamic', required=True,
+        help='New QR per sale: a QR is generated and shown on screen for every payment.\n'
+             'Fixed QR of the POS: the order is sent to the MercadoPago POS bound to the point of sale '
+             '(MercadoPago External POS ID), whose printed QR the customer scans.'
+    )
+    mp_prewarm = fields.Boolean(
+        string='Pre-create MercadoPago QR',
+        help='Create the QR in the background as soon as the payment screen opens, so it is shown '
+             'right away when this payment method is selected. Unused QRs expire after a few minutes.'
+    )
+
+    def _register_hook(self):
+        # Open keep-alive connections to MercadoPago when a serving worker loads the registry;
+        # never while modules are installed or updated, or tests run (no outbound calls in CI)
+        super()._register_hook()
+        if config['test_enable'] or config['init'] or config['update'] or self.env.registry.in_test_mode():
+            return
+        if get_backend(self.env) != BACKEND_SIMULATOR:
+            warm_up_client()
 
     @api.model
     def _load_pos_data_fields(self, config_id):
         # Odoo 18 uses this method to send data to the Owl frontend
         params = super()._load_pos_data_fields(config_id)
-        params.append('use_mercadopago_qr')
+        params += ['use_mercadopago_qr', 'mp_qr_mode', 'mp_prewarm']
         return params
 
     @api.model
-    def create_mp_payment(self, amount, description, pos_client_ref, payment_method_id, customer_email=None):
+    def create_mp_payment(self, amount, description, pos_client_ref, payment_method_id, customer_email=None,
+                          pos_session_id=None, pos_order_uid=None, pos_payment_line_uuid=None, prewarm=False):
         """
         Creates the preference/QR in MercadoPago.
         Called from POS via ORM service.
+
+        Each QR of a POS order gets its own external reference (order uid, payment
+        line and attempt number, see mp.transaction._mp_attempt_reference), returned
+        as "external_reference" for the status checks of the POS; pos_client_ref
+        (the order name) is kept on the transaction.
+
+        When the popup is opened again for the same order and payment line, the
+        open preference is returned as is (same amount) or updated in place
+        (amount changed) instead of creating a new one. A preference pre-created
+        for the order (prewarm) is claimed by the first payment line that opens it.
         
         Args:
             amount: Payment amount
             description: Payment description (order name)
-            pos_client_ref: External reference for the order
+            pos_client_ref: Order name; the external reference when there is no pos_order_uid
             payment_method_id: ID of the pos.payment.method
             customer_email: Optional customer email from POS partner
+            pos_session_id: Optional pos.session ID, used to push status updates over the bus
+            pos_order_uid: Optional POS order uid, to reuse an open preference
+            pos_payment_line_uuid: Optional POS payment line uuid, to reuse an open preference
+            prewarm: Pre-create the preference for the order before any payment line
+                exists (payment methods with mp_prewarm only)
         """
         _logger.info("[MP] Creating payment - Amount: %s, Ref: %s, Email: %s", amount, pos_client_ref, customer_email)
-        
-        if MP_TEST_MODE:
-            return self._create_test_payment(amount, description, pos_client_ref)
-        
-        from ..controllers.mp_api import MPApiController
-        
-        controller = MPApiController()
-        return controller._create_mp_preference(amount, description, pos_client_ref, customer_email)
-
-    def _create_test_payment(self, amount, description, pos_client_ref):
-        """
-        Creates a fake payment for testing purposes.
-        Uses in-memory storage - no database required.
-        """
-        global _test_payments
-        
-        payment_id = f"TEST-{uuid.uuid4().hex[:12].upper()}"
 
-        qr_content = f"mp://pay/{payment_id}/{amount}"
-        qr_data_encoded = urllib.parse.quote(qr_content, safe='')
-        qr_url = f"https://api.qrserver.com/v1/create-qr-code/?size=300x300&data={qr_data_encoded}"
-        
-        _test_payments[payment_id] = {
-            "payment_id": payment_id,
-            "amount": amount,
-            "description": description,
-            "external_reference": pos_client_ref,
-            "qr_url": qr_url,
-            "status": "pending",
+        method = self.browse(payment_method_id)
+        if prewarm and not (pos_order_uid and method.mp_prewarm and method.mp_qr_mode == 'dynamic'):
+            return {"status": "error", "details": "Pre-creación de QR no habilitada"}
+
+        if pos_order_uid and (pos_payment_line_uuid or prewarm):
+            reused = self._reuse_mp_payment(amount, description, pos_order_uid, pos_payment_line_uuid)
+            if reused:
+                return reused
+
+        external_reference = pos_client_ref
+        if pos_order_uid:
+            external_reference = self.env['mp.transaction']._mp_attempt_reference(pos_order_uid, pos_payment_line_uuid)
+        tx_vals = {
+            "pos_session_id": pos_session_id or False,
+            "pos_order_uid": pos_order_uid or False,
+            "pos_order_ref": pos_client_ref or False,
+            "pos_payment_line_uuid": pos_payment_line_uuid or False,
+            "prewarmed": bool(prewarm),
         }
-        
-        if MP_AUTO_APPROVE_SECONDS > 0:
-            thread = threading.Thread(
-                target=_auto_approve_payment,
-                args=(payment_id, MP_AUTO_APPROVE_SECONDS)
+        if get_backend(self.env) == BACKEND_SIMULATOR:
+            result = _mp_simulator.create_payment(self.env, amount, description, external_reference, tx_vals=tx_vals)
+        elif method.mp_qr_mode == 'static':
+            external_pos_id = self.env['pos.session'].browse(pos_session_id).config_id.mp_external_pos_id
+            if not external_pos_id:
+                return {
+                    "status": "error",
+                    "details": "Configure el ID externo de la caja de MercadoPago en el Punto de Venta",
+                }
+            result = _mp_api._create_mp_instore_order(
+                amount, description, external_reference, external_pos_id, env=self.env, tx_vals=tx_vals
             )
-            thread.daemon = True
-            thread.start()
-            _logger.info("[MP TEST] Payment will auto-approve in %s seconds", MP_AUTO_APPROVE_SECONDS)
-        
-        _logger.info("[MP TEST] Created test payment: %s (in-memory)", payment_id)
-        
+        else:
+            result = _mp_api._create_mp_preference(
+                amount, description, external_reference, customer_email, env=self.env, tx_vals=tx_vals
+            )
+        if result.get("status") == "success":
+            result["external_reference"] = external_reference
+        return result
+
+    def _reuse_mp_payment(self, amount, description, pos_order_uid, pos_payment_line_uuid=None):
+        """
+        Return the open preference of a payment line, if it can still be paid.
+        Without a payment line (prewarm), or when the line has none yet, the
+        unclaimed pre-created preference of the order is used.
+
+        Returns:
+            dict: Same result as create_mp_payment, or None to create a new preference
+        """
+        line_domain = ['&', ('prewarmed', '=', True), ('pos_payment_line_uuid', '=', False)]
+        if pos_payment_line_uuid:
+            line_domain = ['|', ('pos_payment_line_uuid', '=', pos_payment_line_uuid)] + line_domain
+        tx = self.env['mp.transaction'].sudo().search(line_domain + [
+            ('pos_order_uid', '=', pos_order_uid),
+            ('status', 'in', ('initial', 'pending')),
+            # Never past the expiration date of the preference in MercadoPago
+            ('create_date', '>=', fields.Datetime.now() - timedelta(
+                seconds=min(MP_REUSE_MAX_AGE, qr_expire_minutes(self.env) * 60))),
+        ], order='pos_payment_line_uuid, create_date desc', limit=1)
+        if not tx:
+            return None
+        if tx.mp_external_pos_id and not tx._mp_instore_active():
+            # Fixed QR: another sale was put on the POS since, its printed QR no longer carries this order
+            return None
+
+        if float_compare(tx.amount, amount, precision_digits=2) != 0:
+            # A payment may already be in progress for the old amount: keep that QR untouched.
+            # Fixed QR: putting a new order on the POS replaces the old one, nothing to update.
+            if tx.status != 'initial' or tx.mp_external_pos_id:
+                return None
+            if tx.simulated:
+                tx.write({'amount': amount})
+            elif not _mp_api._update_mp_preference_amount(tx, amount, description, env=self.env):
+                return None
+            _logger.info("[MP] Preference %s updated to amount %s", tx.mp_payment_id, amount)
+        else:
+            _logger.info("[MP] Reusing open preference %s", tx.mp_payment_id)
+
+        if pos_payment_line_uuid and not tx.pos_payment_line_uuid:
+            # Claim the pre-created preference: the sweeper no longer expires it early
+            tx.write({'pos_payment_line_uuid': pos_payment_line_uuid})
+
+        if tx.mp_external_pos_id:
+            return {"status": "success", "payment_id": tx.mp_payment_id, "qr_data": False, "static_qr": True,
+                    "external_reference": tx.external_reference}
         return {
             "status": "success",
-            "payment_id": payment_id,
-            "qr_data": qr_url,
+            "payment_id": tx.mp_payment_id,
+            "qr_data": qr_image_url(tx.mp_payment_id),
+            "preference_id": tx.mp_payment_id,
+            "external_reference": tx.external_reference,
         }
 
-
     @api.model
     def check_mp_status(self, payment_id, external_reference=None):
         """
@@ -113,44 +192,50 @@ class PosPaymentMethod(models.Model):
             payment_id: MercadoPago preference ID
             external_reference: Optional external reference for the order
         """
-        global _test_payments
-        
-        if MP_TEST_MODE:
-            if payment_id in _test_payments:
-                status = _test_payments[payment_id]["status"]
-                _logger.info("[MP TEST] Status for %s: %s", payment_id, status)
-                return {"payment_status": status}
-            if payment_id and payment_id.startswith("TEST-"):
-                return {"payment_status": "pending"}
-        
-        from ..controllers.mp_api import MPApiController
-        
-        controller = MPApiController()
-        
-        # If external_reference not provided, try to get it from transaction
-        if not external_reference:
-            tx = self.env['mp.transaction'].sudo().search([('mp_payment_id', '=', payment_id)], limit=1)
-            if tx and tx.external_reference:
-                external_reference = tx.external_reference
-        
-        return controller._check_mp_payment_status(payment_id, external_reference)
+        if get_backend(self.env) == BACKEND_SIMULATOR:
+            return _mp_simulator.check_status_batch(self.env, [{"payment_id": payment_id}]).get(
+                payment_id, {"payment_status": "not_found"}
+            )
+
+        # If external_reference not provided, it is read from the transaction
+        return _mp_api._check_mp_payment_status(payment_id, external_reference, env=self.env)
+
+    @api.model
+    def check_mp_status_batch(self, payments):
+        """
+        Check the status of all pending MercadoPago payments of a POS in one call.
+
+        Local transactions are read with a single query; only unresolved payments
+        are searched in MercadoPago (grouped by external_reference, concurrently).
+
+        Args:
+            payments: list of {"payment_id": preference ID, "external_reference": str or None}
+
+        Returns:
+            dict: {payment_id: {"payment_status": str, ...}}
+        """
+        if get_backend(self.env) == BACKEND_SIMULATOR:
+            return _mp_simulator.check_status_batch(self.env, payments)
+
+        return _mp_api._check_mp_payment_status_batch(payments, env=self.env)
 
     @api.model
     def cancel_mp_payment(self, payment_id):
         """
         Cancel a pending MercadoPago payment.
         """
-        global _test_payments
-        
-        if MP_TEST_MODE and payment_id in _test_payments:
-            _test_payments[payment_id]["status"] = "cancelled"
-            _logger.info("[MP TEST] Payment %s cancelled", payment_id)
-            return {"status": "cancelled"}
-        
-        # PRODUCTION: Update database
         tx = self.env['mp.transaction'].sudo().search([('mp_payment_id', '=', payment_id)], limit=1)
-        if tx and tx.status == 'pending':
-            tx.write({'status': 'cancelled'})
+        if tx and tx.mp_external_pos_id and tx.status in ('initial', 'pending'):
+            # Fixed QR: take the order off the POS, or the next customer scanning it would pay it.
+            # Only while it is still there: a later order of the POS belongs to another sale
+            if tx._mp_instore_active():
+                _mp_api._delete_mp_instore_order(tx.mp_external_pos_id, env=self.env)
+                _logger.info("[MP] Order %s removed from POS %s", payment_id, tx.mp_external_pos_id)
+            tx._mp_set_status('cancelled')
+            return {"status": "cancelled"}
+        # Simulated payments stay "initial" until approved: cancel them there too
+        if tx and (tx.status == 'pending' or (tx.simulated and tx.status == 'initial')):
+            tx._mp_set_status('cancelled')
             _logger.info("[MP] Payment %s cancelled", payment_id)
             return {"status": "cancelled"}
         
@@ -159,29 +244,12 @@ class PosPaymentMethod(models.Model):
     @api.model
     def simulate_mp_approval(self, payment_id):
         """
-        TEST ONLY: Simulate payment approval for testing.
+        SIMULATOR ONLY: Approve a simulated payment right away.
         Call this from browser console or Odoo shell.
         """
-        global _test_payments
-        
-        if not MP_TEST_MODE:
-            return {"status": "error", "details": "Not in test mode"}
-        
-        if payment_id in _test_payments:
-            _test_payments[payment_id]["status"] = "approved"
-            _logger.info("[MP TEST] Payment %s APPROVED (simulated)", payment_id)
+        if get_backend(self.env) != BACKEND_SIMULATOR:
+            return {"status": "error", "details": "Simulator backend not enabled"}
+
+        if _mp_simulator.approve(self.env, [payment_id]):
             return {"status": "approved", "payment_id": payment_id}
-        
         return {"status": "not_found", "payment_id": payment_id}
-
-    @api.model
-    def list_test_payments(self):
-        """
-        TEST ONLY: List all pending test payments.
-        Useful for debugging.
-        """
-        global _test_payments
-        return {
-            "test_mode": MP_TEST_MODE,
-            "payments": list(_test_payments.values())
-        }
@@ -0,0 +1,22 @@
+import logging
+
+from odoo import models
+
+_logger = logging.getLogger(__name__)
+
+
+class PosSession(models.Model):
+    _inherit = 'pos.session'
+
+    def _validate_session(self, *args, **kwargs):
+        result = super()._validate_session(*args, **kwargs)
+        # QRs still open when the session closes can no longer be paid from the POS
+        open_transactions = self.env['mp.transaction'].sudo().search([
+            ('pos_session_id', 'in', self.ids),
+            ('status', 'in', ('initial', 'pending')),
+        ])
+        if open_transactions:
+            open_transactions._mp_set_status('expired')
+            _logger.info("[MP] Expired %s open transaction(s) of closed session(s) %s",
+                         len(open_transactions), self.ids)
+        return result
@@ -22,7 +22,8 @@ export class MPQRPopup extends Component {
         // Current status of the payment flow
         status: { type: String },
         
-        // QR code image URL (base64 or URL)
+        // QR code image URL (/mp/pos/qr/<preference_id> route);
+        // null in fixed QR mode, where the printed QR of the POS is scanned
         qr_url: { type: [String, { value: null }], optional: true },
         
         // Payment amount to display
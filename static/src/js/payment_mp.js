@@ -3,11 +3,33 @@
 import { PaymentScreen } from "@point_of_sale/app/screens/payment_screen/payment_screen";
 import { patch } from "@web/core/utils/patch";
 import { useService } from "@web/core/utils/hooks";
-import { useState } from "@odoo/owl";
+import { useState, useEffect, onMounted, onWillUnmount } from "@odoo/owl";
 import { MPQRPopup } from "@pos_mercadopago_qr/js/mp_qr_popup";
 
 console.log("MercadoPago POS Module Loaded (Odoo 18)");
 
+// Status updates are pushed by the server on this bus channel (+ pos.session id)
+const MP_BUS_CHANNEL_PREFIX = "mp_pos_session_";
+const MP_BUS_STATUS_TYPE = "MP_PAYMENT_STATUS";
+
+// Polling delays (ms)
+const MP_POLL_SAFETY_DELAY = 30000;    // Bus connected: safety net for lost notifications
+const MP_POLL_FALLBACK_DELAY = 5000;   // Bus disconnected: fallback polling (unless the server hints otherwise)
+const MP_BACKOFF_BASE_DELAY = 2000;    // After RPC errors: exponential backoff from this delay...
+const MP_BACKOFF_MAX_DELAY = 60000;    // ...up to this one
+const MP_POLL_JITTER = 0.2;            // +/- 20% so terminals don't poll in lockstep
+
+// Pre-created QRs (payment methods with mp_prewarm): created once the amount due
+// has been stable for this long (ms) on the payment screen
+const MP_PREWARM_DEBOUNCE = 1000;
+
+// Final statuses other than "approved", with the word shown after "Pago"
+const MP_FINAL_ERROR_LABELS = {
+    rejected: "rechazado",
+    cancelled: "cancelado",
+    expired: "expirado",
+};
+
 // 1. Register Popup Component
 patch(PaymentScreen, {
     components: {
@@ -39,6 +61,106 @@ patch(PaymentScreen.prototype, {
 
         // Timer for auto-navigation after payment approval
         this.autoNavigateTimer = null;
+
+        // Open QR of each MercadoPago payment line (uuid -> {payment_id, external_reference}),
+        // all checked in the same batched poll as the one shown in the popup
+        this.mpPendingPayments = new Map();
+
+        // Status push over the bus (polling is only a fallback)
+        this.mpBus = useService("bus_service");
+        this.mpBusConnected = true;
+        this.mpPollTimer = null;
+        this.mpPollErrors = 0;        // Consecutive poll errors (exponential backoff)
+        this.mpPollPaused = false;    // Poll skipped while the tab was hidden
+        this._onMPVisibilityChange = this._onMPVisibilityChange.bind(this);
+        this._onMPBusStatus = this._onMPBusStatus.bind(this);
+        this._onMPBusDisconnect = this._onMPBusDisconnect.bind(this);
+        this._onMPBusReconnect = this._onMPBusReconnect.bind(this);
+
+        // Background pre-creation of the QR, re-scheduled whenever the amount due changes
+        this.mpPrewarmTimer = null;
+        this.mpPrewarmKey = null;     // "<order uid>:<amount>" of the last pre-created QR
+        useEffect(
+            () => this._scheduleMPPrewarm(),
+            () => [this.currentOrder && this.currentOrder.uid, this.currentOrder && this.currentOrder.get_due()]
+        );
+
+        onMounted(() => {
+            if (this.pos.session) {
+                this.mpBus.addChannel(`${MP_BUS_CHANNEL_PREFIX}${this.pos.session.id}`);
+            }
+            this.mpBus.subscribe(MP_BUS_STATUS_TYPE, this._onMPBusStatus);
+            this.mpBus.addEventListener("disconnect", this._onMPBusDisconnect);
+            this.mpBus.addEventListener("reconnect", this._onMPBusReconnect);
+            document.addEventListener("visibilitychange", this._onMPVisibilityChange);
+        });
+        onWillUnmount(() => {
+            this.mpBus.unsubscribe(MP_BUS_STATUS_TYPE, this._onMPBusStatus);
+            this.mpBus.removeEventListener("disconnect", this._onMPBusDisconnect);
+            this.mpBus.removeEventListener("reconnect", this._onMPBusReconnect);
+            document.removeEventListener("visibilitychange", this._onMPVisibilityChange);
+            if (this.mpPollTimer) {
+                clearTimeout(this.mpPollTimer);
+                this.mpPollTimer = null;
+            }
+            if (this.mpPrewarmTimer) {
+                clearTimeout(this.mpPrewarmTimer);
+                this.mpPrewarmTimer = null;
+            }
+        });
+    },
+
+    _getMPPrewarmMethod() {
+        return this.pos.config.payment_method_ids.find(
+            (pm) => this._isMercadoPagoPayment(pm) && pm.mp_prewarm
+        );
+    },
+
+    /**
+     * Pre-create the QR of the current order in the background, once the amount
+     * due is stable, so the popup opens with a QR already in hand. The server
+     * hands it to the first MercadoPago payment line of the order (or updates its
+     * amount in place); unused ones are expired by the server after a few minutes.
+     */
+    _scheduleMPPrewarm() {
+        if (this.mpPrewarmTimer) {
+            clearTimeout(this.mpPrewarmTimer);
+            this.mpPrewarmTimer = null;
+        }
+        const order = this.currentOrder;
+        const method = this._getMPPrewarmMethod();
+        if (!order || !method) {
+            return;
+        }
+        const amount = order.get_due();
+        // Nothing left to pay, or a MercadoPago line already exists (its popup creates the QR)
+        if (amount <= 0 || this.paymentLines.some((l) => this._isMercadoPagoPayment(l.payment_method_id))) {
+            return;
+        }
+        const key = `${order.uid}:${amount}`;
+        if (key === this.mpPrewarmKey) {
+            return;
+        }
+        this.mpPrewarmTimer = setTimeout(async () => {
+            this.mpPrewarmTimer = null;
+            this.mpPrewarmKey = key;
+            const partner = order.get_partner();
+            try {
+                await this.mpOrm.silent.call("pos.payment.method", "create_mp_payment", [], {
+                    amount: amount,
+                    description: order.name,
+                    pos_client_ref: order.name,
+                    payment_method_id: method.id,
+                    customer_email: partner && partner.email ? partner.email : null,
+                    pos_session_id: this.pos.session ? this.pos.session.id : null,
+                    pos_order_uid: order.uid,
+                    prewarm: true,
+                });
+            } catch {
+                // Best effort only: the popup creates the QR itself
+                this.mpPrewarmKey = null;
+            }
+        }, MP_PREWARM_DEBOUNCE);
     },
 
     async validateOrder(isForceValidate) {
@@ -136,6 +258,7 @@ patch(PaymentScreen.prototype, {
                 return;
             }
         }
+        this.mpPendingPayments.delete(uuid);
         
         return super.deletePaymentLine(uuid);
     },
@@ -191,7 +314,13 @@ patch(PaymentScreen.prototype, {
             this.mpState.external_reference = null;
             
             // Automatically start QR generation
-            setTimeout(() => this.startMercadoPago(), 100);
+            this.startMercadoPago();
+        } else if (this.mpState.payment_id && !this.mpState.pollActive) {
+            // Reopened on the same QR: polling stopped with the popup, check right away
+            // (the customer may have paid meanwhile)
+            this.mpState.pollActive = true;
+            this.mpPollErrors = 0;
+            this._scheduleMPPoll(0);
         }
     },
     
@@ -240,7 +369,7 @@ patch(PaymentScreen.prototype, {
         this.mpState.error = null;
         this.mpState.qr_url = null;
         
-        setTimeout(() => this.startMercadoPago(), 100);
+        this.startMercadoPago();
     },
 
     _handleMPClose() {
@@ -258,6 +387,9 @@ patch(PaymentScreen.prototype, {
         
         const line = this.selectedPaymentLine;
         const lineUuid = line ? line.uuid : null;
+        if (lineUuid) {
+            this.mpPendingPayments.delete(lineUuid);
+        }
         
         if (this.mpState.payment_id) {
             try {
@@ -347,6 +479,10 @@ patch(PaymentScreen.prototype, {
                     pos_client_ref: order.name,
                     payment_method_id: line.payment_method_id.id,
                     customer_email: customerEmail,
+                    pos_session_id: this.pos.session ? this.pos.session.id : null,
+                    // Reopening the popup for the same line reuses its open preference
+                    pos_order_uid: order.uid,
+                    pos_payment_line_uuid: line.uuid,
                 }
             );
 
@@ -356,13 +492,26 @@ patch(PaymentScreen.prototype, {
                 return;
             }
 
+            // QR images are served by a cacheable route: start the download now,
+            // in parallel with the state updates below
+            if (res.qr_data) {
+                new Image().src = res.qr_data;
+            }
+
             this.mpState.status = "pending";
-            this.mpState.qr_url = res.qr_data;
+            this.mpState.qr_url = res.qr_data || null;
             this.mpState.payment_id = res.payment_id;
-            this.mpState.external_reference = order.name;  // Store external reference for accurate status checking
+            // Reference of this QR only (see create_mp_payment), for accurate status checking
+            this.mpState.external_reference = res.external_reference || order.name;
+            this.mpPendingPayments.set(line.uuid, {
+                payment_id: res.payment_id,
+                external_reference: this.mpState.external_reference,
+            });
             this.mpState.pollActive = true;
+            this.mpPollErrors = 0;
             
-            this._pollPaymentStatus();
+            // First check after the fallback delay; after that the bus pushes status changes
+            this._scheduleMPPoll(MP_POLL_FALLBACK_DELAY);
 
         } catch (err) {
             this.mpState.status = "error";
@@ -371,19 +520,119 @@ patch(PaymentScreen.prototype, {
     },
 
     async _pollPaymentStatus() {
+        this.mpPollTimer = null;
+
         // Validate we're still polling the correct payment
+        if (!this._isMPPollTargetValid()) {
+            return;
+        }
+
+        // Don't poll from a hidden tab - resumed by _onMPVisibilityChange
+        if (document.hidden) {
+            this.mpPollPaused = true;
+            return;
+        }
+
+        try {
+            // One batched call per tick, however many MP payments are pending
+            const results = await this.mpOrm.call(
+                "pos.payment.method",
+                "check_mp_status_batch",
+                [],
+                { payments: this._getMPPendingPayments() }
+            );
+            const res = results[this.mpState.payment_id] || { payment_status: "pending" };
+
+            this.mpPollErrors = 0;
+            this._applyMPOtherLinesStatus(results);
+
+            // Final status - stop polling
+            if (this._applyMPPaymentStatus(res)) {
+                return;
+            }
+
+            // Payment still pending, not found yet or unknown status - keep trying
+            this._scheduleMPPoll(this._getMPPollDelay(res.retry_after));
+
+        } catch (e) {
+            // On network error, back off exponentially
+            this.mpPollErrors += 1;
+            this._scheduleMPPoll(this._getMPBackoffDelay());
+        }
+    },
+
+    /**
+     * Open QRs of every MercadoPago payment line of the order: the one shown in
+     * the popup and those whose popup was closed while the customer could still pay.
+     */
+    _getMPPendingPayments() {
+        const payments = [];
+        for (const line of this.paymentLines) {
+            const pending = this.mpPendingPayments.get(line.uuid);
+            if (pending && line.get_payment_status() !== "done") {
+                payments.push(pending);
+            }
+        }
+        if (this.mpState.payment_id && !payments.some((p) => p.payment_id === this.mpState.payment_id)) {
+            payments.push({
+                payment_id: this.mpState.payment_id,
+                external_reference: this.mpState.external_reference,
+            });
+        }
+        return payments;
+    },
+
+    /**
+     * Apply polled or pushed statuses to the payment lines not shown in the popup:
+     * an approved payment completes its line, any final status closes its QR.
+     * shownPaymentId is the payment of the popup, left to _applyMPPaymentStatus
+     * (null when the popup is closed: its line is settled here too).
+     */
+    _applyMPOtherLinesStatus(results, shownPaymentId = this.mpState.payment_id) {
+        for (const line of this.paymentLines) {
+            const pending = this.mpPendingPayments.get(line.uuid);
+            if (!pending || pending.payment_id === shownPaymentId) {
+                continue;
+            }
+            const res = results[pending.payment_id];
+            if (!res) {
+                continue;
+            }
+            const isPopupPayment = pending.payment_id === this.mpState.payment_id;
+            if (res.payment_status === "approved") {
+                line.set_payment_status("done");
+                this.mpPendingPayments.delete(line.uuid);
+                if (isPopupPayment) {
+                    this.mpState.status = "approved";
+                }
+                this.mpNotification.add(
+                    "¡Pago aprobado exitosamente!",
+                    { type: "success", title: "MercadoPago" }
+                );
+            } else if (res.payment_status in MP_FINAL_ERROR_LABELS) {
+                this.mpPendingPayments.delete(line.uuid);
+                if (isPopupPayment) {
+                    // Reopening the popup then creates a new QR
+                    this.mpState.status = "error";
+                    this.mpState.error = `Pago ${MP_FINAL_ERROR_LABELS[res.payment_status]}`;
+                }
+            }
+        }
+    },
+
+    _isMPPollTargetValid() {
         const order = this.currentOrder;
         const line = this.selectedPaymentLine;
         
         // Basic checks first
         if (!this.mpState.payment_id || !this.mpState.visible || !this.mpState.pollActive) {
-            return;
+            return false;
         }
         
         // Verify order and payment line still exist
         if (!order || !line) {
             this.mpState.pollActive = false;
-            return;
+            return false;
         }
         
         // CRITICAL: Verify order/payment line hasn't changed
@@ -392,94 +641,153 @@ patch(PaymentScreen.prototype, {
             this.mpState.currentPaymentLineUuid !== line.uuid) {
             // Order/payment line changed - stop polling immediately
             this.mpState.pollActive = false;
+            return false;
+        }
+        return true;
+    },
+
+    _getMPPollDelay(retryAfter) {
+        // Status changes are pushed over the bus; polling is only a safety net
+        // while connected. When the bus is down, follow the server's hint
+        // (based on QR age, webhook health and MercadoPago throttling).
+        const hint = retryAfter ? retryAfter * 1000 : MP_POLL_FALLBACK_DELAY;
+        const delay = this.mpBusConnected ? Math.max(MP_POLL_SAFETY_DELAY, hint) : hint;
+        return this._withMPJitter(delay);
+    },
+
+    _getMPBackoffDelay() {
+        const delay = Math.min(MP_BACKOFF_BASE_DELAY * 2 ** (this.mpPollErrors - 1), MP_BACKOFF_MAX_DELAY);
+        return this._withMPJitter(delay);
+    },
+
+    _withMPJitter(delay) {
+        return Math.round(delay * (1 - MP_POLL_JITTER + Math.random() * 2 * MP_POLL_JITTER));
+    },
+
+    _onMPVisibilityChange() {
+        if (!document.hidden && this.mpPollPaused) {
+            this.mpPollPaused = false;
+            this._scheduleMPPoll(0);
+        }
+    },
+
+    _scheduleMPPoll(delay) {
+        if (this.mpPollTimer) {
+            clearTimeout(this.mpPollTimer);
+            this.mpPollTimer = null;
+        }
+        if (this.mpState.pollActive) {
+            this.mpPollTimer = setTimeout(() => this._pollPaymentStatus(), delay);
+        }
+    },
+
+    _onMPBusStatus(payload) {
+        if (!payload) {
             return;
         }
-        
-        // Verify payment_id is still valid (shouldn't be null after above checks, but double-check)
-        if (!this.mpState.payment_id) {
-            this.mpState.pollActive = false;
+        // One message per update and session, with the statuses of all its updated payments.
+        // The popup's payment is only applied to the popup while it is shown
+        const popupShown = this._isMPPollTargetValid();
+        const others = {};
+        let current = null;
+        for (const status of payload) {
+            if (popupShown && status.payment_id === this.mpState.payment_id) {
+                current = status;
+            } else {
+                others[status.payment_id] = status;
+            }
+        }
+        // Payments of the other lines of the order, and of the popup's line once it is
+        // closed: a final status settles its line even with nothing on screen
+        this._applyMPOtherLinesStatus(others, popupShown ? this.mpState.payment_id : null);
+        if (!current) {
             return;
         }
+        if (this._applyMPPaymentStatus(current) && this.mpPollTimer) {
+            clearTimeout(this.mpPollTimer);
+            this.mpPollTimer = null;
+        }
+    },
 
-        try {
-            const res = await this.mpOrm.call(
-                "pos.payment.method",
-                "check_mp_status",
-                [],
-                { 
-                    payment_id: this.mpState.payment_id,
-                    external_reference: this.mpState.external_reference
-                }
-            );
+    _onMPBusDisconnect() {
+        this.mpBusConnected = false;
+        // Switch the running poll to the fallback delay
+        if (this.mpState.pollActive) {
+            this._scheduleMPPoll(MP_POLL_FALLBACK_DELAY);
+        }
+    },
 
-            // Payment approved
-            if (res.payment_status === "approved") {
-                this.mpState.status = "approved";
-                this.mpState.pollActive = false;
-                
-                // Mark payment line as done
-                const line = this.selectedPaymentLine;
-                if (line) {
-                    line.set_payment_status('done');
-                }
-                
-                this.mpNotification.add(
-                    "¡Pago aprobado exitosamente!",
-                    { type: "success", title: "MercadoPago" }
-                );
-                
-                // Set timer to auto-navigate to new order after 3 seconds
-                // Store current order/payment line to verify they haven't changed
-                const currentOrderUid = order ? order.uid : null;
-                const currentLineUuid = line ? line.uuid : null;
-                
-                // Clear any existing timer first
-                if (this.autoNavigateTimer) {
-                    clearTimeout(this.autoNavigateTimer);
-                }
-                
-                this.autoNavigateTimer = setTimeout(() => {
-                    // Verify order and payment line haven't changed before navigating
-                    const currentOrder = this.currentOrder;
-                    const currentLine = this.selectedPaymentLine;
-                    
-                    if (currentOrder && currentLine &&
-                        currentOrder.uid === currentOrderUid &&
-                        currentLine.uuid === currentLineUuid &&
-                        this.mpState.status === "approved") {
-                        this._handleMPNewOrder();
-                    }
-                    
-                    this.autoNavigateTimer = null;
-                }, 3000);
-                
-                return;
-            }
+    _onMPBusReconnect() {
+        this.mpBusConnected = true;
+        // Notifications sent while disconnected are lost - check once right away
+        if (this.mpState.pollActive) {
+            this._scheduleMPPoll(0);
+        }
+    },
 
-            // Payment rejected or cancelled
-            if (res.payment_status === "rejected" || res.payment_status === "cancelled") {
-                this.mpState.status = "error";
-                this.mpState.error = `Pago ${res.payment_status === "rejected" ? "rechazado" : "cancelado"}`;
-                this.mpState.pollActive = false;
-                return;
-            }
+    /**
+     * Apply a payment status (from a poll or a bus notification) to the popup.
+     * Returns true when the status is final and polling must stop.
+     */
+    _applyMPPaymentStatus(res) {
+        const order = this.currentOrder;
 
-            // Payment still pending OR not found yet - continue polling
-            if ((res.payment_status === "pending" || res.payment_status === "not_found") && this.mpState.pollActive) {
-                setTimeout(() => this._pollPaymentStatus(), 3000);
-                return;
-            }
+        if (res.payment_status === "approved" || res.payment_status in MP_FINAL_ERROR_LABELS) {
+            this.mpPendingPayments.delete(this.mpState.currentPaymentLineUuid);
+        }
 
-            // Unknown status - keep trying
-            if (this.mpState.pollActive) {
-                setTimeout(() => this._pollPaymentStatus(), 3000);
+        // Payment approved
+        if (res.payment_status === "approved") {
+            this.mpState.status = "approved";
+            this.mpState.pollActive = false;
+            
+            // Mark payment line as done
+            const line = this.selectedPaymentLine;
+            if (line) {
+                line.set_payment_status('done');
             }
-
-        } catch (e) {
-            // On network error, retry after a longer delay
-            if (this.mpState.pollActive) {
-                setTimeout(() => this._pollPaymentStatus(), 5000);
+            
+            this.mpNotification.add(
+                "¡Pago aprobado exitosamente!",
+                { type: "success", title: "MercadoPago" }
+            );
+            
+            // Set timer to auto-navigate to new order after 3 seconds
+            // Store current order/payment line to verify they haven't changed
+            const currentOrderUid = order ? order.uid : null;
+            const currentLineUuid = line ? line.uuid : null;
+            
+            // Clear any existing timer first
+            if (this.autoNavigateTimer) {
+                clearTimeout(this.autoNavigateTimer);
             }
+            
+            this.autoNavigateTimer = setTimeout(() => {
+                // Verify order and payment line haven't changed before navigating
+                const currentOrder = this.currentOrder;
+                const currentLine = this.selectedPaymentLine;
+                
+                if (currentOrder && currentLine &&
+                    currentOrder.uid === currentOrderUid &&
+                    currentLine.uuid === currentLineUuid &&
+                    this.mpState.status === "approved") {
+                    this._handleMPNewOrder();
+                }
+                
+                this.autoNavigateTimer = null;
+            }, 3000);
+            
+            return true;
         }
+
+        // Payment rejected, cancelled or expired (QR abandoned or session closed)
+        if (res.payment_status in MP_FINAL_ERROR_LABELS) {
+            this.mpState.status = "error";
+            this.mpState.error = `Pago ${MP_FINAL_ERROR_LABELS[res.payment_status]}`;
+            this.mpState.pollActive = false;
+            return true;
+        }
+
+        return false;
     },
 });
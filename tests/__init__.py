@@ -0,0 +1,6 @@
+from . import test_mp_api
+from . import test_mp_cache
+from . import test_mp_guard
+from . import test_mp_metrics
+from . import test_mp_settings
+from . import test_webhook_event
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+
+from odoo.tests import BaseCase, tagged
+
+from ..controllers.mp_api import PaymentIndex, _parse_mp_datetime, attempt_reference, is_attempt_reference
+
+
+@tagged('post_install', '-at_install')
+class TestParseMPDatetime(BaseCase):
+
+    def test_offsets(self):
+        """Dates are returned in UTC, whatever the offset they were sent with."""
+        expected = datetime(2024, 1, 1, 16, 0, tzinfo=timezone.utc)
+        self.assertEqual(_parse_mp_datetime("2024-01-01T12:00:00.000-04:00"), expected)
+        self.assertEqual(_parse_mp_datetime("2024-01-01T12:00:00-0400"), expected)
+        self.assertEqual(_parse_mp_datetime("2024-01-01T21:30:00+05:30"), expected)
+        self.assertEqual(_parse_mp_datetime("2024-01-01T16:00:00Z"), expected)
+        # Without an offset the date is taken as UTC
+        self.assertEqual(_parse_mp_datetime("2024-01-01T16:00:00"), expected)
+
+    def test_fraction(self):
+        """Fractions are kept to the microsecond, longer ones truncated."""
+        self.assertEqual(_parse_mp_datetime("2024-01-01T12:00:00.5-04:00").microsecond, 500000)
+        self.assertEqual(_parse_mp_datetime("2024-01-01T12:00:00.123456789Z").microsecond, 123456)
+
+    def test_invalid(self):
+        for value in (None, "", 12, "2024-01-01", "2024-13-01T12:00:00Z", "2024-01-01T12:00:00+5"):
+            self.assertIsNone(_parse_mp_datetime(value), value)
+
+
+@tagged('post_install', '-at_install')
+class TestPaymentIndex(BaseCase):
+
+    def test_attempt_reference(self):
+        reference = attempt_reference("00001-001-0001", "f3a9c2d1-77aa-4b4c-9e0e-1b2c3d4e5f60", 2)
+        self.assertEqual(reference, "00001-001-0001.f3a9c2d1.2")
+        self.assertTrue(is_attempt_reference(reference))
+        self.assertTrue(is_attempt_reference(attempt_reference("00001-001-0001", None, 1)))
+        self.assertFalse(is_attempt_reference("Order 00001-001-0001"))
+        self.assertFalse(is_attempt_reference(None))
+
+    def test_match_preference(self):
+        """A payment with a preference ID only matches that preference."""
+        payment = {"id": 1, "preference_id": "pref-1", "external_reference": "Order 1"}
+        index = PaymentIndex([payment])
+        self.assertIs(index.match("pref-1", "Order 1", None), payment)
+        self.assertIsNone(index.match("pref-2", "Order 1", datetime(2024, 1, 1)))
+
+    def test_match_attempt_reference(self):
+        """A per-attempt reference matches its newest payment, without a date check."""
+        reference = attempt_reference("00001-001-0001", None, 1)
+        newest = {"id": 2, "external_reference": reference, "date_created": "2024-01-01T10:00:00.000-04:00"}
+        oldest = {"id": 1, "external_reference": reference, "date_created": "2024-01-01T09:00:00.000-04:00"}
+        index = PaymentIndex([newest, oldest])
+        self.assertIs(index.match("instore-1", reference, datetime(2024, 1, 2)), newest)
+        self.assertIs(index.match("instore-1", reference, None), newest)
+
+    def test_match_order_name(self):
+        """An order name only matches a payment created after the transaction (naive UTC or aware)."""
+        payment = {"id": 1, "external_reference": "Order 1", "date_created": "2024-01-01T12:00:00.000-04:00"}
+        index = PaymentIndex([payment])
+        self.assertIs(index.match("instore-1", "Order 1", datetime(2024, 1, 1, 15, 59)), payment)
+        self.assertIs(index.match("instore-1", "Order 1", datetime(2024, 1, 1, 16, 0)), payment)
+        self.assertIsNone(index.match("instore-1", "Order 1", datetime(2024, 1, 1, 16, 1)))
+        argentina = timezone(timedelta(hours=-3))
+        self.assertIs(index.match("instore-1", "Order 1", datetime(2024, 1, 1, 12, 30, tzinfo=argentina)), payment)
+        self.assertIsNone(index.match("instore-1", "Order 1", datetime(2024, 1, 1, 13, 30, tzinfo=argentina)))
+        self.assertIsNone(index.match("instore-1", "Order 1", None))
+        self.assertIsNone(index.match("instore-1", "Order 2", datetime(2024, 1, 1)))
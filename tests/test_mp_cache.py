@@ -0,0 +1,138 @@
+import threading
+
+from odoo.tests import BaseCase, tagged
+
+from ..controllers import mp_cache
+from ..controllers.mp_cache import SingleFlight, TTLCache
+
+
+class _Clock:
+    """Stand-in for the time module, moved forward by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@tagged('post_install', '-at_install')
+class TestTTLCache(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = _Clock()
+        self.patch(mp_cache, 'time', self.clock)
+
+    def test_ttl(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=120)
+        cache.set("c", 3, ttl=None)
+        self.clock.now += 59
+        self.assertEqual(cache.get("a"), 1)
+        self.clock.now += 1
+        self.assertIsNone(cache.get("a"))
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.get("b"), 2)
+        self.clock.now += 3600
+        self.assertEqual(cache.get("b", "expired"), "expired")
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_lru_eviction(self):
+        """The least recently used entry goes first; get and set both count as a use."""
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        cache.set("a", 10)
+        cache.set("d", 4)
+        self.assertEqual((cache.get("a"), cache.get("c"), cache.get("d")), (10, None, 4))
+        self.assertEqual(len(cache), 2)
+
+    def test_pop_invalidate(self):
+        cache = TTLCache()
+        for key in (("db1", 1), ("db1", 2), ("db2", 1)):
+            cache.set(key, key[1])
+        self.assertEqual(cache.pop(("db1", 1)), 1)
+        self.assertIsNone(cache.pop(("db1", 1)))
+        cache.invalidate(lambda key: key[0] == "db1")
+        self.assertEqual(len(cache), 1)
+        cache.invalidate()
+        self.assertEqual(len(cache), 0)
+
+
+class _CountingLock:
+    """Lock of a SingleFlight, telling the test how many calls got in."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.entered = threading.Semaphore(0)
+
+    def __enter__(self):
+        self._lock.acquire()
+        self.entered.release()
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+
+@tagged('post_install', '-at_install')
+class TestSingleFlight(BaseCase):
+
+    def _run_concurrently(self, fn, callers):
+        """
+        Call fn through one SingleFlight from several threads at once; fn only
+        returns once every caller has joined the call in flight.
+
+        Returns:
+            tuple: (SingleFlight, outcomes: results and exceptions of the callers)
+        """
+        flight = SingleFlight()
+        flight._lock = lock = _CountingLock()
+        release = threading.Event()
+        outcomes = []
+
+        def held():
+            release.wait(5)
+            return fn()
+
+        def caller():
+            try:
+                outcomes.append(flight.do("key", held))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=caller) for _i in range(callers)]
+        for thread in threads:
+            thread.start()
+        for _i in range(callers):
+            lock.entered.acquire(timeout=5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return flight, outcomes
+
+    def test_coalesce(self):
+        """Concurrent callers share one execution and its result; later calls run again."""
+        calls = []
+
+        def fn():
+            calls.append(1)
+            return len(calls)
+
+        flight, outcomes = self._run_concurrently(fn, callers=5)
+        self.assertEqual(calls, [1])
+        self.assertEqual(outcomes, [1] * 5)
+        self.assertEqual(flight.do("key", fn), 2)
+
+    def test_error_shared(self):
+        """Callers waiting on a failed execution get its exception."""
+        def fn():
+            raise ValueError("upstream down")
+
+        _flight, outcomes = self._run_concurrently(fn, callers=3)
+        self.assertEqual(len(outcomes), 3)
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
@@ -0,0 +1,123 @@
+import shutil
+import tempfile
+
+from odoo.tests import BaseCase, tagged
+
+from ..controllers import mp_guard
+from ..controllers.mp_guard import (
+    CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN, UpstreamGuard, UpstreamUnavailable, parse_retry_after,
+)
+
+
+class _Clock:
+    """Stand-in for the time module, moved forward by hand (sleep included)."""
+
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@tagged('post_install', '-at_install')
+class TestUpstreamGuard(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        self.clock = _Clock()
+        self.patch(mp_guard, 'time', self.clock)
+        directory = tempfile.mkdtemp(prefix="mp_upstream_test")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.guard = UpstreamGuard(rate=1, burst=5, failures=3, window=60, open_seconds=30, probe_timeout=10,
+                                   directory=directory)
+
+    def _assert_shed(self, reason):
+        with self.assertRaises(UpstreamUnavailable) as catcher:
+            self.guard.acquire()
+        self.assertEqual(catcher.exception.reason, reason)
+        return catcher.exception
+
+    def test_circuit_transitions(self):
+        """Failures open the circuit; after open_seconds one probe closes it or opens it again."""
+        for _i in range(3):
+            self.guard.record(500)
+        self.assertEqual(self.guard.status()["circuit"], CIRCUIT_OPEN)
+        self.assertEqual(self.guard.status()["retry_after"], 30)
+        self._assert_shed("circuit_open")
+
+        self.clock.now += 30
+        self.assertEqual(self.guard.status()["circuit"], CIRCUIT_HALF_OPEN)
+        self.guard.acquire()              # the probe
+        self._assert_shed("circuit_open")  # a single probe at a time
+        self.guard.record(None)
+        status = self.guard.status()
+        self.assertEqual((status["circuit"], status["trips"]), (CIRCUIT_OPEN, 2))
+
+        self.clock.now += 30
+        self.guard.acquire()
+        self.guard.record(200)
+        self.assertEqual(self.guard.status()["circuit"], CIRCUIT_CLOSED)
+        self.guard.acquire()
+        self.assertEqual(self.guard.status()["shed"], {"circuit_open": 2})
+
+    def test_probe_timeout(self):
+        """A probe that never reports back frees the slot after probe_timeout."""
+        for _i in range(3):
+            self.guard.record(None)
+        self.clock.now += 30
+        self.guard.acquire()
+        self.clock.now += 10
+        self.guard.acquire()
+
+    def test_failure_ratio(self):
+        """Failures only open the circuit when they are enough of the window's requests."""
+        for _i in range(7):
+            self.guard.record(200)
+        for _i in range(3):
+            self.guard.record(503)
+        self.assertEqual(self.guard.status()["circuit"], CIRCUIT_CLOSED)
+        # A new window starts once the previous one is over
+        self.clock.now += 61
+        for _i in range(3):
+            self.guard.record(503)
+        self.assertEqual(self.guard.status()["circuit"], CIRCUIT_OPEN)
+
+    def test_retry_after(self):
+        """A 429 suspends every request for its Retry-After delay."""
+        self.guard.record(429, "20")
+        status = self.guard.status()
+        self.assertTrue(status["throttled"])
+        self.assertEqual(status["retry_after"], 20)
+        self.assertEqual(self._assert_shed("throttled").retry_after, 20)
+        self.assertEqual(self.guard.status()["circuit"], CIRCUIT_CLOSED)
+        self.clock.now += 20
+        self.guard.acquire()
+        self.assertFalse(self.guard.status()["throttled"])
+
+    def test_rate_limit(self):
+        """Bursts up to burst requests, then a request waits for a token or is shed."""
+        for _i in range(5):
+            self.guard.acquire()
+        self.assertEqual(self._assert_shed("rate_limited").retry_after, 1)
+        self.clock.now += 0.6
+        before = self.clock.now
+        self.guard.acquire()               # waits the 0.4 s left for the token
+        self.assertAlmostEqual(self.clock.now - before, 0.4, places=3)
+
+    def test_status_read_only(self):
+        """status() never creates nor changes the shared state."""
+        self.assertEqual(self.guard.status()["circuit"], CIRCUIT_CLOSED)
+        self.assertEqual(self.guard._read_state(), {})
+        for _i in range(3):
+            self.guard.record(500)
+        self.clock.now += 30
+        self.assertEqual(self.guard.status()["circuit"], CIRCUIT_HALF_OPEN)
+        self.assertEqual(self.guard._read_state()["circuit"], CIRCUIT_OPEN)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("15"), 15)
+        self.assertEqual(parse_retry_after(None), mp_guard.DEFAULT_RETRY_AFTER)
+        self.assertEqual(parse_retry_after("soon"), mp_guard.DEFAULT_RETRY_AFTER)
@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from odoo.tests import BaseCase, tagged
+
+from ..controllers.mp_metrics import MetricsRegistry, counter_total, endpoint_label, render_prometheus
+
+
+@tagged('post_install', '-at_install')
+class TestMetricsRegistry(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp(prefix="mp_metrics_test_")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def _write_snapshot(self, name, registry, age=0):
+        """Write the snapshot of ``registry`` as if another worker ``name`` had flushed it ``age`` seconds ago."""
+        path = os.path.join(self.directory, f"{name}.json")
+        with open(path, "w") as f:
+            json.dump(registry.snapshot(), f)
+        if age:
+            mtime = time.time() - age
+            os.utime(path, (mtime, mtime))
+
+    def test_histogram_buckets(self):
+        """A value lands in the first bucket whose bound is >= value, or in +Inf."""
+        registry = MetricsRegistry(directory=self.directory)
+        for value in (0.1, 0.5, 1.0, 5.0):
+            registry.observe("mp_upstream_request_duration_seconds", value, buckets=(0.1, 1.0), endpoint="/v1/payments/{id}")
+        _counters, histograms = registry.aggregate()
+        histogram = histograms[("mp_upstream_request_duration_seconds", (("endpoint", "/v1/payments/{id}"),))]
+        self.assertEqual(histogram["buckets"], [0.1, 1.0])
+        self.assertEqual(histogram["counts"], [1, 2, 1])
+        self.assertEqual(histogram["count"], 4)
+        self.assertAlmostEqual(histogram["sum"], 6.6)
+
+    def test_aggregate_workers(self):
+        """Counters and histograms of every worker's snapshot are summed by name and labels."""
+        registry = MetricsRegistry(directory=self.directory)
+        registry.inc("mp_status_checks_total", source="cache")
+        registry.inc("mp_status_checks_total", 2, source="upstream")
+        registry.observe("mp_webhook_queue_lag_seconds", 3.0, buckets=(1.0, 5.0))
+
+        other = MetricsRegistry(directory=self.directory)
+        other.inc("mp_status_checks_total", 5, source="upstream")
+        other.observe("mp_webhook_queue_lag_seconds", 0.5, buckets=(1.0, 5.0))
+        other.observe("mp_webhook_queue_lag_seconds", 30.0, buckets=(1.0, 5.0))
+        self._write_snapshot("worker-2", other)
+
+        counters, histograms = registry.aggregate()
+        self.assertEqual(counters[("mp_status_checks_total", (("source", "cache"),))], 1)
+        self.assertEqual(counters[("mp_status_checks_total", (("source", "upstream"),))], 7)
+        self.assertEqual(counter_total(counters, "mp_status_checks_total"), 8)
+        self.assertEqual(counter_total(counters, "mp_status_checks_total", source="upstream"), 7)
+        histogram = histograms[("mp_webhook_queue_lag_seconds", ())]
+        self.assertEqual(histogram["counts"], [1, 1, 1])
+        self.assertEqual(histogram["count"], 3)
+        self.assertAlmostEqual(histogram["sum"], 33.5)
+
+    def test_aggregate_skips(self):
+        """Stale snapshots of other hosts and histograms with other buckets are left out."""
+        registry = MetricsRegistry(directory=self.directory)
+        registry.inc("mp_transactions_created_total")
+        registry.observe("mp_webhook_queue_lag_seconds", 3.0, buckets=(1.0, 5.0))
+
+        gone = MetricsRegistry(directory=self.directory)
+        gone.inc("mp_transactions_created_total", 10)
+        self._write_snapshot("otherhost-1", gone, age=2 * 3600)
+
+        old_version = MetricsRegistry(directory=self.directory)
+        old_version.inc("mp_transactions_created_total", 2)
+        old_version.observe("mp_webhook_queue_lag_seconds", 3.0, buckets=(2.0,))
+        self._write_snapshot("otherhost-2", old_version)
+
+        counters, histograms = registry.aggregate()
+        self.assertEqual(counter_total(counters, "mp_transactions_created_total"), 3)
+        self.assertEqual(histograms[("mp_webhook_queue_lag_seconds", ())]["counts"], [0, 1, 0])
+
+    def test_endpoint_label(self):
+        self.assertEqual(endpoint_label("https://api.mercadopago.com/v1/payments/123?x=1"), "/v1/payments/{id}")
+        self.assertEqual(endpoint_label("/checkout/preferences/123-abc"), "/checkout/preferences/{id}")
+        self.assertEqual(endpoint_label("/v1/payments/search"), "/v1/payments/search")
+
+
+@tagged('post_install', '-at_install')
+class TestRenderPrometheus(BaseCase):
+
+    def test_render(self):
+        counters = {
+            ("mp_status_checks_total", (("source", "upstream"),)): 7.0,
+            ("mp_status_checks_total", (("source", "cache"),)): 1.0,
+        }
+        histograms = {
+            ("mp_upstream_request_duration_seconds", (("endpoint", "/v1/payments/{id}"), ("status", "200"))): {
+                "buckets": [0.1, 1.0], "counts": [1, 2, 1], "sum": 6.6, "count": 4,
+            },
+        }
+        gauges = {"mp_webhook_queue_depth": 3}
+        lines = render_prometheus(counters, histograms, gauges).splitlines()
+
+        self.assertEqual(lines[lines.index("# TYPE mp_status_checks_total counter") + 1:][:2], [
+            'mp_status_checks_total{source="cache"} 1',
+            'mp_status_checks_total{source="upstream"} 7',
+        ])
+        labels = 'endpoint="/v1/payments/{id}",status="200"'
+        start = lines.index("# TYPE mp_upstream_request_duration_seconds histogram") + 1
+        self.assertEqual(lines[start:start + 5], [
+            'mp_upstream_request_duration_seconds_bucket{%s,le="0.1"} 1' % labels,
+            'mp_upstream_request_duration_seconds_bucket{%s,le="1.0"} 3' % labels,
+            'mp_upstream_request_duration_seconds_bucket{%s,le="+Inf"} 4' % labels,
+            'mp_upstream_request_duration_seconds_sum{%s} 6.6' % labels,
+            'mp_upstream_request_duration_seconds_count{%s} 4' % labels,
+        ])
+        self.assertIn("# HELP mp_webhook_queue_depth Webhook notifications waiting to be processed", lines)
+        self.assertEqual(lines[lines.index("# TYPE mp_webhook_queue_depth gauge") + 1], "mp_webhook_queue_depth 3")
+        self.assertTrue(render_prometheus(counters, histograms, gauges).endswith("\n"))
+
+    def test_untyped_and_escaping(self):
+        """Metrics without help are exported untyped; quotes, backslashes and newlines in labels are escaped."""
+        counters = {("custom_total", (("reason", 'say "hi"\\\n'),)): 2.0}
+        self.assertEqual(render_prometheus(counters, {}, {}).splitlines(), [
+            "# HELP custom_total custom_total",
+            "# TYPE custom_total untyped",
+            'custom_total{reason="say \\"hi\\"\\\\\\n"} 2',
+        ])
@@ -0,0 +1,27 @@
+from odoo.tests import TransactionCase, tagged
+
+from ..controllers.mp_simulator import DEFAULT_APPROVE_SECONDS, MPSimulator
+from ..models.mp_transaction import DEFAULT_ARCHIVE_DAYS
+
+
+@tagged('post_install', '-at_install')
+class TestMPSettings(TransactionCase):
+
+    def test_archive_days_zero(self):
+        """0 turns archiving off and is kept, unlike a missing value."""
+        params = self.env['ir.config_parameter'].sudo()
+        params.set_param('mp_tx_archive_days', False)
+        self.assertEqual(self.env['res.config.settings'].create({}).mp_tx_archive_days, DEFAULT_ARCHIVE_DAYS)
+
+        self.env['res.config.settings'].create({'mp_tx_archive_days': 0}).set_values()
+        self.assertEqual(params.get_param('mp_tx_archive_days'), '0')
+        self.assertEqual(self.env['res.config.settings'].create({}).mp_tx_archive_days, 0)
+
+    def test_simulator_approve_seconds_zero(self):
+        """0 means simulated payments are only approved manually."""
+        self.env['res.config.settings'].create({'mp_simulator_approve_seconds': 0}).set_values()
+        self.assertEqual(MPSimulator()._approve_seconds(self.env), 0)
+        self.assertEqual(self.env['res.config.settings'].create({}).mp_simulator_approve_seconds, 0)
+
+        self.env['ir.config_parameter'].sudo().set_param('mp_simulator_approve_seconds', False)
+        self.assertEqual(MPSimulator()._approve_seconds(self.env), DEFAULT_APPROVE_SECONDS)
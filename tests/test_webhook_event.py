@@ -0,0 +1,98 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import TransactionCase, tagged
+
+from ..controllers.mp_guard import UpstreamGuard
+from ..models.mp_webhook_event import WEBHOOK_DONE_RETENTION_DAYS, WEBHOOK_FAILED_RETENTION_DAYS
+
+
+@tagged('post_install', '-at_install')
+class TestWebhookEventRetention(TransactionCase):
+
+    def _create_event(self, state, age_days):
+        event = self.env['mp.webhook.event'].create({
+            'resource_id': str(self.env['mp.webhook.event'].search_count([]) + 1000),
+            'action': 'payment.updated',
+            'payload': '{}',
+            'state': state,
+        })
+        self.env.cr.execute(
+            "UPDATE mp_webhook_event SET create_date = %s WHERE id = %s",
+            [fields.Datetime.now() - timedelta(days=age_days), event.id],
+        )
+        return event
+
+    def test_purge_processed(self):
+        """Old done and failed notifications are deleted, recent and pending ones are kept."""
+        Event = self.env['mp.webhook.event']
+        done_old = self._create_event('done', WEBHOOK_DONE_RETENTION_DAYS + 1)
+        done_recent = self._create_event('done', WEBHOOK_DONE_RETENTION_DAYS - 1)
+        failed_old = self._create_event('failed', WEBHOOK_FAILED_RETENTION_DAYS + 1)
+        failed_recent = self._create_event('failed', WEBHOOK_DONE_RETENTION_DAYS + 1)
+        pending_old = self._create_event('pending', WEBHOOK_FAILED_RETENTION_DAYS + 1)
+        Event.invalidate_model()
+
+        self.assertEqual(Event._purge_processed(batch_size=100), 2)
+        self.assertFalse(done_old.exists())
+        self.assertFalse(failed_old.exists())
+        self.assertEqual(
+            (done_recent | failed_recent | pending_old).exists(), done_recent | failed_recent | pending_old,
+        )
+
+    def test_purge_processed_batches(self):
+        """At most batch_size notifications are deleted per call, the rest by the next batches."""
+        Event = self.env['mp.webhook.event']
+        events = Event.concat(*[self._create_event('done', WEBHOOK_DONE_RETENTION_DAYS + 1) for _i in range(5)])
+        Event.invalidate_model()
+
+        self.assertEqual(Event._purge_processed(batch_size=2), 2)
+        self.assertEqual(Event._purge_processed(batch_size=2), 2)
+        self.assertEqual(Event._purge_processed(batch_size=2), 1)
+        self.assertEqual(Event._purge_processed(batch_size=2), 0)
+        self.assertFalse(events.exists())
+
+
+@tagged('post_install', '-at_install')
+class TestWebhookEventDedup(TransactionCase):
+
+    def _payload(self, notification_id, resource_id='9001'):
+        return {"id": notification_id, "action": "payment.updated", "data": {"id": resource_id}}
+
+    def test_enqueue_redelivery(self):
+        """A redelivered notification is dropped, unless it failed."""
+        Event = self.env['mp.webhook.event']
+        event = Event._enqueue('9001', 'payment.updated', self._payload(1))
+        self.assertTrue(event)
+        self.assertEqual(event.notification_id, '1')
+        event.write({'state': 'done'})
+
+        self.assertFalse(Event._enqueue('9001', 'payment.updated', self._payload(1)))
+        event.write({'state': 'failed'})
+        self.assertTrue(Event._enqueue('9001', 'payment.updated', self._payload(1)))
+
+    def test_enqueue_pending(self):
+        """A single notification per payment and action waits in the queue."""
+        Event = self.env['mp.webhook.event']
+        event = Event._enqueue('9001', 'payment.updated', self._payload(1))
+        self.assertFalse(Event._enqueue('9001', 'payment.updated', self._payload(2)))
+        self.assertTrue(Event._enqueue('9001', 'payment.created', self._payload(3)))
+        self.assertTrue(Event._enqueue('9002', 'payment.updated', self._payload(4, '9002')))
+
+        event.write({'state': 'done'})
+        self.assertTrue(Event._enqueue('9001', 'payment.updated', self._payload(2)))
+
+    def test_enqueue_while_processing(self):
+        """A notification received while its event is claimed by the queue cron is queued."""
+        Event = self.env['mp.webhook.event']
+        event = Event._enqueue('9001', 'payment.updated', self._payload(1))
+        with patch.object(UpstreamGuard, 'status', return_value={"retry_after": 0}):
+            self.assertIn(event, Event._claim_batch(batch_size=100))
+        self.assertEqual(event.state, 'processing')
+
+        newer = Event._enqueue('9001', 'payment.updated', self._payload(2))
+        self.assertTrue(newer)
+        self.assertEqual(newer.state, 'pending')
+        # Still a duplicate of the newer one until it is claimed too
+        self.assertFalse(Event._enqueue('9001', 'payment.updated', self._payload(3)))
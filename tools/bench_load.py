@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Load test of the module against a running Odoo and the MercadoPago stub.
+
+N simulated terminals each run sales in a loop, through the same RPCs as the
+POS: create_mp_payment, then check_mp_status_batch until the payment is final,
+then (optionally) MercadoPago-style notifications posted to /mp/pos/webhook.
+
+    # 1. stub (notifies Odoo of each payment)
+    python3 tools/mp_stub_server.py --latency 80 --pay-after 3 \\
+        --webhook-url http://localhost:8069/mp/pos/webhook
+    # 2. Odoo with "mp_api_base_url = http://127.0.0.1:8099" in odoo.conf
+    # 3. load
+    python3 tools/bench_load.py --url http://localhost:8069 --db bench --login admin --password admin \\
+        --payment-method-id 5 --pos-session-id 1 --terminals 20 --sales 10 \\
+        --dsn "dbname=bench"
+
+Reports p50/p95/p99 latency of each call and of a full sale, MercadoPago
+calls per sale (from the stub's counters) and database writes per sale
+(inserted/updated/deleted rows from pg_stat_user_tables, with --dsn and
+psycopg2 installed).
+"""
+import argparse
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+FINAL_STATUSES = ("approved", "rejected", "cancelled", "expired")
+
+
+class Terminal(threading.Thread):
+    """One POS terminal: its own Odoo session, running sales one after another."""
+
+    def __init__(self, index, args, timings, errors):
+        super().__init__(name=f"terminal-{index}", daemon=True)
+        self.index = index
+        self.args = args
+        self.timings = timings
+        self.errors = errors
+        self.http = requests.Session()
+        self.sales_done = 0
+
+    def _rpc(self, route, params):
+        response = self.http.post(
+            f"{self.args.url}{route}",
+            json={"jsonrpc": "2.0", "method": "call", "params": params, "id": uuid.uuid4().hex},
+            timeout=60,
+        )
+        response.raise_for_status()
+        body = response.json()
+        if body.get("error"):
+            raise RuntimeError(body["error"].get("data", {}).get("message") or body["error"])
+        return body.get("result")
+
+    def _call_kw(self, method, kwargs):
+        return self._rpc(f"/web/dataset/call_kw/pos.payment.method/{method}", {
+            "model": "pos.payment.method", "method": method, "args": [], "kwargs": kwargs,
+        })
+
+    def _timed(self, name, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.timings[name].append((time.perf_counter() - start) * 1000)
+
+    def run(self):
+        self._rpc("/web/session/authenticate", {
+            "db": self.args.db, "login": self.args.login, "password": self.args.password,
+        })
+        for sale in range(self.args.sales):
+            try:
+                self._sale(sale)
+                self.sales_done += 1
+            except Exception as e:
+                self.errors.append(f"{self.name} sale {sale}: {e}")
+
+    def _sale(self, sale):
+        reference = f"Bench {self.index:03d}-{sale:05d}-{uuid.uuid4().hex[:6]}"
+        start = time.perf_counter()
+        created = self._timed("create_mp_payment", self._call_kw, "create_mp_payment", {
+            "amount": round(100 + self.index + sale / 100, 2),
+            "description": reference,
+            "pos_client_ref": reference,
+            "payment_method_id": self.args.payment_method_id,
+            "pos_session_id": self.args.pos_session_id,
+            "pos_order_uid": reference,
+            "pos_payment_line_uuid": uuid.uuid4().hex,
+        })
+        if created.get("status") != "success":
+            raise RuntimeError(created.get("details"))
+        self.timings["time_to_qr"].append((time.perf_counter() - start) * 1000)
+
+        payment_id = created["payment_id"]
+        deadline = time.monotonic() + self.args.sale_timeout
+        result = {}
+        while time.monotonic() < deadline:
+            time.sleep(self.args.poll_interval)
+            results = self._timed("check_mp_status_batch", self._call_kw, "check_mp_status_batch", {
+                "payments": [{"payment_id": payment_id, "external_reference": created["external_reference"]}],
+            })
+            result = results.get(payment_id) or {}
+            if result.get("payment_status") in FINAL_STATUSES:
+                break
+        else:
+            raise RuntimeError(f"{payment_id} still {result.get('payment_status')} after {self.args.sale_timeout}s")
+        self.timings["sale"].append((time.perf_counter() - start) * 1000)
+
+        # Notifications as MercadoPago delivers them: often several per payment
+        mp_payment_id = result.get("payment_id")
+        for _i in range(self.args.webhooks_per_sale if mp_payment_id else 0):
+            self._timed("webhook", self.http.post, f"{self.args.url}/mp/pos/webhook", None, {
+                "id": uuid.uuid4().int % 10 ** 11,
+                "action": "payment.updated",
+                "type": "payment",
+                "data": {"id": str(mp_payment_id)},
+            })
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+
+    def _at(p):
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+    return {"n": len(values), "p50": _at(50), "p95": _at(95), "p99": _at(99), "mean": statistics.fmean(values)}
+
+
+def _stub_stats(args):
+    return requests.get(f"{args.stub_url}/__stats", timeout=10).json()
+
+
+def _db_writes(args):
+    """Rows inserted + updated + deleted per table since the stats reset (psycopg2 required)."""
+    import psycopg2
+
+    with psycopg2.connect(args.dsn) as conn, conn.cursor() as cr:
+        cr.execute("""
+            SELECT relname, n_tup_ins + n_tup_upd + n_tup_del
+              FROM pg_stat_user_tables
+             WHERE relname LIKE 'mp\\_%%' OR relname IN ('bus_bus', 'ir_cron', 'ir_cron_trigger')
+        """)
+        return dict(cr.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8069", help="Odoo base URL")
+    parser.add_argument("--db", required=True)
+    parser.add_argument("--login", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--payment-method-id", type=int, required=True)
+    parser.add_argument("--pos-session-id", type=int, help="open pos.session (bus notifications, fixed QR mode)")
+    parser.add_argument("--terminals", type=int, default=10)
+    parser.add_argument("--sales", type=int, default=10, help="sales per terminal")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between status checks")
+    parser.add_argument("--sale-timeout", type=float, default=60.0)
+    parser.add_argument("--webhooks-per-sale", type=int, default=0,
+                        help="extra notifications posted to /mp/pos/webhook per approved sale")
+    parser.add_argument("--stub-url", default="http://127.0.0.1:8099")
+    parser.add_argument("--dsn", help="libpq DSN of the Odoo database, to count database writes")
+    args = parser.parse_args()
+
+    requests.post(f"{args.stub_url}/__reset", timeout=10)
+    writes_before = _db_writes(args) if args.dsn else {}
+
+    timings = defaultdict(list)
+    errors = []
+    terminals = [Terminal(i, args, timings, errors) for i in range(args.terminals)]
+    start = time.perf_counter()
+    for terminal in terminals:
+        terminal.start()
+    for terminal in terminals:
+        terminal.join()
+    elapsed = time.perf_counter() - start
+
+    sales = sum(terminal.sales_done for terminal in terminals)
+    print(f"{args.terminals} terminal(s), {sales} sale(s) in {elapsed:.1f}s "
+          f"({sales / elapsed:.2f} sales/s), {len(errors)} error(s)")
+    for error in errors[:10]:
+        print(f"  {error}")
+
+    print(f"\n{'latency (ms)':<24} {'n':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'mean':>9}")
+    for name in ("create_mp_payment", "time_to_qr", "check_mp_status_batch", "webhook", "sale"):
+        result = _percentiles(timings.get(name, []))
+        if result:
+            print(f"{name:<24} {result['n']:>6} {result['p50']:>9.1f} {result['p95']:>9.1f} "
+                  f"{result['p99']:>9.1f} {result['mean']:>9.1f}")
+
+    if not sales:
+        return
+
+    # Let the webhook queue drain before reading the counters
+    time.sleep(2)
+    stub = _stub_stats(args)
+    print(f"\nMercadoPago calls per sale: {stub.get('total', 0) / sales:.2f}")
+    for name, count in sorted(stub.items()):
+        if name not in ("total", "preferences", "payments"):
+            print(f"  {name:<24} {count / sales:>8.2f}")
+
+    if args.dsn:
+        # pg_stat counters are flushed asynchronously by the backends
+        time.sleep(1)
+        writes_after = _db_writes(args)
+        total = sum(writes_after.get(table, 0) - writes_before.get(table, 0) for table in writes_after)
+        print(f"\nDatabase writes (rows) per sale: {total / sales:.2f}")
+        for table in sorted(writes_after):
+            delta = writes_after[table] - writes_before.get(table, 0)
+            if delta:
+                print(f"  {table:<24} {delta / sales:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
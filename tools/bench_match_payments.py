@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the matching of payment search results to transactions.
+
+Times, for search results of 1, 100 and 1000 payments:
+
+  legacy  per-preference walk of the results, parsing each date in the loop
+          (dateutil import attempt, or regex fallback) - the matcher before
+          PaymentIndex
+  index   PaymentIndex: results indexed once by preference ID, then one
+          lookup per preference; only the dates of payments without a
+          preference are parsed, with the compiled parser, when needed
+
+Each batch matches --lookups preferences (a POS checking several payments),
+one of them an in-store order matched by external_reference. Runs with the
+Python of an Odoo installation:
+
+    python3 tools/bench_match_payments.py --addons-path /path/to/addons
+"""
+import argparse
+import importlib
+import random
+import re
+import timeit
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+def legacy_parse_mp_datetime(value):
+    """_parse_mp_datetime before the compiled parser."""
+    if not value:
+        return None
+    try:
+        from dateutil import parser
+        return parser.parse(value).astimezone(timezone.utc)
+    except ImportError:
+        pass
+    except (ValueError, OverflowError):
+        return None
+    try:
+        tz_match = re.search(r'([+-]\d{2}):(\d{2})(?:Z)?$', value)
+        if not tz_match:
+            date_part = value.split('.')[0]
+            return datetime.strptime(date_part, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+        date_part = re.sub(r'(\.\d+)?[+-]\d{2}:\d{2}(?:Z)?$', '', value)
+        payment_date = datetime.strptime(date_part, "%Y-%m-%dT%H:%M:%S")
+        hours = int(tz_match.group(1))
+        minutes = int(tz_match.group(2))
+        offset_seconds = hours * 3600 + (-minutes * 60 if tz_match.group(1).startswith('-') else minutes * 60)
+        payment_date = payment_date.replace(tzinfo=timezone(timedelta(seconds=offset_seconds)))
+        return payment_date.astimezone(timezone.utc)
+    except (ValueError, AttributeError):
+        return None
+
+
+def legacy_match(results, payment_id, external_reference, transaction_date):
+    """MPApiController._match_mp_payment before PaymentIndex."""
+    transaction_date_utc = transaction_date.replace(tzinfo=timezone.utc) if transaction_date else None
+    for payment in results:
+        payment_preference_id = payment.get("preference_id")
+        if payment_preference_id and str(payment_preference_id) == str(payment_id):
+            return payment
+        if (payment_preference_id or not transaction_date_utc or
+                payment.get("external_reference") != external_reference):
+            continue
+        payment_date_utc = legacy_parse_mp_datetime(payment.get("date_created"))
+        if payment_date_utc and payment_date_utc >= transaction_date_utc:
+            return payment
+    return None
+
+
+def make_results(count, reference, lookups):
+    """Search results, newest first: `count` payments of an order name reused by many sales."""
+    now = datetime.now(timezone(timedelta(hours=-4)))
+    results = []
+    for i in range(count):
+        created = now - timedelta(seconds=30 * i)
+        results.append({
+            "id": 1000000000 + i,
+            "status": "approved",
+            "status_detail": "accredited",
+            # Every tenth payment is an in-store order (no preference ID)
+            "preference_id": None if i % 10 == 9 else f"123456789-{uuid.uuid4()}",
+            "external_reference": reference,
+            "date_created": created.isoformat(timespec="milliseconds"),
+            "transaction_amount": round(random.uniform(10, 1000), 2),
+        })
+    # Preferences checked by the POS: the oldest ones (worst case for a linear walk)
+    with_preference = [p for p in results if p["preference_id"]]
+    targets = [(p["preference_id"], None) for p in with_preference[-(lookups - 1):]] if lookups > 1 else []
+    # In-store order created before the oldest payment: matched by external_reference
+    oldest = (now - timedelta(seconds=30 * count + 60)).astimezone(timezone.utc).replace(tzinfo=None)
+    targets.append(("instore-order", oldest))
+    return results, targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--addons-path", help="Odoo addons path containing pos_mercadopago_qr")
+    parser.add_argument("--lookups", type=int, default=5, help="preferences matched per search")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    import odoo
+    from odoo.tools import config
+    config.parse_config(["--addons-path", args.addons_path] if args.addons_path else [])
+    odoo.modules.module.initialize_sys_path()
+    mp_api = importlib.import_module("odoo.addons.pos_mercadopago_qr.controllers.mp_api")
+
+    reference = "Order 00042-001-0001"
+    print(f"{'results':>8} {'legacy (us)':>12} {'index (us)':>12} {'speed-up':>9}")
+    for count in (1, 100, 1000):
+        results, targets = make_results(count, reference, args.lookups)
+
+        def _legacy():
+            return [legacy_match(results, payment_id, reference, date) for payment_id, date in targets]
+
+        def _index():
+            index = mp_api.PaymentIndex(results)
+            return [index.match(payment_id, reference, date) for payment_id, date in targets]
+
+        assert [p and p["id"] for p in _legacy()] == [p and p["id"] for p in _index()], "matchers disagree"
+        number = max(1, 20000 // count)
+        legacy = min(timeit.repeat(_legacy, number=number, repeat=args.repeat)) / number * 1e6
+        indexed = min(timeit.repeat(_index, number=number, repeat=args.repeat)) / number * 1e6
+        print(f"{count:>8} {legacy:>12.1f} {indexed:>12.1f} {legacy / indexed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
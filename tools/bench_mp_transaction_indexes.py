@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the mp.transaction lookups with the old and the new indexes.
+
+Seeds a scratch copy of the mp_transaction table in a PostgreSQL database
+(never the real table), then times the queries issued by check_mp_status,
+cancel_mp_payment and the webhook with:
+
+  baseline  single-column indexes on mp_payment_id and external_reference
+  indexed   unique mp_payment_id, (external_reference, create_date DESC),
+            partial create_date index on open (initial/pending) rows
+
+    pip install psycopg2-binary
+    python3 tools/bench_mp_transaction_indexes.py --dsn "dbname=bench" --rows 3000000
+
+Order names are reused across retries, so every external_reference is shared
+by --retries rows.
+"""
+import argparse
+import random
+import statistics
+import time
+
+import psycopg2
+
+TABLE = "mp_transaction_bench"
+
+SCHEMA = f"""
+DROP TABLE IF EXISTS {TABLE};
+CREATE TABLE {TABLE} (
+    id serial PRIMARY KEY,
+    create_date timestamp NOT NULL,
+    write_date timestamp,
+    pos_session_id integer,
+    mp_payment_id varchar,
+    external_reference varchar,
+    qr_data text,
+    status varchar,
+    amount numeric,
+    raw_data text
+);
+"""
+
+# ~2% of the rows are still open, the rest reached a final status
+SEED = f"""
+INSERT INTO {TABLE} (create_date, write_date, pos_session_id, mp_payment_id, external_reference,
+                     qr_data, status, amount, raw_data)
+SELECT now() - (%(rows)s - g) * interval '1 second',
+       now() - (%(rows)s - g) * interval '1 second',
+       g / 5000,
+       '123456789-' || md5(g::text),
+       'Order ' || lpad((g / %(retries)s)::text, 5, '0') || '-001-' || lpad((g / %(retries)s %% 9999)::text, 4, '0'),
+       'https://www.mercadopago.com.ar/checkout/v1/redirect?pref_id=123456789-' || md5(g::text),
+       CASE WHEN random() < 0.02 THEN 'initial' WHEN random() < 0.9 THEN 'approved' ELSE 'cancelled' END,
+       round((random() * 10000)::numeric, 2),
+       repeat('{{"payload": "x"}}', 60)
+  FROM generate_series(1, %(rows)s) AS g;
+ANALYZE {TABLE};
+"""
+
+BASELINE_INDEXES = f"""
+DROP INDEX IF EXISTS {TABLE}_mp_payment_id_uniq;
+DROP INDEX IF EXISTS {TABLE}_ext_ref_create_date;
+DROP INDEX IF EXISTS {TABLE}_open_create_date;
+CREATE INDEX IF NOT EXISTS {TABLE}_mp_payment_id ON {TABLE} (mp_payment_id);
+CREATE INDEX IF NOT EXISTS {TABLE}_external_reference ON {TABLE} (external_reference);
+ANALYZE {TABLE};
+"""
+
+NEW_INDEXES = f"""
+DROP INDEX IF EXISTS {TABLE}_mp_payment_id;
+DROP INDEX IF EXISTS {TABLE}_external_reference;
+CREATE UNIQUE INDEX IF NOT EXISTS {TABLE}_mp_payment_id_uniq ON {TABLE} (mp_payment_id);
+CREATE INDEX IF NOT EXISTS {TABLE}_ext_ref_create_date ON {TABLE} (external_reference, create_date DESC);
+CREATE INDEX IF NOT EXISTS {TABLE}_open_create_date ON {TABLE} (create_date)
+    WHERE status IN ('initial', 'pending');
+ANALYZE {TABLE};
+"""
+
+# The queries the ORM issues (default _order = 'create_date desc')
+QUERIES = {
+    "check_mp_status (batch by preference)": (
+        f"SELECT id FROM {TABLE} WHERE mp_payment_id IN %(payment_ids)s ORDER BY create_date DESC"
+    ),
+    "cancel_mp_payment (preference, limit 1)": (
+        f"SELECT id FROM {TABLE} WHERE mp_payment_id = %(payment_id)s ORDER BY create_date DESC LIMIT 1"
+    ),
+    "webhook fallback (external_reference, limit 1)": (
+        f"SELECT id FROM {TABLE} WHERE external_reference = %(external_reference)s ORDER BY create_date DESC LIMIT 1"
+    ),
+    "open transactions older than 1h": (
+        f"SELECT id FROM {TABLE} WHERE status IN ('initial', 'pending') "
+        f"AND create_date < now() - interval '1 hour' ORDER BY create_date LIMIT 500"
+    ),
+}
+
+
+def _sample_params(cr, count):
+    cr.execute(f"SELECT mp_payment_id, external_reference FROM {TABLE} TABLESAMPLE SYSTEM (1) LIMIT %s", [count])
+    rows = cr.fetchall()
+    random.shuffle(rows)
+    return [{
+        "payment_id": payment_id,
+        "payment_ids": tuple(r[0] for r in random.sample(rows, min(10, len(rows)))),
+        "external_reference": external_reference,
+    } for payment_id, external_reference in rows]
+
+
+def _run(cr, params, runs):
+    results = {}
+    for name, query in QUERIES.items():
+        timings = []
+        for i in range(runs):
+            start = time.perf_counter()
+            cr.execute(query, params[i % len(params)])
+            cr.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = (statistics.median(timings), timings[int(len(timings) * 0.95) - 1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="libpq connection string of a scratch database")
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--retries", type=int, default=4, help="rows sharing each external_reference")
+    parser.add_argument("--runs", type=int, default=500)
+    parser.add_argument("--keep", action="store_true", help="keep the seeded table")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cr = conn.cursor()
+
+    print(f"Seeding {args.rows} rows into {TABLE}...")
+    start = time.perf_counter()
+    cr.execute(SCHEMA)
+    cr.execute(SEED, {"rows": args.rows, "retries": args.retries})
+    print(f"  done in {time.perf_counter() - start:.1f}s")
+
+    params = _sample_params(cr, 2000)
+
+    cr.execute(BASELINE_INDEXES)
+    baseline = _run(cr, params, args.runs)
+    cr.execute(NEW_INDEXES)
+    indexed = _run(cr, params, args.runs)
+
+    print(f"\n{'query':<48} {'baseline p50/p95 ms':>22} {'indexed p50/p95 ms':>22}")
+    for name in QUERIES:
+        b50, b95 = baseline[name]
+        n50, n95 = indexed[name]
+        print(f"{name:<48} {b50:>10.3f} / {b95:>9.3f} {n50:>10.3f} / {n95:>9.3f}")
+
+    for name, query in QUERIES.items():
+        cr.execute("EXPLAIN (ANALYZE, BUFFERS, COSTS OFF) " + query, params[0])
+        print(f"\n-- {name}\n" + "\n".join(row[0] for row in cr.fetchall()))
+
+    if not args.keep:
+        cr.execute(f"DROP TABLE {TABLE}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the local QR rendering (controllers/mp_qr.py).
+
+Runs without Odoo: only the ``qrcode`` package is required.
+
+    python3 tools/bench_qr_render.py [--iterations 200]
+
+Reports cold renders (new payload, cache miss) and warm renders (same
+payload, LRU hit) for the two payload shapes MercadoPago returns.
+"""
+import argparse
+import importlib
+import os
+import statistics
+import sys
+import time
+import types
+
+CONTROLLERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "controllers")
+
+PAYLOADS = {
+    # EMVCo "qr_code" string (interoperable QR), ~250 chars
+    "qr_code": (
+        "00020101021243650016COM.MERCADOLIBRE02013063638f1192a-5fd1-4180-a180-8bcae3556bc35204000053030"
+        "325802AR5910Test Store6012Buenos Aires62070503***6304{seq:04X}"
+        "0115{seq:015d}0220{seq:020d}"
+    ),
+    # Checkout "init_point" payment link, ~100 chars
+    "init_point": "https://www.mercadopago.com.ar/checkout/v1/redirect?pref_id=123456789-{seq:08x}-aaaa-bbbb-{seq:012x}",
+}
+
+
+def _load_mp_qr():
+    # Import controllers/mp_qr.py (and its relative imports) without running
+    # controllers/__init__.py, which needs a full Odoo installation.
+    package = types.ModuleType("mp_controllers")
+    package.__path__ = [CONTROLLERS_DIR]
+    sys.modules["mp_controllers"] = package
+    return importlib.import_module("mp_controllers.mp_qr")
+
+
+def _measure(fn, payloads):
+    timings = []
+    for payload in payloads:
+        start = time.perf_counter()
+        fn(payload)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "mean": statistics.fmean(timings),
+        "p50": timings[len(timings) // 2],
+        "p95": timings[int(len(timings) * 0.95) - 1],
+        "max": timings[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    mp_qr = _load_mp_qr()
+
+    print(f"{'payload':<12} {'mode':<6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for name, template in PAYLOADS.items():
+        payloads = [template.format(seq=i) for i in range(args.iterations)]
+        cold = _measure(mp_qr.render_qr_svg, payloads)
+        warm = _measure(mp_qr.render_qr_svg, [payloads[0]] * args.iterations)
+        size = len(mp_qr.render_qr_svg(payloads[0]))
+        for mode, result in (("cold", cold), ("warm", warm)):
+            print(f"{name:<12} {mode:<6} {result['mean']:>9.3f} {result['p50']:>9.3f} "
+                  f"{result['p95']:>9.3f} {result['max']:>9.3f}")
+        print(f"{name:<12} svg size: {size} bytes, payload: {len(payloads[0])} chars")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the MercadoPago API, for load tests and benchmarks.
+
+Implements the endpoints the module calls, with configurable latency, error
+and throttling profiles. Stdlib only.
+
+    python3 tools/mp_stub_server.py --port 8099 --latency 80 --jitter 40 \\
+        --pay-after 3 --webhook-url http://localhost:8069/mp/pos/webhook
+
+Point Odoo at it in odoo.conf:
+
+    mp_api_base_url = http://127.0.0.1:8099
+
+Endpoints:
+    GET    /users/me
+    POST   /checkout/preferences          (honours X-Idempotency-Key)
+    PUT    /checkout/preferences/{id}
+    GET    /v1/payments/search?external_reference=...&range=...&begin_date=...&offset=...
+    GET    /v1/payments/{id}
+    PUT    /instore/qr/seller/collectors/{user_id}/pos/{external_pos_id}/orders
+    DELETE /instore/qr/seller/collectors/{user_id}/pos/{external_pos_id}/orders
+
+    GET    /__stats     request counts per endpoint (used by bench_load.py)
+    POST   /__reset     clear counts, preferences and payments
+
+Every preference (or in-store order) gets an approved payment --pay-after
+seconds after its creation; with --webhook-url, a payment.created
+notification is posted to Odoo at that moment.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+USER_ID = 123456789
+
+ROUTES = [
+    ("GET", re.compile(r"^/users/me$"), "users_me"),
+    ("POST", re.compile(r"^/checkout/preferences$"), "create_preference"),
+    ("PUT", re.compile(r"^/checkout/preferences/(?P<id>[^/]+)$"), "update_preference"),
+    ("GET", re.compile(r"^/v1/payments/search$"), "search_payments"),
+    ("GET", re.compile(r"^/v1/payments/(?P<id>\d+)$"), "get_payment"),
+    ("PUT", re.compile(r"^/instore/qr/seller/collectors/\d+/pos/(?P<pos>[^/]+)/orders$"), "put_instore_order"),
+    ("DELETE", re.compile(r"^/instore/qr/seller/collectors/\d+/pos/(?P<pos>[^/]+)/orders$"), "delete_instore_order"),
+    ("GET", re.compile(r"^/__stats$"), "stats"),
+    ("POST", re.compile(r"^/__reset$"), "reset"),
+]
+
+
+def _mp_date(dt):
+    # MercadoPago format: "2024-01-01T12:00:00.000-04:00"
+    return dt.astimezone(timezone(timedelta(hours=-4))).isoformat(timespec="milliseconds")
+
+
+class StubState:
+    def __init__(self, options):
+        self.options = options
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = Counter()
+            self.preferences = {}   # id -> preference dict
+            self.idempotency = {}   # X-Idempotency-Key -> preference id
+            self.payments = {}      # id -> payment dict
+            self.by_reference = {}  # external_reference -> [payment ids]
+            self.next_payment_id = 1000000000
+
+    def schedule_payment(self, external_reference, amount, preference_id=None):
+        """Approve a payment for the preference/order after --pay-after seconds."""
+        if self.options.pay_after < 0:
+            return
+
+        def _pay():
+            with self.lock:
+                self.next_payment_id += 1
+                payment_id = self.next_payment_id
+                now = datetime.now(timezone.utc)
+                self.payments[payment_id] = {
+                    "id": payment_id,
+                    "status": "approved",
+                    "status_detail": "accredited",
+                    "date_created": _mp_date(now),
+                    "date_approved": _mp_date(now),
+                    "date_last_updated": _mp_date(now),
+                    "external_reference": external_reference,
+                    "preference_id": preference_id,
+                    "transaction_amount": amount,
+                    "currency_id": "ARS",
+                }
+                self.by_reference.setdefault(external_reference, []).append(payment_id)
+            if self.options.webhook_url:
+                self.send_webhook(payment_id)
+
+        timer = threading.Timer(self.options.pay_after, _pay)
+        timer.daemon = True
+        timer.start()
+
+    def send_webhook(self, payment_id):
+        body = json.dumps({
+            "id": random.randint(10 ** 10, 10 ** 11),
+            "action": "payment.created",
+            "type": "payment",
+            "data": {"id": str(payment_id)},
+        }).encode()
+        request = urllib.request.Request(
+            self.options.webhook_url, data=body, method="POST", headers={"Content-Type": "application/json"}
+        )
+        try:
+            urllib.request.urlopen(request, timeout=10).read()
+            with self.lock:
+                self.counts["webhook_sent"] += 1
+        except Exception as e:
+            with self.lock:
+                self.counts["webhook_failed"] += 1
+            print(f"webhook to {self.options.webhook_url} failed: {e}")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like api.mercadopago.com
+    state = None
+
+    def log_message(self, fmt, *args):
+        if self.state.options.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                break
+        else:
+            self._read_json()
+            return self._send(404, {"message": "not found", "error": "not_found", "status": 404})
+
+        body = self._read_json()
+        if not name.startswith("stats") and name != "reset":
+            with self.state.lock:
+                self.state.counts[name] += 1
+                self.state.counts["total"] += 1
+            if self._apply_profile():
+                return
+        return getattr(self, name)(match, parse_qs(url.query), body)
+
+    def _apply_profile(self):
+        """Simulated latency, throttling and server errors. Returns True if the response was sent."""
+        options = self.state.options
+        delay = max(0.0, random.gauss(options.latency, options.jitter)) / 1000
+        time.sleep(delay)
+        if random.random() < options.throttle_rate:
+            with self.state.lock:
+                self.state.counts["throttled"] += 1
+            self._send(429, {"message": "too many requests", "status": 429},
+                       headers={"Retry-After": str(options.retry_after)})
+            return True
+        if random.random() < options.error_rate:
+            with self.state.lock:
+                self.state.counts["errors"] += 1
+            self._send(500, {"message": "internal_error", "status": 500})
+            return True
+        return False
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def do_HEAD(self):
+        # Connection warm-up (MPClient.warm_up)
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    # Endpoints
+
+    def users_me(self, match, query, body):
+        self._send(200, {"id": USER_ID, "nickname": "TESTSTUB", "site_id": "MLA"})
+
+    def create_preference(self, match, query, body):
+        key = self.headers.get("X-Idempotency-Key")
+        with self.state.lock:
+            replayed = self.state.preferences.get(self.state.idempotency.get(key)) if key else None
+            if replayed:
+                self.state.counts["idempotent_replays"] += 1
+        if replayed:
+            return self._send(201, replayed)
+
+        preference_id = f"{USER_ID}-{uuid.uuid4()}"
+        preference = {
+            "id": preference_id,
+            "items": body.get("items", []),
+            "external_reference": body.get("external_reference"),
+            "init_point": f"https://www.mercadopago.com.ar/checkout/v1/redirect?pref_id={preference_id}",
+            "sandbox_init_point": f"https://sandbox.mercadopago.com.ar/checkout/v1/redirect?pref_id={preference_id}",
+            "date_created": _mp_date(datetime.now(timezone.utc)),
+        }
+        with self.state.lock:
+            self.state.preferences[preference_id] = preference
+            if key:
+                self.state.idempotency[key] = preference_id
+        amount = sum(item.get("unit_price", 0) * item.get("quantity", 1) for item in preference["items"])
+        self.state.schedule_payment(preference["external_reference"], amount, preference_id)
+        self._send(201, preference)
+
+    def update_preference(self, match, query, body):
+        with self.state.lock:
+            preference = self.state.preferences.get(match["id"])
+            if preference:
+                preference.update({key: value for key, value in body.items() if key != "id"})
+        if not preference:
+            return self._send(404, {"message": "preference not found", "status": 404})
+        self._send(200, preference)
+
+    def search_payments(self, match, query, body):
+        def _param(name, default=None):
+            return (query.get(name) or [default])[0]
+
+        reference = _param("external_reference")
+        with self.state.lock:
+            if reference:
+                ids = self.state.by_reference.get(reference, [])
+            else:
+                ids = list(self.state.payments)
+            results = [self.state.payments[payment_id] for payment_id in ids]
+
+        def _date(value):
+            # Absolute ISO dates, or "NOW" as MercadoPago accepts
+            return datetime.now(timezone.utc) if value == "NOW" else datetime.fromisoformat(value)
+
+        date_field = _param("range", "date_created")
+        begin, end = _param("begin_date"), _param("end_date")
+        if begin:
+            begin = _date(begin)
+            results = [p for p in results if datetime.fromisoformat(p[date_field]) >= begin]
+        if end:
+            end = _date(end)
+            results = [p for p in results if datetime.fromisoformat(p[date_field]) <= end]
+        results.sort(key=lambda payment: datetime.fromisoformat(payment[_param("sort", "date_created")]),
+                     reverse=_param("criteria", "desc") == "desc")
+        limit, offset = int(_param("limit", 30)), int(_param("offset", 0))
+        self._send(200, {
+            "paging": {"total": len(results), "limit": limit, "offset": offset},
+            "results": results[offset:offset + limit],
+        })
+
+    def get_payment(self, match, query, body):
+        with self.state.lock:
+            payment = self.state.payments.get(int(match["id"]))
+        if not payment:
+            return self._send(404, {"message": "Payment not found", "status": 404})
+        self._send(200, payment)
+
+    def put_instore_order(self, match, query, body):
+        self.state.schedule_payment(body.get("external_reference"), body.get("total_amount", 0))
+        self._send(204)
+
+    def delete_instore_order(self, match, query, body):
+        self._send(204)
+
+    def stats(self, match, query, body):
+        with self.state.lock:
+            counts = dict(self.state.counts)
+            counts.update(preferences=len(self.state.preferences), payments=len(self.state.payments))
+        self._send(200, counts)
+
+    def reset(self, match, query, body):
+        self.state.reset()
+        self._send(200, {"status": "ok"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=80.0, help="mean response latency (ms)")
+    parser.add_argument("--jitter", type=float, default=30.0, help="latency standard deviation (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses (0-1)")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of 429 responses (0-1)")
+    parser.add_argument("--retry-after", type=int, default=5, help="Retry-After of 429 responses (s)")
+    parser.add_argument("--pay-after", type=float, default=3.0,
+                        help="seconds until a preference is paid (negative: never)")
+    parser.add_argument("--webhook-url", help="Odoo /mp/pos/webhook URL notified of each payment")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    StubHandler.state = StubState(args)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    print(f"MercadoPago stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()